@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步任务执行器
+背景图片和输出目录位于较慢的网络存储上时，逐个任务 "读 → 渲染 → 写" 会让CPU
+大部分时间在等待I/O。这里用 asyncio 把三个阶段拆开并重叠执行：
+
+    读取 (I/O线程池，预读后续任务)  →  解码/叠加/文字/编码 (CPU执行器)  →  写出 (I/O线程池)
+
+- 读取和写出在线程池中并发进行，数量由 io_workers 控制
+- 渲染在有上限的执行器中进行: workers == 1 时在本进程的单个线程中渲染，
+  workers > 1 时使用进程池，每个工作进程只加载一次CSS，字体和图层缓存常驻
+- 背压: 预读队列有长度上限 (prefetch)，已读入和待写出的字节总数不超过
+  max_inflight_bytes，超出时暂停读取，内存占用保持在上限以内
+
+同一个队列中可以混合两种任务:
+    元素叠加 / 流水线: {"background_path", "element_path", "output_path", 可选 "texts", "position", ...}
+    封面文字:         {"image_path", "output_path", "texts"}
+元素叠加的结果与 overlay_images.py / pipeline.py 一致，封面文字的结果与 create_cover 一致。
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import image_io
+import instrumentation
+import overlay_images
+import style_cache
+from stable_script import add_font_arguments, load_manifest, render_cover, resolve_font_paths
+
+DEFAULT_IO_WORKERS = 8
+DEFAULT_PREFETCH = 8
+DEFAULT_MAX_INFLIGHT_BYTES = 256 * 1024 * 1024
+
+# 可以按任务单独指定、否则使用 run_async 参数的渲染选项
+RENDER_OPTIONS = ('position', 'opacity', 'scale_factor', 'preset', 'quality', 'max_width', 'memory_budget')
+
+
+class _ByteBudget:
+    """
+    在途字节数的上限：读取前申请，写出后归还
+
+    单个任务超过上限时，只要没有其他在途数据也允许通过，避免卡死
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self._add(size)
+
+    def force(self, size):
+        """不等待直接占用，用于渲染产出的编码结果 (写出不能被读取阻塞)"""
+        self._add(size)
+
+    def _add(self, size):
+        self.used += size
+        self.peak = max(self.peak, self.used)
+
+    async def release(self, size):
+        async with self._changed:
+            self.used -= size
+            self._changed.notify_all()
+
+
+def _source_path(job):
+    return job.get('background_path') or job['image_path']
+
+
+def _read_file(path):
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+    return data, round((time.perf_counter() - start) * 1000, 2)
+
+
+def _write_file(path, data):
+    """先写临时文件再替换，写到一半失败不会留下残缺的输出"""
+    start = time.perf_counter()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+# 渲染执行器内常驻的状态，由 _init_worker 填充一次
+_worker_state = {}
+
+
+def _init_worker(style_css, font_paths, options, trace_settings=None):
+    """渲染执行器初始化函数：只解析一次CSS，字体、元素和文字图层在进程内缓存"""
+    instrumentation.init_worker(trace_settings)
+    _worker_state['styles'] = style_cache.load_styles(style_css) if style_css else None
+    _worker_state['font_paths'] = font_paths
+    _worker_state['options'] = options
+
+
+def _render_encoded(job, data):
+    """
+    在内存中完成一个任务：解码 → (叠加元素) → (渲染文字) → 编码
+
+    Returns:
+        tuple: (编码后的字节, 统计字典)
+    """
+    options = dict(_worker_state['options'])
+    options.update((key, job[key]) for key in RENDER_OPTIONS if key in job)
+    stats = {}
+    source_path = _source_path(job)
+    with instrumentation.image_scope('async', image_path=source_path, output_path=job['output_path']) as scope:
+        with instrumentation.span('decode'):
+            image = image_io.open_image(io.BytesIO(data), options.get('max_width'), stats)
+        if job.get('element_path'):
+            position = overlay_images.parse_position(options.get('position', 'center'))
+            overlay_images.overlay_element(image, job['element_path'], position,
+                                           options.get('opacity', 1.0), options.get('scale_factor', 1.0),
+                                           options.get('memory_budget'))
+        if job.get('texts'):
+            if not _worker_state['styles']:
+                raise ValueError('任务包含封面文字，但没有可用的CSS样式')
+            render_cover(image, job['texts'], _worker_state['styles'], _worker_state['font_paths'],
+                         memory_budget=options.get('memory_budget'))
+        # 元素叠加的结果与 overlay_images.py 一样去掉透明通道
+        if job.get('element_path') and image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        buffer = io.BytesIO()
+        with instrumentation.span('encode'):
+            image_io.save_image(image, buffer, image_io.output_format(job['output_path'], 'JPEG'),
+                                options.get('preset'), options.get('quality'), stats)
+        scope.set(success=True)
+    stats.pop('source_size', None)
+    return buffer.getvalue(), stats
+
+
+async def run_async(jobs, style_css=None, font_paths=None, workers=1, io_workers=DEFAULT_IO_WORKERS,
+                    prefetch=DEFAULT_PREFETCH, max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES,
+                    on_result=None, **options):
+    """
+    异步执行任务，读取、渲染和写出三个阶段重叠进行
+
+    Args:
+        jobs: 任务列表 (格式见模块说明)
+        style_css: CSS样式文件路径，任务中有封面文字时必需
+        font_paths: 字体路径字典，任务中有封面文字时必需
+        workers: 渲染并发数，0表示使用全部CPU核心
+        io_workers: 并发读写的线程数
+        prefetch: 已读入、等待渲染的任务数上限
+        max_inflight_bytes: 已读入和待写出的数据总字节数上限
+        on_result: (可选) 每个任务完成时调用 on_result(result)
+        options: 渲染选项的默认值 (position, opacity, scale_factor, preset, quality, max_width,
+                 memory_budget)，任务中的同名字段优先
+
+    Returns:
+        dict: 统计信息，包含 results (按完成顺序)、elapsed 和在途字节数的峰值 peak_inflight_bytes
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+
+    io_pool = ThreadPoolExecutor(io_workers, thread_name_prefix='cover-io')
+    initargs = (style_css, font_paths, options, instrumentation.settings())
+    if workers == 1:
+        # 单个渲染线程，与读写线程共享本进程的字体和图层缓存
+        _init_worker(*initargs)
+        cpu_pool = ThreadPoolExecutor(1, thread_name_prefix='cover-render')
+    else:
+        cpu_pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs)
+
+    budget = _ByteBudget(max_inflight_bytes)
+    ready = asyncio.Queue(maxsize=max(1, prefetch))
+    write_slots = asyncio.Semaphore(io_workers)
+    pending_jobs = iter(enumerate(jobs))
+    writes = set()
+    results = []
+
+    def finish(result):
+        results.append(result)
+        if result['success']:
+            print(f"✓ 成功生成: {result['output_path']}")
+        else:
+            print(f"✗ 处理失败 {result['output_path']}: {result['error']}")
+        if on_result is not None:
+            on_result(result)
+
+    def new_result(index, job):
+        return {'index': index, 'line': job.get('line'), 'output_path': job.get('output_path'),
+                'success': False, 'error': None}
+
+    async def reader():
+        for index, job in pending_jobs:
+            try:
+                if job.get('error'):
+                    # 清单中无法解析的行 (见 stable_script.load_manifest)
+                    raise ValueError(f"第 {job['line']} 行: {job['error']}")
+                size = await loop.run_in_executor(io_pool, os.path.getsize, _source_path(job))
+                await budget.acquire(size)
+                try:
+                    data, read_ms = await loop.run_in_executor(io_pool, _read_file, _source_path(job))
+                except BaseException:
+                    await budget.release(size)
+                    raise
+            except Exception as e:
+                result = new_result(index, job)
+                result['error'] = f"{type(e).__name__}: {e}"
+                finish(result)
+                continue
+            await ready.put((index, job, data, size, read_ms))
+
+    async def write(result, data):
+        try:
+            result['write_ms'] = await loop.run_in_executor(io_pool, _write_file, result['output_path'], data)
+            result['success'] = True
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            await budget.release(len(data))
+            write_slots.release()
+        finish(result)
+
+    async def renderer():
+        while True:
+            item = await ready.get()
+            if item is None:
+                return
+            index, job, data, size, read_ms = item
+            result = new_result(index, job)
+            result['read_ms'] = read_ms
+            try:
+                render_start = time.perf_counter()
+                encoded, stats = await loop.run_in_executor(cpu_pool, _render_encoded, job, data)
+                result['render_ms'] = round((time.perf_counter() - render_start) * 1000, 2)
+                result.update(stats)
+            except Exception as e:
+                result['error'] = f"{type(e).__name__}: {e}"
+                finish(result)
+                continue
+            finally:
+                item = data = None
+                await budget.release(size)
+
+            # 写出并发数已满时等待，渲染结果不会无限堆积
+            await write_slots.acquire()
+            budget.force(len(encoded))
+            task = asyncio.ensure_future(write(result, encoded))
+            writes.add(task)
+            task.add_done_callback(writes.discard)
+
+    try:
+        readers = [asyncio.ensure_future(reader()) for _ in range(io_workers)]
+        renderers = [asyncio.ensure_future(renderer()) for _ in range(workers)]
+        await asyncio.gather(*readers)
+        for _ in renderers:
+            await ready.put(None)
+        await asyncio.gather(*renderers)
+        if writes:
+            await asyncio.gather(*writes)
+    finally:
+        cpu_pool.shutdown()
+        io_pool.shutdown()
+
+    return {
+        'results': results,
+        'elapsed': time.perf_counter() - start,
+        'peak_inflight_bytes': budget.peak,
+    }
+
+
+def run_jobs(jobs, style_css=None, font_paths=None, workers=1, **kwargs):
+    """run_async 的同步入口，参数相同"""
+    return asyncio.run(run_async(jobs, style_css, font_paths, workers, **kwargs))
+
+
+def print_summary(summary):
+    """打印 run_async 返回的统计信息"""
+    results = summary['results']
+    succeeded = [r for r in results if r['success']]
+    elapsed = summary['elapsed']
+    throughput = len(results) / elapsed if elapsed > 0 else 0.0
+    print("-" * 50)
+    print(f"处理完成! 成功生成 {len(succeeded)}/{len(results)} 张图片")
+    print(f"总耗时 {elapsed:.2f}s, 吞吐量 {throughput:.1f} 张/秒, "
+          f"在途数据峰值 {summary['peak_inflight_bytes'] / 1024 / 1024:.1f}MB")
+    if succeeded:
+        count = len(succeeded)
+        print(f"平均读取 {sum(r['read_ms'] for r in succeeded) / count:.1f}ms, "
+              f"平均解码 {sum(r['decode_ms'] for r in succeeded) / count:.1f}ms, "
+              f"平均编码 {sum(r['encode_ms'] for r in succeeded) / count:.1f}ms, "
+              f"平均写出 {sum(r['write_ms'] for r in succeeded) / count:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='异步执行封面/元素叠加任务：读写与渲染重叠进行')
+    parser.add_argument('--manifest', required=True,
+                        help='任务清单 (JSONL 或 CSV)，每个任务包含 image_path 或 background_path (及 element_path)、'
+                             'output_path 和可选的 texts')
+    parser.add_argument('--style_css', default=None, help='CSS样式文件路径，任务中有封面文字时必需')
+    add_font_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1, help='渲染并发数，0表示使用全部CPU核心 (默认: 1)')
+    parser.add_argument('--io_workers', type=int, default=DEFAULT_IO_WORKERS,
+                        help=f'并发读写的线程数 (默认: {DEFAULT_IO_WORKERS})')
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH,
+                        help=f'预读的任务数上限 (默认: {DEFAULT_PREFETCH})')
+    parser.add_argument('--max_inflight_mb', type=int, default=DEFAULT_MAX_INFLIGHT_BYTES // 1024 // 1024,
+                        help='已读入和待写出的数据总量上限，MB (默认: 256)')
+    parser.add_argument('--position', type=str, default='center',
+                        help='元素位置的默认值 (center, top-left, top-right, bottom-left, bottom-right, 或 x,y 坐标)')
+    parser.add_argument('--opacity', type=float, default=1.0, help='元素透明度的默认值 (0.0-1.0)')
+    parser.add_argument('--resize_factor', type=float, default=1.0, help='元素缩放因子的默认值 (0.1-2.0)')
+    parser.add_argument('--max_width', type=int, default=None, help='(可选) 输出的最大宽度')
+    parser.add_argument('--preset', default=None, choices=sorted(image_io.ENCODER_PRESETS),
+                        help='(可选) 编码预设，默认使用 Pillow 的默认参数')
+    parser.add_argument('--quality', type=int, default=None, help='(可选) 有损格式的编码质量，覆盖预设中的值')
+    parser.add_argument('--memory_budget_mb', type=int, default=None,
+                        help='(可选) 单张图片的内存预算，MB；指定后按条带分块合成，输出不变')
+    parser.add_argument('--report', default=None, help='(可选) 逐个任务结果报告的输出路径 (JSONL)')
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.enable_from_args(args)
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"错误：读取任务清单失败 {args.manifest}: {e}")
+        sys.exit(1)
+    if not jobs:
+        print("警告: 任务清单为空")
+        sys.exit(1)
+
+    # 元素叠加任务与 overlay_images.py 一样，未指定质量和预设时使用 95
+    if args.quality is None and not args.preset:
+        for job in jobs:
+            if job.get('element_path'):
+                job.setdefault('quality', 95)
+
+    font_paths = None
+    if any(job.get('texts') for job in jobs):
+        if not args.style_css:
+            print("错误: 任务包含封面文字，请使用 --style_css 指定样式")
+            sys.exit(1)
+        font_paths = resolve_font_paths(args)
+        if not font_paths or not style_cache.load_styles(args.style_css):
+            sys.exit(1)
+
+    report_file = open(args.report, 'w', encoding='utf-8') if args.report else None
+
+    def write_report(result):
+        if report_file:
+            report_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    print(f"共 {len(jobs)} 个任务")
+    print("-" * 50)
+    try:
+        summary = run_jobs(
+            jobs, args.style_css, font_paths, args.workers,
+            io_workers=args.io_workers,
+            prefetch=args.prefetch,
+            max_inflight_bytes=args.max_inflight_mb * 1024 * 1024,
+            on_result=write_report,
+            position=overlay_images.parse_position(args.position),
+            opacity=args.opacity,
+            scale_factor=args.resize_factor,
+            max_width=args.max_width,
+            preset=args.preset,
+            quality=args.quality,
+            memory_budget=args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None,
+        )
+    finally:
+        if report_file:
+            report_file.close()
+
+    print_summary(summary)
+    if args.report:
+        print(f"结果报告已保存到: {args.report}")
+    if any(not r['success'] for r in summary['results']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准脚本
+用仓库自带的素材 (img-background 中的背景图、yezi.ttf / antuozongyi.ttf、guangshu_style.css)
+测量各个热点路径的耗时，输出JSON格式的结果，并可与保存的基线比较，变慢超过阈值时以非零状态退出。
+
+测量项目:
+    parse_css        解析并编译CSS (不使用缓存)
+    wrap_text        长文字的自动换行
+    text_layer       文字图层渲染 (背景块、描边/阴影、主文字)，不使用图层缓存，字形图集已预热
+    text_layer_cold  同上，但每次清空字形图集，所有字形重新光栅化
+    create_cover     完整的封面生成 (解码、渲染、编码)
+    overlay_<宽度>   不同尺寸背景上的元素叠加
+    extract_groups   从大量文件名中提取分组
+
+用法:
+    python benchmark.py --output bench.json                 # 运行并保存结果
+    python benchmark.py --save_baseline                     # 运行并更新基线
+    python benchmark.py --baseline benchmark_baseline.json  # 运行并与基线比较
+
+耗时与机器相关，仓库中不附带基线：先在当前机器上用 --save_baseline 生成，之后的运行才会检查回退。
+亚毫秒级的项目 (如 parse_css、wrap_text) 的抖动远超 --tolerance 的比例，变慢的绝对值
+不超过 --min_diff_ms 时不算回退。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image, ImageDraw
+
+import font_registry
+import glyph_atlas
+import style_cache
+import text_layer
+from extract_groups import extract_groups_from_filenames
+from overlay_images import overlay_images
+from stable_script import create_cover
+from text_wrap import wrap_text
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+
+# 变慢的绝对值不超过该值 (毫秒) 时不算回退，避免亚毫秒级项目的计时抖动触发回退
+DEFAULT_MIN_DIFF_MS = 0.5
+
+FIXTURE_BACKGROUND = os.path.join(BASE_DIR, 'img-background', '2.jpg')
+FIXTURE_CSS = os.path.join(BASE_DIR, 'guangshu_style.css')
+FIXTURE_FONTS = {
+    'main': os.path.join(BASE_DIR, 'yezi.ttf'),
+    'zongyi': os.path.join(BASE_DIR, 'antuozongyi.ttf'),
+    'english': os.path.join(BASE_DIR, 'yezi.ttf'),
+    'italic': '',
+}
+FIXTURE_TEXTS = ["一人公司神器", "Weclone", "喂给它聊天记录,克隆一个数字版的你自己 with some English words"]
+LONG_TEXT = "喂给它聊天记录，克隆一个数字版的你自己。Feed it your chat logs and clone a digital version of yourself! " * 8
+
+OVERLAY_WIDTHS = (720, 1440, 2880)
+
+
+def time_call(func, repeat, warmup=1):
+    """多次调用 func，返回耗时统计 (毫秒)"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'median_ms': round(statistics.median(samples), 3),
+        'min_ms': round(min(samples), 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+        'repeat': repeat,
+    }
+
+
+def _make_element(path, size=400):
+    """生成一个带半透明边缘的PNG元素，仓库中没有自带元素图片"""
+    element = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(element)
+    draw.ellipse((0, 0, size - 1, size - 1), fill=(255, 200, 0, 160))
+    draw.ellipse((size // 4, size // 4, size * 3 // 4, size * 3 // 4), fill=(20, 20, 200, 255))
+    element.save(path)
+
+
+def _make_backgrounds(work_dir):
+    """把固定的背景图缩放成多种宽度，返回 {宽度: 路径}"""
+    source = Image.open(FIXTURE_BACKGROUND).convert('RGB')
+    paths = {}
+    for width in OVERLAY_WIDTHS:
+        height = round(source.height * width / source.width)
+        path = os.path.join(work_dir, f"bg_{width}.jpg")
+        source.resize((width, height), Image.Resampling.LANCZOS).save(path, quality=90)
+        paths[width] = path
+    return paths
+
+
+def _make_group_files(directory, count):
+    """生成 count 个符合 {背景}_with_{分组}_{序号}.jpg 命名的空文件"""
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        name = f"{i % 500}_with_分组{i % 97}_{i}.jpg" if i % 10 else f"{i}_with_element{i % 13}.jpg"
+        open(os.path.join(directory, name), 'wb').close()
+
+
+def run_benchmarks(repeat=5, group_files=100000, only=None):
+    """
+    运行全部基准
+
+    Args:
+        repeat: 每项的计时次数 (extract_groups 固定为 max(1, repeat // 2) 次)
+        group_files: extract_groups 使用的文件数量
+        only: (可选) 只运行名称包含其中任意一个字符串的项目
+
+    Returns:
+        dict: {项目名: 耗时统计}
+    """
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='cover_bench_')
+
+    def selected(name):
+        return not only or any(part in name for part in only)
+
+    try:
+        styles = style_cache.load_styles(FIXTURE_CSS)
+        quiet = contextlib.redirect_stdout(io.StringIO())
+
+        if selected('parse_css'):
+            results['parse_css'] = time_call(
+                lambda: style_cache.compile_styles(style_cache.parse_css(FIXTURE_CSS)), repeat * 20)
+
+        if selected('wrap_text'):
+            font = font_registry.get_font(FIXTURE_FONTS['main'], 96)
+            results['wrap_text'] = time_call(lambda: wrap_text(LONG_TEXT, font, 1080), repeat * 4)
+
+        if selected('text_layer'):
+            results['text_layer'] = time_call(
+                lambda: text_layer.render_text_layer(FIXTURE_TEXTS, styles, FIXTURE_FONTS, 1440, 0.0), repeat)
+
+        if selected('text_layer_cold'):
+            def cold_layer():
+                glyph_atlas.clear()
+                text_layer.render_text_layer(FIXTURE_TEXTS, styles, FIXTURE_FONTS, 1440, 0.0)
+            results['text_layer_cold'] = time_call(cold_layer, repeat)
+
+        if selected('create_cover'):
+            output_path = os.path.join(work_dir, 'cover.jpg')
+
+            def cover():
+                text_layer.clear()
+                with quiet:
+                    create_cover(FIXTURE_BACKGROUND, output_path, FIXTURE_TEXTS, FIXTURE_CSS, FIXTURE_FONTS, styles)
+            results['create_cover'] = time_call(cover, repeat)
+
+        if selected('overlay'):
+            element_path = os.path.join(work_dir, 'element.png')
+            _make_element(element_path)
+            for width, background_path in _make_backgrounds(work_dir).items():
+                name = f"overlay_{width}"
+                if not selected(name):
+                    continue
+                output_path = os.path.join(work_dir, f"overlay_{width}.jpg")
+                with quiet:
+                    results[name] = time_call(
+                        lambda: overlay_images(background_path, element_path, output_path, opacity=0.8), repeat)
+
+        if selected('extract_groups'):
+            group_dir = os.path.join(work_dir, 'groups')
+            _make_group_files(group_dir, group_files)
+            with quiet:
+                results['extract_groups'] = time_call(
+                    lambda: extract_groups_from_filenames(group_dir), max(1, repeat // 2), warmup=0)
+            results['extract_groups']['files'] = group_files
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, tolerance, min_diff_ms=DEFAULT_MIN_DIFF_MS):
+    """
+    与基线比较中位数耗时
+
+    Returns:
+        list: 变慢超过 tolerance (比例)、且变慢超过 min_diff_ms 毫秒的项目，每项为 (名称, 基线ms, 当前ms)
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        # 规模不同 (如 --group_files 不同) 的结果不可比
+        if not previous or previous.get('files') != current.get('files'):
+            continue
+        slower_ms = current['median_ms'] - previous['median_ms']
+        if slower_ms > previous['median_ms'] * tolerance and slower_ms > min_diff_ms:
+            regressions.append((name, previous['median_ms'], current['median_ms']))
+    return regressions
+
+
+def print_table(results, baseline=None):
+    print(f"{'name':<16}{'median_ms':>12}{'min_ms':>12}{'baseline_ms':>12}{'change':>9}")
+    print("-" * 61)
+    for name, stats in results.items():
+        line = f"{name:<16}{stats['median_ms']:>12.2f}{stats['min_ms']:>12.2f}"
+        previous = (baseline or {}).get(name)
+        if previous and previous.get('files') == stats.get('files'):
+            change = stats['median_ms'] / previous['median_ms'] - 1
+            line += f"{previous['median_ms']:>12.2f}{change:>+9.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='封面渲染各热点路径的性能基准')
+    parser.add_argument('--repeat', type=int, default=5, help='每项的计时次数 (默认: 5)')
+    parser.add_argument('--group_files', type=int, default=100000, help='分组提取使用的文件数量 (默认: 100000)')
+    parser.add_argument('--only', default=None, help='(可选) 只运行名称包含这些字符串的项目，逗号分隔，如 wrap,overlay')
+    parser.add_argument('--output', default=None, help='(可选) 结果JSON的输出路径')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线JSON路径 (默认: benchmark_baseline.json)')
+    parser.add_argument('--save_baseline', action='store_true', help='把本次结果保存为新的基线')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许的变慢比例，超过则以状态1退出 (默认: 0.25)')
+    parser.add_argument('--min_diff_ms', type=float, default=DEFAULT_MIN_DIFF_MS,
+                        help=f'变慢不超过该毫秒数时不算回退，过滤亚毫秒级项目的抖动 (默认: {DEFAULT_MIN_DIFF_MS})')
+    args = parser.parse_args()
+
+    only = [part.strip() for part in args.only.split(',') if part.strip()] if args.only else None
+    results = run_benchmarks(args.repeat, args.group_files, only)
+    report = {'environment': environment(), 'results': results}
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+
+    if baseline is None and not args.save_baseline:
+        print(f"注意: 没有基线 {args.baseline}，本次只输出耗时，不检查性能回退")
+    print_table(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已保存到: {args.baseline}")
+        return
+
+    if baseline is None:
+        print(f"\n未找到基线 {args.baseline}，没有与基线比较；先在本机运行 --save_baseline 生成基线")
+        return
+
+    regressions = compare(results, baseline, args.tolerance, args.min_diff_ms)
+    threshold = f"{args.tolerance:.0%} 且 {args.min_diff_ms:g}ms"
+    if regressions:
+        print(f"\n性能回退 (超过 {threshold}):")
+        for name, previous, current in regressions:
+            print(f"  {name}: {previous:.2f}ms -> {current:.2f}ms")
+        sys.exit(1)
+    print(f"\n没有超过 {threshold} 的性能回退")
+
+
+if __name__ == '__main__':
+    main()
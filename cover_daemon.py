@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+封面常驻进程
+单次调用 stable_script.py 的大部分时间花在启动解释器、导入 Pillow 和加载字体上。
+常驻进程在启动时完成这些工作，再 fork 出若干个工作进程监听同一个本地 Unix socket；
+命令行通过很薄的客户端把参数转发给已经预热的工作进程，单张封面不再付出冷启动的开销。
+
+用法:
+    python cover_daemon.py start --style_css style.css --font_main main.ttf [--workers 2]
+    python cover_daemon.py render <stable_script.py 的参数>
+    python cover_daemon.py status
+    python cover_daemon.py stop
+
+render 的参数与 stable_script.py 完全相同，相对路径按客户端的当前目录解析；
+守护进程未运行时直接在当前进程内渲染，结果与调用 stable_script.py 一致。
+socket 路径默认为 $XDG_RUNTIME_DIR (或 /tmp) 下的 cover_daemon_<uid>.sock，
+可用环境变量 COVER_DAEMON_SOCKET 或 --socket 指定。
+
+客户端只导入标准库中的 json/os/socket/sys；Pillow 等模块只在守护进程和
+进程内渲染时才导入。
+"""
+
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+                                   f'cover_daemon_{os.getuid()}.sock')
+
+DEFAULT_WORKERS = 2
+
+# 单个请求/响应的最大字节数
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+# 工作进程读取请求、写回响应时单次收发的超时 (秒)，连上后不发送数据的客户端不会一直占住工作进程
+CONNECTION_TIMEOUT = 10
+
+
+def socket_path_from_env():
+    return os.environ.get('COVER_DAEMON_SOCKET') or DEFAULT_SOCKET_PATH
+
+
+# =============================================================================
+# 1. 客户端
+# =============================================================================
+def _recv_message(conn):
+    chunks = []
+    size = 0
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_MESSAGE_BYTES:
+            raise ValueError('消息过大')
+        chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def send_request(message, socket_path=None, timeout=None):
+    """
+    向守护进程发送一条消息并等待响应
+
+    Returns:
+        dict 或 None: 守护进程的响应，守护进程未运行时返回 None
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(timeout)
+    try:
+        try:
+            conn.connect(socket_path or socket_path_from_env())
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        conn.sendall(json.dumps(message, ensure_ascii=False).encode('utf-8'))
+        conn.shutdown(socket.SHUT_WR)
+        return _recv_message(conn)
+    finally:
+        conn.close()
+
+
+def render(argv, socket_path=None):
+    """
+    通过守护进程执行一次 stable_script.py，守护进程未运行时在当前进程内执行
+
+    Args:
+        argv: stable_script.py 的命令行参数
+
+    Returns:
+        int: 退出码
+    """
+    response = send_request({'command': 'render', 'argv': list(argv), 'cwd': os.getcwd()}, socket_path)
+    if response is None:
+        import stable_script
+        try:
+            stable_script.main(list(argv))
+        except SystemExit as e:
+            return _exit_code(e)
+        return 0
+    sys.stdout.write(response['output'])
+    sys.stdout.flush()
+    return response['returncode']
+
+
+def _exit_code(exit):
+    if exit.code is None:
+        return 0
+    if isinstance(exit.code, int):
+        return exit.code
+    print(exit.code, file=sys.stderr)
+    return 1
+
+
+# =============================================================================
+# 2. 工作进程
+# =============================================================================
+def _run_stable_script(argv, cwd):
+    """在工作进程中执行 stable_script.main，返回 (退出码, 捕获的输出)"""
+    import contextlib
+    import io
+    import traceback
+
+    import instrumentation
+    import stable_script
+
+    output = io.StringIO()
+    returncode = 0
+    previous_cwd = os.getcwd()
+    try:
+        os.chdir(cwd)
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            try:
+                stable_script.main(argv)
+            except SystemExit as e:
+                returncode = _exit_code(e)
+            except Exception:
+                traceback.print_exc()
+                returncode = 1
+    except OSError as e:
+        output.write(f"错误: 无法切换到工作目录 {cwd}: {e}\n")
+        returncode = 1
+    finally:
+        os.chdir(previous_cwd)
+        # 每个请求单独决定是否开启埋点，不影响同一工作进程的后续请求
+        instrumentation.disable()
+    return returncode, output.getvalue()
+
+
+def _handle_connection(conn, state):
+    stop = False
+    try:
+        message = _recv_message(conn)
+        command = message.get('command')
+        if command == 'render':
+            returncode, output = _run_stable_script(message.get('argv') or [], message.get('cwd') or '/')
+            state['requests'] += 1
+            response = {'returncode': returncode, 'output': output}
+        elif command == 'status':
+            response = {
+                'daemon_pid': os.getppid(),
+                'worker_pid': os.getpid(),
+                'worker_requests': state['requests'],
+                'workers': state['workers'],
+            }
+        elif command == 'stop':
+            stop = True
+            response = {'stopping': True}
+        else:
+            response = {'returncode': 2, 'output': f"错误: 未知的命令 {command}\n"}
+    except (ValueError, AttributeError) as e:
+        response = {'returncode': 2, 'output': f"错误: 无效的请求 {e}\n"}
+    conn.sendall(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+    if stop:
+        # 先回复客户端，再通知守护进程结束全部工作进程
+        import signal
+        os.kill(os.getppid(), signal.SIGTERM)
+
+
+def _worker_loop(listener, workers):
+    import signal
+    # Ctrl+C 由守护进程统一处理，工作进程不单独退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    state = {'requests': 0, 'workers': workers}
+    while True:
+        conn, _ = listener.accept()
+        try:
+            with conn:
+                conn.settimeout(CONNECTION_TIMEOUT)
+                _handle_connection(conn, state)
+        except OSError:
+            # 客户端提前断开，或超时未发送完请求 (socket.timeout)
+            pass
+
+
+# =============================================================================
+# 3. 守护进程
+# =============================================================================
+def _warm_up(style_css, font_paths, warm_sizes):
+    """导入渲染模块、编译样式并预加载字体，fork 出的工作进程直接继承"""
+    from PIL import Image
+
+    # stable_script 在渲染时才导入这些模块，在这里提前导入，fork 出的工作进程直接继承
+    import font_registry
+    import glyph_atlas  # noqa: F401
+    import image_io  # noqa: F401
+    import render_cache  # noqa: F401
+    import stable_script  # noqa: F401
+    import style_cache
+    import template_registry  # noqa: F401
+    import text_layer  # noqa: F401
+
+    Image.preinit()
+    if not style_cache.load_styles(style_css):
+        return False
+    if warm_sizes:
+        font_registry.warm_up(font_paths, warm_sizes)
+    return True
+
+
+def serve(socket_path, style_css, font_paths, workers=DEFAULT_WORKERS, warm_sizes=None):
+    """
+    启动守护进程：预热后 fork 出 workers 个工作进程，退出的工作进程会被重新拉起
+
+    收到 SIGTERM 或 Ctrl+C 时结束全部工作进程并删除 socket 文件。
+
+    Returns:
+        bool: 是否成功启动 (样式无法加载或 socket 已被占用时返回 False)
+    """
+    import signal
+
+    if not _warm_up(style_css, font_paths, warm_sizes):
+        return False
+    if send_request({'command': 'status'}, socket_path) is not None:
+        print(f"错误: 守护进程已在运行: {socket_path}")
+        return False
+
+    # 清理上次异常退出留下的 socket 文件
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    listener.listen(64)
+
+    children = set()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker_loop(listener, workers)
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"封面守护进程已启动: {socket_path} (工作进程 {workers} 个, PID {os.getpid()})", flush=True)
+    try:
+        for _ in range(workers):
+            spawn()
+        while True:
+            pid, _ = os.wait()
+            children.discard(pid)
+            print(f"警告: 工作进程 {pid} 已退出，重新启动", flush=True)
+            spawn()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        print("封面守护进程已停止", flush=True)
+    return True
+
+
+# =============================================================================
+# 4. 命令行接口
+# =============================================================================
+def _manage(argv):
+    import argparse
+
+    from stable_script import add_font_arguments, resolve_font_paths
+
+    parser = argparse.ArgumentParser(description='常驻的封面渲染进程 (Unix socket)')
+    parser.add_argument('command', choices=['start', 'stop', 'status'], help='start 启动, stop 停止, status 查看状态')
+    parser.add_argument('--socket', default=socket_path_from_env(), help=f'socket 路径 (默认: {DEFAULT_SOCKET_PATH})')
+    parser.add_argument('--style_css', default=None, help='start 时预先编译的 guangshu_style.css 文件路径')
+    add_font_arguments(parser)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'预先 fork 的工作进程数 (默认: {DEFAULT_WORKERS})')
+    parser.add_argument('--warm_sizes', default='', help='(可选) 启动时预加载的字号，逗号分隔，如 96,160')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        response = send_request({'command': 'status'}, args.socket, timeout=5)
+        if response is None:
+            print("守护进程未在运行")
+            return 1
+        print(json.dumps(response, ensure_ascii=False))
+        return 0
+    if args.command == 'stop':
+        if send_request({'command': 'stop'}, args.socket, timeout=5) is None:
+            print("守护进程未在运行")
+            return 1
+        print("守护进程已停止")
+        return 0
+
+    if not args.style_css:
+        parser.error('start 需要指定 --style_css')
+    font_paths = resolve_font_paths(args)
+    if not font_paths:
+        return 1
+    warm_sizes = [int(size) for size in args.warm_sizes.split(',') if size.strip()]
+    return 0 if serve(args.socket, os.path.abspath(args.style_css), font_paths, max(1, args.workers), warm_sizes) else 1
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # render 是交互式调用的热路径，不经过 argparse
+    if argv and argv[0] == 'render':
+        return render(argv[1:])
+    return _manage(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+排版模块
+在 720px 参考宽度下一次性计算文字块的排版：每行的样式、换行后的文字、
+文字边界框和相对文字块顶部的纵坐标。排版结果 (CoverLayout) 与图片尺寸无关，
+渲染到任意宽度时只需按比例投影，不再重新换行、测量。
+
+同一组文字渲染到不同尺寸的背景上时，排版只计算一次；结果按
+(文字, 样式, 字体) 缓存在进程内，超出容量后按LRU淘汰。
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+import font_registry
+import instrumentation
+from style_cache import line_style
+from text_wrap import wrap_text
+
+# CSS 中的像素值都以 720px 宽的封面为参考
+REFERENCE_WIDTH = 720.0
+
+# 背景块在文字四周留出的像素 (参考宽度下)
+BACKGROUND_PADDING = 20
+
+# ImageDraw 多行文字的行间距 (绝对像素，不随字号缩放)
+MULTILINE_SPACING = 4
+
+DEFAULT_MAX_LAYOUTS = 256
+
+# 单行的排版结果，坐标均为参考宽度下的数值
+LineLayout = namedtuple('LineLayout', [
+    'text',   # str, 换行后的文字 (用换行符分隔)
+    'style',  # style_cache.LineStyle, 该行的样式
+    'bbox',   # tuple, 文字在 (0, 0) 处绘制时的边界框 (left, top, right, bottom)
+    'y',      # float, 该行顶部相对文字块起始位置的纵坐标
+])
+
+# 整个文字块的排版结果
+CoverLayout = namedtuple('CoverLayout', ['texts', 'lines'])
+
+_layouts = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_max_layouts = DEFAULT_MAX_LAYOUTS
+
+# 仅用于测量文字尺寸，不会在上面绘制
+_measure_draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+
+def load_line_font(style, font_size, font_paths):
+    """按行样式从字体注册表获取字体，斜体可用时不再加载常规字体"""
+    font = None
+    if style.italic and font_paths.get('italic'):
+        try:
+            font = font_registry.get_font(font_paths['italic'], font_size, 'italic')
+        except IOError:
+            print(f"警告：斜体字体 at {font_paths['italic']} 未找到。")
+
+    if font is None:
+        font_path = font_paths.get(style.font_role) or font_paths['main']
+        try:
+            font = font_registry.get_font(font_path, font_size)
+        except IOError:
+            print(f"错误：字体文件未找到 at {font_path}。请检查路径。")
+            font = ImageFont.load_default()
+    return font
+
+
+def _line_advance(font):
+    """ImageDraw 多行文字相邻两行的纵向距离；字体的度量不随字号线性缩放，需按实际字号计算"""
+    return font.getbbox('A')[3] + MULTILINE_SPACING
+
+
+def compute_layout(texts, styles, font_paths, prewrapped=False):
+    """
+    在参考宽度下计算文字块的排版
+
+    Args:
+        texts: 各行文字
+        styles: style_cache.load_styles 编译好的样式
+        font_paths: 字体路径字典
+        prewrapped: 文字是否已经换好行 (此时不再自动换行)
+
+    Returns:
+        CoverLayout: 排版结果
+    """
+    current_y = 0
+    lines = []
+    for i, text in enumerate(texts):
+        line_num = i + 1
+        style = line_style(styles, line_num)
+        with instrumentation.span('font_load', line=line_num):
+            font = load_line_font(style, style.font_size, font_paths)
+
+        # --- 处理换行 ---
+        if style.width_percent and not prewrapped:
+            with instrumentation.span('wrap', line=line_num):
+                text = "\n".join(wrap_text(text, font, REFERENCE_WIDTH * (style.width_percent / 100.0)))
+
+        # --- 测量文字尺寸 ---
+        instrumentation.count('textbbox')
+        bbox = _measure_draw.textbbox((0, 0), text, font=font, align="center")
+
+        # --- 纵向位置: 上一行的行高加上本行的上边距 ---
+        margin_top = style.margin_top + style.margin
+        if i == 0:
+            current_y += margin_top
+        else:
+            current_y += line_style(styles, i).font_size * style.line_height + margin_top
+
+        lines.append(LineLayout(text, style, bbox, current_y))
+    return CoverLayout(tuple(texts), tuple(lines))
+
+
+def get_layout(texts, styles, font_paths, prewrapped=False):
+    """获取排版结果，命中缓存时不再重新换行、测量"""
+    key = (tuple(texts), styles, tuple(sorted(font_paths.items())), prewrapped)
+    with _lock:
+        layout = _layouts.get(key)
+        if layout is not None:
+            _layouts.move_to_end(key)
+            _stats['hits'] += 1
+            instrumentation.count('layout_cache_hits')
+            return layout
+        _stats['misses'] += 1
+
+    layout = compute_layout(texts, styles, font_paths, prewrapped)
+
+    with _lock:
+        _layouts[key] = layout
+        _layouts.move_to_end(key)
+        while len(_layouts) > _max_layouts:
+            _layouts.popitem(last=False)
+            _stats['evictions'] += 1
+    return layout
+
+
+def project(layout, font_paths, img_width, start_y):
+    """
+    把参考宽度下的排版按比例投影到指定宽度
+
+    Args:
+        layout: compute_layout / get_layout 返回的排版结果
+        font_paths: 字体路径字典 (用于获取目标字号的字体)
+        img_width: 图片宽度
+        start_y: 文字块的起始纵坐标
+
+    Returns:
+        list: 每行一个字典，包含绘制所需的字体、文字、坐标、背景块和阴影
+    """
+    scale_factor = img_width / REFERENCE_WIDTH
+    lines = []
+    for line_num, line in enumerate(layout.lines, 1):
+        style = line.style
+        with instrumentation.span('font_load', line=line_num):
+            font = load_line_font(style, int(style.font_size * scale_factor), font_paths)
+
+        ref_left, ref_top, ref_right, ref_bottom = line.bbox
+        text_left, text_top = ref_left * scale_factor, ref_top * scale_factor
+        text_width = (ref_right - ref_left) * scale_factor
+        text_height = (ref_bottom - ref_top) * scale_factor
+        breaks = line.text.count("\n")
+        if breaks:
+            # 多行文字的行距按目标字号的实际度量计算，其余部分按比例缩放
+            ref_font = load_line_font(style, style.font_size, font_paths)
+            text_height = ((ref_bottom - ref_top - breaks * _line_advance(ref_font)) * scale_factor
+                           + breaks * _line_advance(font))
+        x_start = (img_width - text_width) / 2
+        y_start = start_y + line.y * scale_factor
+
+        # --- 背景块 (针对line3) ---
+        bg_box = None
+        if style.background_color:
+            padding = int(BACKGROUND_PADDING * scale_factor)
+            bg_box = [x_start - padding, y_start - padding,
+                      x_start + text_width + padding, y_start + text_height + padding]
+
+        lines.append({
+            'text': line.text,
+            'font': font,
+            'color': style.color,
+            'draw_x': x_start - text_left,
+            'draw_y': y_start - text_top,
+            'top': y_start,
+            'bottom': y_start + text_height,
+            'background_color': style.background_color,
+            'bg_box': bg_box,
+            'shadows': [(int(x * scale_factor), int(y * scale_factor), blur * scale_factor, color)
+                        for x, y, blur, color in style.shadows],
+        })
+    return lines
+
+
+def set_max_layouts(max_layouts):
+    """调整缓存容量，多余的排版结果会立即被淘汰"""
+    global _max_layouts
+    with _lock:
+        _max_layouts = max(1, int(max_layouts))
+        while len(_layouts) > _max_layouts:
+            _layouts.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def cache_info():
+    """返回排版缓存统计：命中、未命中、淘汰次数以及当前缓存的排版数量"""
+    with _lock:
+        info = dict(_stats)
+        info['size'] = len(_layouts)
+        info['max_size'] = _max_layouts
+    return info
+
+
+def clear():
+    """清空排版缓存和统计"""
+    with _lock:
+        _layouts.clear()
+        for key in _stats:
+            _stats[key] = 0
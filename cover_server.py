@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+封面渲染服务
+常驻进程形式的本地HTTP服务：CSS和字体在工作进程中常驻，避免每次请求都
+启动解释器、重新加载字体。并发请求会被合并成小批次交给工作进程池处理。
+
+接口:
+    POST /render   请求体为JSON，返回编码后的图片字节
+        {
+            "texts": ["第一行", "第二行", "第三行"],
+            "image_path": "/path/to/bg.jpg",      # 或 "image_base64": "..."
+            "style_css": "/path/to/style.css",    # (可选) 默认使用服务启动时指定的CSS
+            "template": "name",                   # (可选) 使用 --templates 预编译的模板 (样式和字体)
+            "format": "jpeg",                     # (可选) jpeg / png / webp / avif，默认 jpeg
+            "preset": "web",                      # (可选) image_io.ENCODER_PRESETS 中的编码预设
+            "quality": 95,                        # (可选) 有损格式的编码质量
+            "max_width": 1080                     # (可选) 输出的最大宽度
+        }
+        响应头 X-Decode-Ms / X-Encode-Ms 为本次请求的解码、编码耗时
+    GET /metrics   返回JSON格式的请求数、错误数、p50/p99延迟和队列深度
+    GET /health    健康检查，进程池损坏 (工作进程被杀死或崩溃) 时返回 503 并重建进程池
+
+只依赖标准库和Pillow，可在无网络的单机上运行。
+"""
+
+import argparse
+import base64
+import collections
+import io
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import font_registry
+import image_io
+import style_cache
+import template_registry
+from stable_script import add_font_arguments, render_cover, resolve_font_paths
+
+CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+# 每个请求的最大请求体 (字节)，防止误传超大文件拖垮服务
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# 请求中整数参数的取值范围 (含两端)
+INT_RANGES = {
+    'max_width': (1, 16384),
+    'quality': (1, 100),
+}
+
+# =============================================================================
+# 1. 工作进程
+# =============================================================================
+_worker_state = {}
+
+
+def _init_worker(style_css, font_paths, warm_sizes, templates=()):
+    """工作进程初始化：预编译默认样式和全部模板，并预加载常用字号的字体"""
+    # fork 出的工作进程继承了主进程停止服务的 SIGTERM 处理函数，恢复默认行为，
+    # 进程池损坏时 ProcessPoolExecutor 才能用 terminate() 结束残留的工作进程
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _worker_state['style_css'] = style_css
+    _worker_state['font_paths'] = font_paths
+    style_cache.load_styles(style_css)
+    template_registry.install(templates)
+    if warm_sizes:
+        font_registry.warm_up(font_paths, warm_sizes)
+
+
+def validate_request(request):
+    """
+    在提交给工作进程之前检查请求参数的类型和范围
+
+    Raises:
+        ValueError: 请求参数无效
+    """
+    for key, (low, high) in INT_RANGES.items():
+        value = request.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+            raise ValueError(f'{key} 必须是 {low} 到 {high} 之间的整数，收到: {value!r}')
+
+
+def render_request(request, style_css, font_paths, stats=None):
+    """
+    渲染单个请求
+
+    Args:
+        stats: (可选) 统计字典，写入 decode_ms, encode_ms, output_bytes
+
+    Returns:
+        tuple: (content_type, 图片字节)
+
+    Raises:
+        ValueError: 请求参数无效
+    """
+    texts = request.get('texts')
+    if not isinstance(texts, list) or not texts:
+        raise ValueError('texts 必须是非空的字符串列表')
+
+    if request.get('template'):
+        template = template_registry.get_template(request['template'])
+        styles, font_paths = template.styles, template.font_paths
+    else:
+        styles = style_cache.load_styles(request.get('style_css') or style_css)
+    if not styles:
+        raise ValueError('样式文件无法加载')
+
+    if request.get('image_base64'):
+        source = io.BytesIO(base64.b64decode(request['image_base64']))
+    elif request.get('image_path'):
+        source = request['image_path']
+    else:
+        raise ValueError('缺少 image_path 或 image_base64')
+
+    output_format = str(request.get('format', 'jpeg')).lower()
+    if output_format == 'jpg':
+        output_format = 'jpeg'
+    if output_format not in CONTENT_TYPES:
+        raise ValueError(f'不支持的输出格式: {output_format}')
+
+    preset = request.get('preset')
+    quality = request.get('quality')
+    if quality is None and not preset:
+        quality = 95
+
+    image = image_io.open_image(source, request.get('max_width'), stats)
+    render_cover(image, texts, styles, font_paths)
+
+    if output_format != 'png' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image_io.save_image(image, buffer, output_format, preset, quality, stats)
+    return CONTENT_TYPES[output_format], buffer.getvalue()
+
+
+def _render_batch(requests):
+    """在工作进程中渲染一个批次，逐个返回 (ok, content_type 或错误信息, 图片字节, 统计)"""
+    results = []
+    for request in requests:
+        stats = {}
+        try:
+            content_type, data = render_request(request, _worker_state['style_css'], _worker_state['font_paths'], stats)
+            results.append((True, content_type, data, stats))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}", None, stats))
+    return results
+
+
+# =============================================================================
+# 2. 请求合批与调度
+# =============================================================================
+class MicroBatcher:
+    """
+    把并发到达的请求合并成小批次提交给进程池
+
+    一个批次在凑满 batch_size 个请求，或第一个请求等待超过 batch_window 秒后提交。
+    合批只用于分摊调度和进程间通信的开销：提交时批次按空闲工作进程数 (没有空闲时按
+    工作进程总数) 切分，每一份交给一个工作进程，同一批次的请求并行渲染。
+
+    工作进程被杀死 (如 OOM) 或崩溃后进程池不可再用 (BrokenProcessPool)：正在处理的请求失败，
+    进程池用相同的 initargs 重建，之后的请求照常处理。
+    """
+
+    def __init__(self, workers, initargs, batch_size=8, batch_window=0.005):
+        self.workers = workers
+        self.initargs = initargs
+        self.executor = self._new_executor()
+        self.restarts = 0
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.pending = queue.Queue()
+        self.in_flight = 0
+        self.busy = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        future = Future()
+        self.pending.put((request, future))
+        return future
+
+    def queue_depth(self):
+        with self.lock:
+            return self.pending.qsize() + self.in_flight
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=self.initargs)
+
+    def is_broken(self):
+        """进程池是否已损坏 (ProcessPoolExecutor 在工作进程异常退出时设置 _broken)"""
+        with self.lock:
+            return bool(getattr(self.executor, '_broken', False))
+
+    def restart(self, broken_executor):
+        """重建损坏的进程池；broken_executor 已被替换时 (其他线程先重建了) 什么也不做"""
+        with self.lock:
+            if self.executor is not broken_executor:
+                return
+            self.executor = self._new_executor()
+            self.restarts += 1
+        print(f"工作进程池已损坏，已重建 (第 {self.restarts} 次)", flush=True)
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self.lock:
+            executor = self.executor
+        executor.shutdown(cancel_futures=True)
+
+    def _submit(self, chunk):
+        requests = [request for request, _ in chunk]
+        with self.lock:
+            executor = self.executor
+        try:
+            batch_future = executor.submit(_render_batch, requests)
+        except BrokenProcessPool:
+            # 上一批请求处理时进程池已经损坏，重建后重新提交一次
+            self.restart(executor)
+            with self.lock:
+                executor = self.executor
+            batch_future = executor.submit(_render_batch, requests)
+        return executor, batch_future
+
+    def _dispatch_loop(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            with self.lock:
+                self.in_flight += len(batch)
+                idle = self.workers - self.busy
+            for chunk in self._split(batch, idle if idle > 0 else self.workers):
+                with self.lock:
+                    self.busy += 1
+                try:
+                    executor, batch_future = self._submit(chunk)
+                except Exception as e:
+                    self._finish(chunk, None, e)
+                    continue
+                batch_future.add_done_callback(
+                    lambda f, chunk=chunk, executor=executor: self._finish(chunk, f, None, executor))
+
+    @staticmethod
+    def _split(batch, parts):
+        """把批次按顺序切成最多 parts 份，各份大小相差不超过1"""
+        parts = max(1, min(parts, len(batch)))
+        size, extra = divmod(len(batch), parts)
+        start = 0
+        for index in range(parts):
+            end = start + size + (1 if index < extra else 0)
+            yield batch[start:end]
+            start = end
+
+    def _finish(self, batch, batch_future, error, executor=None):
+        with self.lock:
+            self.in_flight -= len(batch)
+            self.busy -= 1
+        if error is None:
+            error = batch_future.exception()
+        if isinstance(error, BrokenProcessPool) and executor is not None:
+            self.restart(executor)
+        for index, (_, future) in enumerate(batch):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(batch_future.result()[index])
+
+
+class LatencyStats:
+    """记录最近的请求延迟，计算分位数"""
+
+    def __init__(self, window=4096):
+        self.samples = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, elapsed_ms, ok):
+        with self.lock:
+            self.samples.append(elapsed_ms)
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            samples = sorted(self.samples)
+            requests, errors = self.requests, self.errors
+
+        def percentile(p):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2)
+
+        return {
+            'requests': requests,
+            'errors': errors,
+            'p50_ms': percentile(0.50),
+            'p99_ms': percentile(0.99),
+        }
+
+
+# =============================================================================
+# 3. HTTP 接口
+# =============================================================================
+class CoverRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'CoverServer/1.0'
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            batcher = self.server.batcher
+            if batcher.is_broken():
+                # 报告损坏的状态，同时重建进程池，之后的检查恢复正常
+                with batcher.lock:
+                    executor = batcher.executor
+                batcher.restart(executor)
+                self._send_json(503, {'status': 'broken', 'restarts': batcher.restarts})
+            else:
+                self._send_json(200, {'status': 'ok', 'restarts': batcher.restarts})
+        elif self.path == '/metrics':
+            metrics = self.server.stats.snapshot()
+            metrics['queue_depth'] = self.server.batcher.queue_depth()
+            metrics['workers'] = self.server.workers
+            metrics['pool_restarts'] = self.server.batcher.restarts
+            self._send_json(200, metrics)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        start = time.perf_counter()
+        ok = False
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length <= 0 or length > MAX_BODY_BYTES:
+                self._send_json(400, {'error': '请求体为空或过大'})
+                return
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise ValueError('请求体必须是JSON对象')
+            validate_request(request)
+
+            ok, content_type, data, stats = self.server.batcher.submit(request).result()
+            if not ok:
+                self._send_json(400, {'error': content_type})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('X-Decode-Ms', str(stats.get('decode_ms')))
+            self.send_header('X-Encode-Ms', str(stats.get('encode_ms')))
+            self.end_headers()
+            self.wfile.write(data)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+        finally:
+            self.server.stats.record((time.perf_counter() - start) * 1000, ok)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(host, port, style_css, font_paths, workers=0, batch_size=8, batch_window_ms=5,
+                  warm_sizes=None, verbose=False, templates=()):
+    """
+    创建HTTP服务及其工作进程池，调用方负责 serve_forever 和关闭
+
+    templates 为 template_registry.templates() 返回的模板，每个工作进程启动时注册一次
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    initargs = (style_css, font_paths, warm_sizes or [], list(templates))
+    server = ThreadingHTTPServer((host, port), CoverRequestHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(workers, initargs, batch_size, batch_window_ms / 1000.0)
+    server.stats = LatencyStats()
+    server.workers = workers
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻的封面渲染HTTP服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口 (默认: 8765)')
+    parser.add_argument('--style_css', required=True, help='默认使用的 guangshu_style.css 文件路径')
+    add_font_arguments(parser)
+    parser.add_argument('--templates', default=None,
+                        help='(可选) 模板目录或JSON清单，启动时预编译全部模板，请求可用 template 字段按名称选择')
+    parser.add_argument('--workers', type=int, default=0, help='工作进程数，0表示使用全部CPU核心 (默认: 0)')
+    parser.add_argument('--batch_size', type=int, default=8, help='每个批次最多合并的请求数 (默认: 8)')
+    parser.add_argument('--batch_window_ms', type=float, default=5, help='凑批次的最长等待时间，毫秒 (默认: 5)')
+    parser.add_argument('--warm_sizes', default='', help='(可选) 启动时预加载的字号，逗号分隔，如 96,160')
+    parser.add_argument('--verbose', action='store_true', help='打印每个请求的访问日志')
+    args = parser.parse_args()
+
+    font_paths = resolve_font_paths(args)
+    if not font_paths or not style_cache.load_styles(args.style_css):
+        exit(1)
+    if args.templates and template_registry.load_templates(args.templates, font_paths) is None:
+        exit(1)
+    warm_sizes = [int(size) for size in args.warm_sizes.split(',') if size.strip()]
+
+    server = create_server(args.host, args.port, os.path.abspath(args.style_css), font_paths,
+                           args.workers, args.batch_size, args.batch_window_ms, warm_sizes, args.verbose,
+                           template_registry.templates())
+    print(f"封面渲染服务已启动: http://{args.host}:{args.port} (工作进程 {server.workers} 个)")
+    # 作为守护进程运行时通过 SIGTERM 停止；shutdown 必须在其他线程中调用
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.shutdown()
+        print("封面渲染服务已停止")
+
+
+if __name__ == '__main__':
+    main()
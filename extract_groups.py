@@ -4,19 +4,47 @@
 文件名分组提取脚本
 遍历./out文件夹下的文件名，提取"_with_{分组}_"中的分组名，
 生成分组JSON文件保存到根目录
+
+输出目录很大时可以使用增量索引 (--index)：索引记录已处理过的文件名及其分组，
+再次运行时只处理新增和已删除的文件；索引文件以 .db/.sqlite 结尾时保存为 SQLite，
+可以直接按分组查询 (--group)，不必读取整个JSON。
 """
 
 import os
 import json
 import re
+import sqlite3
+import time
 from collections import defaultdict
 
-def extract_groups_from_filenames(directory_path="./out"):
+# 匹配模式1: _with_{分组名}_ (有结尾下划线)
+# 匹配模式2: _with_{分组名}. (没有结尾下划线，直接接文件扩展名)
+_GROUP_PATTERN_UNDERSCORE = re.compile(r'_with_(.+?)_')
+_GROUP_PATTERN_EXTENSION = re.compile(r'_with_(.+?)\.')
+
+def extract_group_name(filename):
+    """
+    从单个文件名中提取分组名
+    
+    Returns:
+        str: 分组名，未匹配到分组模式时返回 None
+    """
+    # 优先匹配有下划线的，没有再匹配直接接扩展名的
+    match = _GROUP_PATTERN_UNDERSCORE.search(filename) or _GROUP_PATTERN_EXTENSION.search(filename)
+    return match.group(1) if match else None
+
+def list_files(directory_path):
+    """列出目录中的文件名 (跳过子目录)，文件类型由 scandir 直接给出，不需要逐个 stat"""
+    with os.scandir(directory_path) as entries:
+        return [entry.name for entry in entries if entry.is_file()]
+
+def extract_groups_from_filenames(directory_path="./out", verbose=True):
     """
     从文件名中提取分组信息
     
     Args:
         directory_path: 要遍历的目录路径
+        verbose: 是否逐个打印文件的匹配结果
     
     Returns:
         dict: 分组字典，格式如{"工作流": ['2_with_工作流_1.jpg', '3_with_工作流_1.jpg']}
@@ -28,35 +56,24 @@ def extract_groups_from_filenames(directory_path="./out"):
     # 用于存储分组结果
     groups = defaultdict(list)
     
-    # 遍历目录中的所有文件
-    for filename in os.listdir(directory_path):
-        # 只处理文件，跳过子目录
-        file_path = os.path.join(directory_path, filename)
-        if not os.path.isfile(file_path):
-            continue
-            
-        # 使用正则表达式提取分组名
-        # 匹配模式1: _with_{分组名}_ (有结尾下划线)
-        # 匹配模式2: _with_{分组名}. (没有结尾下划线，直接接文件扩展名)
-        pattern1 = r'_with_(.+?)_'
-        pattern2 = r'_with_(.+?)\.'
-        
-        match = re.search(pattern1, filename)  # 优先匹配有下划线的
-        if not match:
-            match = re.search(pattern2, filename)  # 如果没有，匹配没有下划线的
-        
-        if match:
-            group_name = match.group(1)
+    # 遍历目录中的所有文件 (跳过子目录)
+    for filename in list_files(directory_path):
+        group_name = extract_group_name(filename)
+        if group_name is not None:
             groups[group_name].append(filename)
-            print(f"找到文件: {filename} -> 分组: {group_name}")
-        else:
+            if verbose:
+                print(f"找到文件: {filename} -> 分组: {group_name}")
+        elif verbose:
             print(f"跳过文件: {filename} (未匹配到分组模式)")
     
     # 转换为普通字典并排序
+    return sort_groups(groups)
+
+def sort_groups(groups):
+    """把 {分组: [文件名]} 转换为按分组名、文件名排序的普通字典"""
     result = {}
     for group_name in sorted(groups.keys()):
         result[group_name] = sorted(groups[group_name])
-    
     return result
 
 def save_to_json(data, output_path="./filename_groups.json"):
@@ -76,14 +93,232 @@ def save_to_json(data, output_path="./filename_groups.json"):
         print(f"保存JSON文件失败: {str(e)}")
         return False
 
+# =============================================================================
+# 增量分组索引
+# =============================================================================
+# 目录修改时间距本次扫描不足该秒数时不记录，避免文件系统时间戳精度不足
+# 导致扫描之后新增的文件被漏掉
+_DIR_STAMP_MIN_AGE = 2.0
+_INDEX_FORMAT = 1
+
+def is_sqlite_index(index_path):
+    """索引文件以 .db/.sqlite/.sqlite3 结尾时使用 SQLite，否则使用紧凑的JSON"""
+    return index_path.lower().endswith(('.db', '.sqlite', '.sqlite3'))
+
+def _directory_stamp(directory_path, scan_start):
+    mtime_ns = os.stat(directory_path).st_mtime_ns
+    if scan_start - mtime_ns / 1e9 < _DIR_STAMP_MIN_AGE:
+        return None
+    return mtime_ns
+
+def _connect(index_path):
+    conn = sqlite3.connect(index_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, group_name TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS files_by_group ON files (group_name, name)")
+    return conn
+
+def _load_json_data(index_path):
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') == _INDEX_FORMAT and isinstance(data.get('files'), dict):
+            return data
+    except (OSError, ValueError):
+        pass
+    return {'format': _INDEX_FORMAT, 'files': {}}
+
+def _load_json_index(index_path):
+    data = _load_json_data(index_path)
+    return data.get('directory'), data.get('stamp'), data['files']
+
+def _save_json_data(index_path, data):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, index_path)
+
+def update_group_index(directory_path, index_path, rebuild=False):
+    """
+    增量更新分组索引：只对新增的文件提取分组，并删除已不存在的文件
+
+    目录自上次更新以来没有变化 (修改时间相同) 时不扫描目录。
+
+    Args:
+        directory_path: 要遍历的目录路径
+        index_path: 索引文件路径 (.db/.sqlite 为 SQLite，其他为JSON)
+        rebuild: 忽略已有的索引，重新扫描所有文件
+
+    Returns:
+        dict: 统计信息，包含 total, added, removed, scanned (是否扫描了目录), elapsed，
+              以及索引的版本号 generation (文件列表每次变化时递增)
+    """
+    start = time.perf_counter()
+    scan_start = time.time()
+    directory = os.path.abspath(directory_path)
+    sqlite = is_sqlite_index(index_path)
+
+    if sqlite:
+        conn = _connect(index_path)
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    else:
+        data = _load_json_data(index_path)
+        meta = data
+    generation = int(meta.get('generation') or 0)
+    reset = rebuild or meta.get('directory') != directory
+    if sqlite:
+        if reset:
+            conn.execute("DELETE FROM files")
+        stamp = int(meta['stamp']) if meta.get('stamp') and not reset else None
+        known = None
+    else:
+        if reset:
+            data['files'] = {}
+        stamp = None if reset else data.get('stamp')
+        known = data['files']
+
+    stats = {'total': 0, 'added': 0, 'removed': 0, 'scanned': False, 'generation': generation}
+    try:
+        if stamp is not None and stamp == os.stat(directory_path).st_mtime_ns:
+            if sqlite:
+                stats['total'] = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            else:
+                stats['total'] = len(known)
+            stats['elapsed'] = time.perf_counter() - start
+            return stats
+
+        current = set(list_files(directory_path))
+        stats['scanned'] = True
+        if sqlite:
+            known = set(name for (name,) in conn.execute("SELECT name FROM files"))
+        added = current.difference(known)
+        removed = set(known).difference(current)
+        new_stamp = _directory_stamp(directory_path, scan_start)
+        changed = reset or added or removed
+        if changed:
+            generation += 1
+
+        if sqlite:
+            with conn:
+                conn.executemany("DELETE FROM files WHERE name = ?", ((name,) for name in removed))
+                conn.executemany("INSERT OR REPLACE INTO files (name, group_name) VALUES (?, ?)",
+                                 ((name, extract_group_name(name)) for name in added))
+                conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                 [('directory', directory), ('stamp', '' if new_stamp is None else str(new_stamp)),
+                                  ('generation', str(generation))])
+        else:
+            for name in removed:
+                del known[name]
+            for name in added:
+                known[name] = extract_group_name(name)
+            if changed or new_stamp != stamp:
+                data.update(directory=directory, stamp=new_stamp, generation=generation)
+                _save_json_data(index_path, data)
+
+        stats.update(total=len(current), added=len(added), removed=len(removed), generation=generation)
+    finally:
+        if sqlite:
+            conn.close()
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
+
+def _json_stamp(output_json, generation):
+    """分组JSON的写入记录：索引版本号、JSON的绝对路径、大小和修改时间"""
+    stat = os.stat(output_json)
+    return [generation, os.path.abspath(output_json), stat.st_size, stat.st_mtime_ns]
+
+def json_is_current(index_path, output_json, generation):
+    """
+    分组JSON是否由当前版本的索引生成，且之后没有被修改或删除
+
+    只更新索引 (--no_json) 或写入JSON失败之后，记录的版本号与索引不一致，需要重新生成
+    """
+    if is_sqlite_index(index_path):
+        conn = _connect(index_path)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'json_stamp'").fetchone()
+        finally:
+            conn.close()
+        recorded = json.loads(row[0]) if row else None
+    else:
+        recorded = _load_json_data(index_path).get('json_stamp')
+    try:
+        return recorded == _json_stamp(output_json, generation)
+    except OSError:
+        return False
+
+def record_json_written(index_path, output_json, generation):
+    """在索引中记录分组JSON已按版本号 generation 写入"""
+    stamp = _json_stamp(output_json, generation)
+    if is_sqlite_index(index_path):
+        conn = _connect(index_path)
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_stamp', ?)",
+                             (json.dumps(stamp, ensure_ascii=False),))
+        finally:
+            conn.close()
+        return
+    data = _load_json_data(index_path)
+    data['json_stamp'] = stamp
+    _save_json_data(index_path, data)
+
+def load_groups(index_path):
+    """从索引中读取全部分组，返回格式与 extract_groups_from_filenames 相同"""
+    if is_sqlite_index(index_path):
+        groups = {}
+        conn = _connect(index_path)
+        try:
+            rows = conn.execute(
+                "SELECT group_name, name FROM files WHERE group_name IS NOT NULL ORDER BY group_name, name")
+            for group_name, name in rows:
+                groups.setdefault(group_name, []).append(name)
+        finally:
+            conn.close()
+        return groups
+
+    groups = defaultdict(list)
+    for name, group_name in _load_json_index(index_path)[2].items():
+        if group_name is not None:
+            groups[group_name].append(name)
+    return sort_groups(groups)
+
+def read_group(index_path, group_name):
+    """只读取一个分组的文件名列表 (SQLite 索引按分组建有索引，无需读取全部数据)"""
+    if is_sqlite_index(index_path):
+        conn = _connect(index_path)
+        try:
+            rows = conn.execute("SELECT name FROM files WHERE group_name = ? ORDER BY name", (group_name,))
+            return [name for (name,) in rows]
+        finally:
+            conn.close()
+    return load_groups(index_path).get(group_name, [])
+
+
 def main():
     """主函数"""
-    import sys
+    import argparse
     
-    # 支持命令行参数
-    if len(sys.argv) > 1:
-        target_directory = sys.argv[1]
-    else:
+    parser = argparse.ArgumentParser(description='从文件名中提取 _with_{分组}_ 分组信息')
+    parser.add_argument('directory', nargs='?', default=None, help='要遍历的目录 (默认: ./out，不存在时使用 ./img-output)')
+    parser.add_argument('output_json', nargs='?', default='./filename_groups.json', help='输出JSON文件路径 (默认: ./filename_groups.json)')
+    parser.add_argument('--index', default=None, help='(可选) 增量索引文件，以 .db/.sqlite 结尾时使用 SQLite')
+    parser.add_argument('--rebuild', action='store_true', help='忽略已有索引，重新扫描所有文件')
+    parser.add_argument('--group', default=None, help='(可选) 只从索引中查询并打印该分组的文件，需配合 --index')
+    parser.add_argument('--no_json', action='store_true', help='只更新索引，不生成JSON文件')
+    parser.add_argument('--quiet', action='store_true', help='不逐个打印文件和分组')
+    args = parser.parse_args()
+    
+    if args.group:
+        if not args.index or not os.path.exists(args.index):
+            print("错误: --group 需要配合已存在的 --index 使用")
+            return
+        for filename in read_group(args.index, args.group):
+            print(filename)
+        return
+    
+    target_directory = args.directory
+    if target_directory is None:
         # 检查是否存在out目录，如果不存在则使用img-output
         if os.path.exists("./out"):
             target_directory = "./out"
@@ -93,11 +328,7 @@ def main():
         else:
             print("错误: 未找到out或img-output目录")
             return
-    
-    if len(sys.argv) > 2:
-        output_json = sys.argv[2]
-    else:
-        output_json = "./filename_groups.json"
+    output_json = args.output_json
     
     print("=" * 50)
     print("文件名分组提取工具")
@@ -105,10 +336,28 @@ def main():
     
     print(f"目标目录: {target_directory}")
     print(f"输出文件: {output_json}")
+    if args.index:
+        print(f"索引文件: {args.index}")
     print("-" * 50)
     
     # 提取分组信息
-    groups = extract_groups_from_filenames(target_directory)
+    if args.index:
+        if not os.path.isdir(target_directory):
+            print(f"错误: 目录 {target_directory} 不存在")
+            return
+        stats = update_group_index(target_directory, args.index, args.rebuild)
+        if stats['scanned']:
+            print(f"共 {stats['total']} 个文件, 新增 {stats['added']} 个, 删除 {stats['removed']} 个, 耗时 {stats['elapsed']:.2f}s")
+        else:
+            print(f"目录未变化, 共 {stats['total']} 个文件, 耗时 {stats['elapsed']:.2f}s")
+        if args.no_json:
+            return
+        if json_is_current(args.index, output_json, stats['generation']):
+            print(f"分组没有变化，保留已有的JSON文件: {output_json}")
+            return
+        groups = load_groups(args.index)
+    else:
+        groups = extract_groups_from_filenames(target_directory, verbose=not args.quiet)
     
     if not groups:
         print("未找到任何分组信息")
@@ -117,13 +366,20 @@ def main():
     # 显示分组结果
     print(f"\n共找到 {len(groups)} 个分组:")
     for group_name, filenames in groups.items():
+        if args.quiet:
+            print(f"  {group_name}: {len(filenames)} 个文件")
+            continue
         print(f"\n分组 '{group_name}':")
         for filename in filenames:
             print(f"  - {filename}")
     
     # 保存为JSON文件
     if save_to_json(groups, output_json):
+        if args.index:
+            record_json_written(args.index, output_json, stats['generation'])
         print(f"\n✓ 成功生成JSON文件: {output_json}")
+        if args.quiet:
+            return
         
         # 显示JSON文件内容预览
         print("\nJSON文件内容预览:")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字体注册表模块
+进程级的字体缓存：按 (字体路径, 字号, 样式) 缓存已加载的 FreeTypeFont 对象，
+避免每次渲染都重新解析数MB的TTF文件。
+
+缓存容量有限，超出后按LRU淘汰最久未使用的字体；单次命令行调用与
+批量/常驻进程共用同一个注册表。
+"""
+
+import threading
+from collections import OrderedDict
+
+from PIL import ImageFont
+
+import instrumentation
+
+DEFAULT_MAX_FONTS = 64
+
+_fonts = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_max_fonts = DEFAULT_MAX_FONTS
+
+
+def get_font(font_path, font_size, variant='regular'):
+    """
+    获取字体对象，命中缓存时直接返回
+
+    Args:
+        font_path: 字体文件路径
+        font_size: 字号 (像素)
+        variant: 样式标识，如 'regular' 或 'italic'
+
+    Returns:
+        ImageFont.FreeTypeFont: 字体对象
+
+    Raises:
+        IOError: 字体文件不存在或无法解析
+    """
+    key = (font_path, int(font_size), variant)
+    with _lock:
+        font = _fonts.get(key)
+        if font is not None:
+            _fonts.move_to_end(key)
+            _stats['hits'] += 1
+            instrumentation.count('font_cache_hits')
+            return font
+        _stats['misses'] += 1
+    instrumentation.count('fonts_loaded')
+
+    # 解析TTF比较耗时，放在锁外进行
+    font = ImageFont.truetype(font_path, int(font_size))
+
+    with _lock:
+        _fonts[key] = font
+        _fonts.move_to_end(key)
+        while len(_fonts) > _max_fonts:
+            _fonts.popitem(last=False)
+            _stats['evictions'] += 1
+    return font
+
+
+def warm_up(font_paths, font_sizes, variant='regular'):
+    """
+    预加载字体，常驻进程启动时调用，避免第一次渲染时的加载延迟
+
+    Args:
+        font_paths: 字体路径列表 (或 font_paths 字典)
+        font_sizes: 需要预加载的字号列表
+
+    Returns:
+        int: 成功加载的字体数量
+    """
+    if isinstance(font_paths, dict):
+        font_paths = font_paths.values()
+    loaded = 0
+    for font_path in set(p for p in font_paths if p):
+        for font_size in font_sizes:
+            try:
+                get_font(font_path, font_size, variant)
+                loaded += 1
+            except IOError:
+                print(f"警告：预加载字体失败 at {font_path}")
+                break
+    return loaded
+
+
+def set_max_fonts(max_fonts):
+    """调整缓存容量，多余的字体会立即被淘汰"""
+    global _max_fonts
+    with _lock:
+        _max_fonts = max(1, int(max_fonts))
+        while len(_fonts) > _max_fonts:
+            _fonts.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def cache_info():
+    """返回缓存统计：命中、未命中、淘汰次数以及当前缓存的字体数量"""
+    with _lock:
+        info = dict(_stats)
+        info['size'] = len(_fonts)
+        info['max_size'] = _max_fonts
+    return info
+
+
+def clear():
+    """清空缓存和统计"""
+    with _lock:
+        _fonts.clear()
+        for key in _stats:
+            _stats[key] = 0
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+字形图集模块
+进程级的字形缓存：按 (字体, 字号, 字符) 缓存 FreeType 光栅化后的灰度蒙版、
+相对笔位置的偏移和前进宽度。绘制一行文字时按前进宽度和字距 (kerning) 依次
+把缓存的蒙版拼到一起，不再逐字调用 FreeType 光栅化；封面文字反复使用的
+少量汉字 (如 "工作流"、"AI") 在稳定状态下只剩内存拷贝。
+
+拼接规则与 Pillow 基础排版 (BASIC layout) 的 draw.text 一致，结果逐像素相同：
+- 字形在整数像素原点光栅化，笔位置 (26.6 定点数) 四舍五入到整数像素
+- 同一行内重叠的字形取最大值，多行文字逐行用 draw_bitmap 叠加
+- 多行文字的行距和居中对齐与 ImageDraw 的多行排版相同
+
+使用 raqm 排版 (连字、复杂文字) 的字体、非 FreeType 字体以及负坐标不适用，
+此时 line_masks 返回 None，由调用方交给 draw.text 绘制。
+
+缓存按蒙版占用的字节数限制大小，超出后按LRU淘汰。
+"""
+
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageChops, ImageFont
+
+import instrumentation
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# 每个字形除蒙版像素外的大致开销 (Image 对象、键、元组)
+_ENTRY_OVERHEAD = 200
+
+# 每个字体缓存的字距对数量上限，超出后清空该字体的字距表
+_MAX_KERNING_PAIRS = 65536
+
+# 缓存排版度量的字体数量上限
+_MAX_CACHED_FONTS = 64
+
+# ImageDraw 多行文字的默认行间距
+_LINE_SPACING = 4
+
+_glyphs = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_cache_bytes = 0
+_max_bytes = DEFAULT_MAX_BYTES
+
+# 每个字体一份排版度量: {'advances': {字符: 前进宽度}, 'kerning': {字符对: 字距}, 'line_spacing': 行距}
+_metrics = {}
+
+
+def _font_key(font):
+    return (font.path, font.size, font.index)
+
+
+def supports(font):
+    """字体是否可以使用图集绘制"""
+    return (isinstance(font, ImageFont.FreeTypeFont) and font.path is not None
+            and font.layout_engine == ImageFont.Layout.BASIC)
+
+
+def _pixel(value):
+    """26.6 定点数四舍五入到整数像素，同 FreeType 的 PIXEL 宏"""
+    return (value + 32) >> 6
+
+
+def _get_glyph(font, font_key, char):
+    """返回 (蒙版, 偏移)，空白字符的蒙版为 None；第二个返回值表示是否命中缓存"""
+    global _cache_bytes
+    key = (font_key, char)
+    with _lock:
+        glyph = _glyphs.get(key)
+        if glyph is not None:
+            _glyphs.move_to_end(key)
+            _stats['hits'] += 1
+            return glyph, True
+        _stats['misses'] += 1
+
+    core, offset = font.getmask2(char, 'L')
+    mask = Image.frombytes('L', core.size, bytes(core)) if core.size[0] and core.size[1] else None
+    glyph = (mask, offset)
+
+    glyph_bytes = _ENTRY_OVERHEAD + (mask.width * mask.height if mask else 0)
+    with _lock:
+        if glyph_bytes <= _max_bytes and key not in _glyphs:
+            _glyphs[key] = glyph
+            _cache_bytes += glyph_bytes
+            while _cache_bytes > _max_bytes:
+                _, (old_mask, _) = _glyphs.popitem(last=False)
+                _cache_bytes -= _ENTRY_OVERHEAD + (old_mask.width * old_mask.height if old_mask else 0)
+                _stats['evictions'] += 1
+    return glyph, False
+
+
+def _font_metrics(font, font_key):
+    metrics = _metrics.get(font_key)
+    if metrics is None:
+        if len(_metrics) >= _MAX_CACHED_FONTS:
+            _metrics.clear()
+        metrics = _metrics[font_key] = {
+            'advances': {},
+            'kerning': {},
+            'line_spacing': font.getbbox('A')[3] + _LINE_SPACING,
+        }
+    return metrics
+
+
+def _pen_positions(font, metrics, text):
+    """各字符的笔位置和整行的前进宽度 (26.6 定点数)，等同于逐个前缀调用 font.getlength"""
+    advances, kerning = metrics['advances'], metrics['kerning']
+    positions = []
+    pen = 0
+    previous = None
+    for char in text:
+        advance = advances.get(char)
+        if advance is None:
+            advance = advances[char] = round(font.getlength(char) * 64)
+        if previous is not None:
+            pair = previous + char
+            kern = kerning.get(pair)
+            if kern is None:
+                if len(kerning) >= _MAX_KERNING_PAIRS:
+                    kerning.clear()
+                kern = kerning[pair] = round(font.getlength(pair) * 64) - advances[previous] - advance
+            pen += kern
+        positions.append(pen)
+        pen += advance
+        previous = char
+    return positions, pen
+
+
+def _line_mask(font, font_key, text, positions, x, y):
+    """
+    拼接一行文字的蒙版
+
+    Returns:
+        tuple: (origin, mask)，没有墨迹时返回 None
+    """
+    x_base, x_frac = int(x), math.floor(math.modf(x)[0] * 64 + 0.5)
+    y_shift = int(y) - _pixel(-math.floor(math.modf(y)[0] * 64 + 0.5))
+
+    placed = []
+    hits = 0
+    left = top = math.inf
+    right = bottom = -math.inf
+    for char, pen in zip(text, positions):
+        (mask, offset), hit = _get_glyph(font, font_key, char)
+        hits += hit
+        if mask is None:
+            continue
+        gx = x_base + _pixel(x_frac + pen) + offset[0]
+        gy = y_shift + offset[1]
+        placed.append((mask, gx, gy))
+        left, top = min(left, gx), min(top, gy)
+        right, bottom = max(right, gx + mask.width), max(bottom, gy + mask.height)
+    instrumentation.count('glyph_cache_hits', hits)
+    instrumentation.count('glyph_cache_misses', len(text) - hits)
+    if not placed:
+        return None
+
+    canvas = Image.new('L', (right - left, bottom - top), 0)
+    ink_right = -math.inf
+    for mask, gx, gy in placed:
+        box = (gx - left, gy - top, gx - left + mask.width, gy - top + mask.height)
+        if box[0] >= ink_right:
+            # 与之前的字形不重叠，直接拷贝
+            canvas.paste(mask, box)
+        else:
+            # 与之前的字形重叠 (如斜体、紧排的英文)，取最大值
+            canvas.paste(ImageChops.lighter(canvas.crop(box), mask), box)
+        ink_right = max(ink_right, box[2])
+    return (left, top), canvas
+
+
+def line_masks(font, text, xy, align='left'):
+    """
+    用缓存的字形拼出文字的蒙版，效果等同于 draw.text(xy, text, font=font, align=align)
+
+    Args:
+        font: 字体对象
+        text: 文字，可以包含换行符
+        xy: 绘制坐标 (左上角，可以是小数)
+        align: 多行文字的对齐方式，'left'、'center' 或 'right'
+
+    Returns:
+        list 或 None: 每个有墨迹的行一项 (origin, mask)，依次用
+                      draw.bitmap(origin, mask, fill) 绘制即可；不适用时返回 None
+    """
+    if not supports(font) or align not in ('left', 'center', 'right'):
+        return None
+
+    font_key = _font_key(font)
+    metrics = _font_metrics(font, font_key)
+    lines = text.split('\n')
+    layouts = [_pen_positions(font, metrics, line) for line in lines]
+    max_width = max(width for _, width in layouts)
+
+    x, y = xy
+    masks = []
+    for i, (line, (positions, width)) in enumerate(zip(lines, layouts)):
+        line_x = x
+        line_y = y + i * metrics['line_spacing']
+        if len(lines) > 1 and align == 'center':
+            line_x += (max_width - width) / 64 / 2.0
+        elif len(lines) > 1 and align == 'right':
+            line_x += (max_width - width) / 64
+        # 负坐标时 Pillow 的取整方式不同，交给 draw.text
+        if line_x < 0 or line_y < 0:
+            return None
+        line_mask = _line_mask(font, font_key, line, positions, line_x, line_y)
+        if line_mask is not None:
+            masks.append(line_mask)
+    return masks
+
+
+def set_max_bytes(max_bytes):
+    """调整字形缓存的容量 (字节)，多余的字形会立即被淘汰"""
+    global _max_bytes, _cache_bytes
+    with _lock:
+        _max_bytes = max(0, int(max_bytes))
+        while _glyphs and _cache_bytes > _max_bytes:
+            _, (old_mask, _) = _glyphs.popitem(last=False)
+            _cache_bytes -= _ENTRY_OVERHEAD + (old_mask.width * old_mask.height if old_mask else 0)
+            _stats['evictions'] += 1
+
+
+def cache_info():
+    """返回字形缓存统计：命中、未命中、淘汰次数、缓存字形数和占用字节数"""
+    with _lock:
+        info = dict(_stats)
+        info['size'] = len(_glyphs)
+        info['bytes'] = _cache_bytes
+        info['max_bytes'] = _max_bytes
+    return info
+
+
+def clear():
+    """清空字形缓存、排版度量和统计"""
+    global _cache_bytes
+    with _lock:
+        _glyphs.clear()
+        _metrics.clear()
+        _cache_bytes = 0
+        for key in _stats:
+            _stats[key] = 0
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+金标准图片回归检查
+按固定的矩阵 (封面文字 × guangshu_style.css 的变体 × img-background 中的背景，以及元素叠加)
+渲染输出，封面还在参考宽度 (720px) 以外的宽度上各渲染一组，排版从参考宽度投影过去的误差也在检查之内；
+与保存的金标准图片逐一比较，同时记录每个用例的渲染耗时。
+性能优化 (字体/字形缓存、单遍描边、分块合成等) 可以同时按速度和保真度决定是否接受。
+
+比较全部使用 Pillow 在C层完成的整图运算 (ImageChops / ImageStat / ImageFilter)，不逐像素循环:
+    max_diff       任一通道的最大差值
+    changed_ratio  任一通道差值超过 --pixel_tolerance 的像素比例 (像素级)
+    psnr           峰值信噪比 (dB)，完全相同时为 inf
+    blurred_max    两张图各自 3×3 均值模糊后的最大差值 (感知级)：亚像素的抗锯齿抖动
+                   基本被抹平，缺失的阴影、错位的文字等肉眼可见的变化仍然很大
+
+用法:
+    python golden_check.py --update                 # 在确认无误的版本上生成金标准
+    python golden_check.py                          # 与金标准比较，保真度或速度不达标时以状态1退出
+    python golden_check.py --only cover-2 --diff_dir /tmp/golden_diff
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from PIL import Image, ImageChops, ImageFilter, ImageStat
+
+import style_cache
+import text_layer
+from benchmark import BASE_DIR, FIXTURE_CSS, FIXTURE_FONTS, _make_element, environment, time_call
+from overlay_images import overlay_images
+from stable_script import create_cover
+
+DEFAULT_GOLDEN_DIR = os.path.join(BASE_DIR, 'golden')
+MANIFEST_NAME = 'manifest.json'
+
+FIXTURE_BACKGROUNDS = ('2.jpg', '10.png', '7.png')
+
+FIXTURE_TEXT_SETS = {
+    'short': ["一人公司神器", "Weclone", "克隆数字版的你"],
+    'long': ["一人公司神器", "Weclone", "喂给它聊天记录,克隆一个数字版的你自己 with some English words"],
+    'mixed': ["AI 工作流", "Feed it your chat logs",
+              "喂给它聊天记录，克隆一个数字版的你自己。Feed it your chat logs and clone a digital version of yourself!"],
+}
+
+# guangshu_style.css 的变体: 名称 -> [(正则, 替换为)]，覆盖描边、模糊阴影、字号和换行宽度
+_STROKE = r'text-shadow:\s*-2px -2px 0 #000,[^;]*;'
+CSS_VARIANTS = {
+    'base': [],
+    'no_stroke': [(_STROKE, 'text-shadow: none;')],
+    'blur_shadow': [(_STROKE, 'text-shadow: 4px 6px 8px #000;')],
+    'large_narrow': [(r'font-size: 80px;(\s*margin-top: -200px;)', r'font-size: 96px;\1'),
+                     (r'width: 80%;(\s*font-size:) 48px;', r'width: 60%;\1 56px;')],
+}
+
+# 元素叠加的参数: 名称 -> (position, opacity, scale_factor)
+OVERLAY_SETTINGS = {
+    'center': ((0, 0), 1.0, 1.0),
+    'corner': ('bottom-right', 0.6, 0.5),
+}
+
+# 参考宽度以外的封面输出宽度：1440 (2.jpg 按 1440 输出，较窄的背景按原尺寸 777/805 输出)
+# 和一个比全部背景都窄的奇数宽度，排版投影在这些宽度上不是精确的
+DEFAULT_EXTRA_WIDTHS = (1440, 763)
+
+# 非参考宽度只渲染影响排版的变体 (字号和换行宽度)，用例数量不至于翻倍
+EXTRA_WIDTH_VARIANTS = ('base', 'large_narrow')
+
+# 分块合成用例的内存预算，足够小以保证按多个条带合成
+TILED_MEMORY_BUDGET = 1024 * 1024
+
+# 输出使用无损的 PNG；快速预设只降低压缩级别，像素不变，编码不会占满计时
+GOLDEN_PRESET = 'fast'
+
+DEFAULT_PIXEL_TOLERANCE = 8
+DEFAULT_MAX_CHANGED = 0.001
+DEFAULT_MIN_PSNR = 40.0
+DEFAULT_MAX_BLURRED = 48
+
+
+def write_css_variants(work_dir):
+    """在 work_dir 中生成全部CSS变体，返回 {变体名: 路径}"""
+    with open(FIXTURE_CSS, 'r', encoding='utf-8') as f:
+        source = f.read()
+    paths = {}
+    for name, replacements in CSS_VARIANTS.items():
+        css = source
+        for pattern, replacement in replacements:
+            css, count = re.subn(pattern, replacement, css)
+            if not count:
+                raise ValueError(f"CSS变体 {name} 已失效: guangshu_style.css 中找不到 {pattern!r}")
+        paths[name] = os.path.join(work_dir, f"style_{name}.css")
+        with open(paths[name], 'w', encoding='utf-8') as f:
+            f.write(css)
+    return paths
+
+
+def build_cases(work_dir, max_width=720, extra_widths=DEFAULT_EXTRA_WIDTHS):
+    """
+    生成用例矩阵
+
+    Args:
+        max_width: 完整矩阵的输出宽度上限，0 表示原尺寸
+        extra_widths: 另外渲染 EXTRA_WIDTH_VARIANTS 封面的宽度上限，用例名为 cover-{背景}-w{宽度}-...
+
+    Returns:
+        dict: {用例名: 渲染函数}，渲染函数接收输出路径 (PNG)
+    """
+    css_paths = write_css_variants(work_dir)
+    element_path = os.path.join(work_dir, 'element.png')
+    _make_element(element_path)
+
+    cases = {}
+    for background in FIXTURE_BACKGROUNDS:
+        image_path = os.path.join(BASE_DIR, 'img-background', background)
+        bg_name = os.path.splitext(background)[0]
+        for css_name, css_path in css_paths.items():
+            styles = style_cache.load_styles(css_path)
+            for texts_name, texts in FIXTURE_TEXT_SETS.items():
+                cases[f"cover-{bg_name}-{css_name}-{texts_name}"] = _cover_case(
+                    image_path, texts, css_path, styles, max_width)
+                if css_name not in EXTRA_WIDTH_VARIANTS:
+                    continue
+                for width in extra_widths:
+                    cases[f"cover-{bg_name}-w{width}-{css_name}-{texts_name}"] = _cover_case(
+                        image_path, texts, css_path, styles, width)
+        cases[f"tiled-{bg_name}"] = _cover_case(
+            image_path, FIXTURE_TEXT_SETS['long'], css_paths['base'], style_cache.load_styles(css_paths['base']),
+            max_width, TILED_MEMORY_BUDGET)
+        for setting_name, (position, opacity, scale_factor) in OVERLAY_SETTINGS.items():
+            cases[f"overlay-{bg_name}-{setting_name}"] = _overlay_case(
+                image_path, element_path, position, opacity, scale_factor)
+    return cases
+
+
+def _cover_case(image_path, texts, css_path, styles, max_width, memory_budget=None):
+    def render(output_path):
+        # 每次都重新渲染文字图层，字形图集等进程级缓存保持预热
+        text_layer.clear()
+        if not create_cover(image_path, output_path, texts, css_path, FIXTURE_FONTS, styles,
+                            max_width=max_width or None, preset=GOLDEN_PRESET, memory_budget=memory_budget):
+            raise RuntimeError(f"封面生成失败: {image_path}")
+    return render
+
+
+def _overlay_case(background_path, element_path, position, opacity, scale_factor):
+    def render(output_path):
+        if not overlay_images(background_path, element_path, output_path, position, opacity, scale_factor,
+                              preset=GOLDEN_PRESET):
+            raise RuntimeError(f"元素叠加失败: {background_path}")
+    return render
+
+
+def diff_metrics(expected, actual, pixel_tolerance=DEFAULT_PIXEL_TOLERANCE):
+    """
+    比较两张图片
+
+    Returns:
+        dict: max_diff, changed_ratio, psnr, blurred_max；尺寸不同时只返回 size_mismatch
+    """
+    if expected.size != actual.size:
+        return {'size_mismatch': [list(expected.size), list(actual.size)]}
+    expected = expected.convert('RGB')
+    actual = actual.convert('RGB')
+
+    diff = ImageChops.difference(expected, actual)
+    # 每个像素取三个通道中最大的差值
+    red, green, blue = diff.split()
+    peak = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    changed = sum(peak.histogram()[pixel_tolerance + 1:])
+
+    mse = sum(rms * rms for rms in ImageStat.Stat(diff).rms) / 3
+    psnr = math.inf if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+    blur = ImageFilter.BoxBlur(1)
+    blurred = ImageChops.difference(expected.filter(blur), actual.filter(blur))
+    return {
+        'max_diff': peak.getextrema()[1],
+        'changed_ratio': changed / (expected.width * expected.height),
+        'psnr': psnr,
+        'blurred_max': max(high for _, high in blurred.getextrema()),
+    }
+
+
+def diff_image(expected, actual, gain=8):
+    """放大后的差异图 (灰度)，便于查看变化的位置"""
+    diff = ImageChops.difference(expected.convert('RGB'), actual.convert('RGB')).convert('L')
+    return diff.point([min(255, value * gain) for value in range(256)])
+
+
+def passes(metrics, max_changed=DEFAULT_MAX_CHANGED, min_psnr=DEFAULT_MIN_PSNR, max_blurred=DEFAULT_MAX_BLURRED):
+    """保真度是否达标：尺寸相同，且像素级、PSNR 和感知级三项都在阈值内"""
+    if 'size_mismatch' in metrics:
+        return False
+    return (metrics['changed_ratio'] <= max_changed and metrics['psnr'] >= min_psnr
+            and metrics['blurred_max'] <= max_blurred)
+
+
+def run_cases(cases, output_dir, repeat=3):
+    """
+    渲染全部用例到 output_dir，返回 {用例名: 耗时统计}
+
+    每个用例先预热一次，再计时 repeat 次；最后一次的输出用于比较
+    """
+    timings = {}
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    for name, render in cases.items():
+        output_path = os.path.join(output_dir, f"{name}.png")
+        with quiet:
+            timings[name] = time_call(lambda: render(output_path), repeat)
+    return timings
+
+
+def load_manifest(golden_dir):
+    try:
+        with open(os.path.join(golden_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def update_golden(output_dir, timings, golden_dir, max_width):
+    """把本次的输出和耗时保存为金标准 (只替换本次运行的用例)"""
+    os.makedirs(golden_dir, exist_ok=True)
+    manifest = load_manifest(golden_dir) or {}
+    if manifest.get('max_width') != max_width:
+        manifest = {}
+    manifest_cases = manifest.get('cases', {})
+    for name, timing in timings.items():
+        shutil.copyfile(os.path.join(output_dir, f"{name}.png"), os.path.join(golden_dir, f"{name}.png"))
+        manifest_cases[name] = timing
+    manifest = {'environment': environment(), 'max_width': max_width, 'cases': manifest_cases}
+    with open(os.path.join(golden_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def compare_golden(output_dir, timings, golden_dir, manifest, args):
+    """
+    与金标准比较
+
+    Returns:
+        tuple: (保真度不达标的用例列表, 本次总耗时ms, 金标准总耗时ms)
+    """
+    failures = []
+    total_ms = golden_ms = 0.0
+    print(f"{'case':<36}{'max':>5}{'changed':>10}{'psnr':>8}{'blur':>6}{'ms':>9}{'golden':>9}{'change':>9}")
+    print("-" * 92)
+    for name, timing in timings.items():
+        golden_path = os.path.join(golden_dir, f"{name}.png")
+        golden_timing = manifest['cases'].get(name)
+        if golden_timing is None or not os.path.exists(golden_path):
+            print(f"{name:<36}{'(没有金标准，使用 --update 生成)':>40}")
+            continue
+
+        with Image.open(golden_path) as expected, Image.open(os.path.join(output_dir, f"{name}.png")) as actual:
+            metrics = diff_metrics(expected, actual, args.pixel_tolerance)
+            ok = passes(metrics, args.max_changed, args.min_psnr, args.max_blurred)
+            if not ok:
+                failures.append(name)
+                if args.diff_dir and 'size_mismatch' not in metrics:
+                    os.makedirs(args.diff_dir, exist_ok=True)
+                    diff_image(expected, actual).save(os.path.join(args.diff_dir, f"{name}.png"))
+
+        total_ms += timing['median_ms']
+        golden_ms += golden_timing['median_ms']
+        change = timing['median_ms'] / golden_timing['median_ms'] - 1
+        if 'size_mismatch' in metrics:
+            fidelity = f"{'尺寸不同 ' + str(metrics['size_mismatch']):>29}"
+        else:
+            fidelity = (f"{metrics['max_diff']:>5}{metrics['changed_ratio']:>10.4%}"
+                        f"{metrics['psnr']:>8.1f}{metrics['blurred_max']:>6}")
+        print(f"{name:<36}{fidelity}{timing['median_ms']:>9.2f}{golden_timing['median_ms']:>9.2f}"
+              f"{change:>+9.1%}{'' if ok else '  ✗'}")
+    return failures, total_ms, golden_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description='渲染固定的用例矩阵并与金标准图片比较保真度和耗时')
+    parser.add_argument('--golden_dir', default=DEFAULT_GOLDEN_DIR, help='金标准目录 (默认: golden)')
+    parser.add_argument('--update', action='store_true', help='把本次输出保存为新的金标准')
+    parser.add_argument('--only', default=None, help='(可选) 只运行名称包含这些字符串的用例，逗号分隔，如 cover-2,tiled')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例的计时次数 (默认: 3)')
+    parser.add_argument('--max_width', type=int, default=720, help='封面的输出宽度上限，0表示原尺寸 (默认: 720)')
+    parser.add_argument('--extra_widths', default=','.join(map(str, DEFAULT_EXTRA_WIDTHS)),
+                        help='另外渲染部分封面用例的宽度上限，逗号分隔，留空则不渲染 (默认: %(default)s)')
+    parser.add_argument('--pixel_tolerance', type=int, default=DEFAULT_PIXEL_TOLERANCE,
+                        help=f'像素级比较时忽略的通道差值 (默认: {DEFAULT_PIXEL_TOLERANCE})')
+    parser.add_argument('--max_changed', type=float, default=DEFAULT_MAX_CHANGED,
+                        help=f'允许变化的像素比例 (默认: {DEFAULT_MAX_CHANGED})')
+    parser.add_argument('--min_psnr', type=float, default=DEFAULT_MIN_PSNR,
+                        help=f'PSNR 下限，dB (默认: {DEFAULT_MIN_PSNR})')
+    parser.add_argument('--max_blurred', type=int, default=DEFAULT_MAX_BLURRED,
+                        help=f'模糊后允许的最大差值 (默认: {DEFAULT_MAX_BLURRED})')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='总耗时允许的变慢比例，超过则以状态1退出 (默认: 0.25)')
+    parser.add_argument('--diff_dir', default=None, help='(可选) 保存不达标用例的差异图')
+    args = parser.parse_args()
+
+    only = [part.strip() for part in args.only.split(',') if part.strip()] if args.only else None
+    try:
+        extra_widths = [int(width) for width in args.extra_widths.split(',') if width.strip()]
+    except ValueError:
+        parser.error('--extra_widths 必须是逗号分隔的正整数')
+    if any(width <= 0 for width in extra_widths):
+        parser.error('--extra_widths 必须是逗号分隔的正整数')
+    work_dir = tempfile.mkdtemp(prefix='cover_golden_')
+    try:
+        cases = build_cases(work_dir, args.max_width, extra_widths)
+        if only:
+            cases = {name: render for name, render in cases.items() if any(part in name for part in only)}
+        if not cases:
+            print("没有匹配的用例")
+            sys.exit(1)
+        output_dir = os.path.join(work_dir, 'output')
+        os.makedirs(output_dir)
+        timings = run_cases(cases, output_dir, args.repeat)
+
+        if args.update:
+            update_golden(output_dir, timings, args.golden_dir, args.max_width)
+            print(f"已保存 {len(timings)} 个用例的金标准到: {args.golden_dir}")
+            return
+
+        manifest = load_manifest(args.golden_dir)
+        if manifest is None:
+            print(f"未找到金标准 {args.golden_dir}，使用 --update 生成")
+            sys.exit(1)
+        if manifest.get('max_width') != args.max_width:
+            print(f"错误: 金标准使用 --max_width {manifest.get('max_width')} 生成，与本次不同")
+            sys.exit(1)
+        failures, total_ms, golden_ms = compare_golden(output_dir, timings, args.golden_dir, manifest, args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("-" * 92)
+    slower = golden_ms and total_ms > golden_ms * (1 + args.tolerance)
+    if golden_ms:
+        print(f"总耗时 {total_ms:.1f}ms, 金标准 {golden_ms:.1f}ms ({total_ms / golden_ms - 1:+.1%})")
+    if failures:
+        print(f"保真度不达标 {len(failures)} 个: {', '.join(failures)}")
+    if slower:
+        print(f"总耗时变慢超过 {args.tolerance:.0%}")
+    if failures or slower:
+        sys.exit(1)
+    print("保真度和耗时均达标")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片读写模块
+所有脚本共用的解码、合成和编码入口：
+
+- 解码: 只需要较小尺寸时，JPEG 通过 draft 模式直接以 1/2、1/4、1/8 的比例解码；
+  没有透明通道的图片保持 RGB，不再整张提升为 RGBA (内存减少 1/4，转换也省掉)
+- 合成: alpha_composite 同时支持 RGB 和 RGBA 图片，RGB 图片只在被覆盖的区域
+  临时转换为 RGBA，结果与整张转换后再合成完全一致
+- 编码: 按预设选择质量、渐进式、优化、色度抽样等参数，支持 JPEG/PNG/WebP/AVIF
+- 分块: 指定单张图片的内存预算时，合成按固定行数的条带进行，临时缓冲区的大小
+  与条带而不是整个合成区域成正比；未被覆盖的区域不做任何转换和拷贝
+
+每张图片的解码耗时、编码耗时和输出字节数记录在调用方传入的 stats 字典中。
+"""
+
+import os
+import time
+
+from PIL import Image, features
+
+# 按扩展名确定输出格式
+FORMAT_BY_EXTENSION = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.webp': 'WEBP',
+    '.avif': 'AVIF',
+}
+
+# 编码预设: {预设名: {格式: Pillow 的 save 参数}}，未列出的格式使用 Pillow 默认参数
+ENCODER_PRESETS = {
+    # Pillow 默认参数，与直接调用 image.save 的结果一致
+    'default': {},
+    # 高质量: 不做色度抽样，文字边缘的彩色描边不会发糊
+    'high': {
+        'JPEG': {'quality': 95, 'subsampling': 0, 'optimize': True},
+        'WEBP': {'quality': 95, 'method': 6},
+        'AVIF': {'quality': 90},
+        'PNG': {'optimize': True},
+    },
+    # 网页发布: 渐进式 JPEG，体积更小
+    'web': {
+        'JPEG': {'quality': 85, 'subsampling': 2, 'optimize': True, 'progressive': True},
+        'WEBP': {'quality': 82, 'method': 6},
+        'AVIF': {'quality': 65},
+        'PNG': {'optimize': True},
+    },
+    # 快速: 编码耗时最短，适合预览和中间结果
+    'fast': {
+        'JPEG': {'quality': 85, 'subsampling': 2},
+        'WEBP': {'quality': 80, 'method': 0},
+        'AVIF': {'quality': 60, 'speed': 10},
+        'PNG': {'compress_level': 1},
+    },
+}
+
+# 只有这些格式接受 quality 参数
+_LOSSY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+
+# 分块合成时每个像素的临时内存 (字节)：条带图层、裁出的背景区域及其 RGBA 副本、
+# 合成结果和转换回原模式的副本
+_STRIP_BYTES_PER_PIXEL = 24
+
+# 条带的最小行数，预算过小时也不再继续缩小，避免逐行合成的调用开销
+MIN_TILE_ROWS = 16
+
+
+def has_alpha(image):
+    """图片是否带有透明通道 (包括调色板图片的透明色)"""
+    return image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in image.info
+
+
+def open_image(source, max_width=None, stats=None, resample=Image.Resampling.LANCZOS):
+    """
+    解码图片，返回 RGB (无透明通道) 或 RGBA 模式的图片
+
+    Args:
+        source: 文件路径或文件对象
+        max_width: (可选) 最大宽度，原图更宽时按比例缩小；JPEG 会直接以缩小的尺寸解码
+        stats: (可选) 统计字典，写入 decode_ms 和 source_size
+        resample: 缩小时使用的重采样滤镜
+
+    Returns:
+        Image: 解码后的图片
+    """
+    start = time.perf_counter()
+    image = Image.open(source)
+    source_size = image.size
+
+    target_size = None
+    if max_width and image.width > max_width:
+        target_size = (int(max_width), max(1, round(image.height * max_width / image.width)))
+        # draft 只对 JPEG 生效，解码出的尺寸不小于 target_size
+        image.draft(None, target_size)
+
+    mode = 'RGBA' if has_alpha(image) else 'RGB'
+    if image.mode != mode:
+        image = image.convert(mode)
+    else:
+        image.load()
+    if target_size and image.size != target_size:
+        image = image.resize(target_size, resample)
+
+    if stats is not None:
+        stats['decode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        stats['source_size'] = source_size
+    return image
+
+
+def tile_rows(image, memory_budget):
+    """
+    按单张图片的内存预算计算分块合成时每个条带的行数
+
+    Pillow 只能整张解码和编码 JPEG/PNG，解码后的图片必须常驻内存；预算扣除这部分后，
+    剩余的部分分给条带的临时缓冲区。预算连整张图片都容纳不下时使用最小条带。
+
+    Args:
+        image: 解码后的图片
+        memory_budget: 单张图片的内存预算 (字节)，None 或 0 表示不限制
+
+    Returns:
+        int 或 None: 条带行数，不限制时返回 None (整块合成)
+    """
+    if not memory_budget:
+        return None
+    available = memory_budget - image.width * image.height * len(image.getbands())
+    return max(MIN_TILE_ROWS, available // (image.width * _STRIP_BYTES_PER_PIXEL))
+
+
+def alpha_composite(image, overlay, dest=(0, 0), source=None, tile_rows=None):
+    """
+    把 RGBA 图层原地合成到图片上，参数含义同 Image.alpha_composite
+
+    RGB 图片只把被覆盖的区域转换成 RGBA 合成后再写回；RGB 图片视为完全不透明，
+    结果与先整张转换为 RGBA 再合成一致。指定 tile_rows 时按条带逐块合成，
+    结果与整块合成完全一致。
+
+    Returns:
+        Image: 传入的图片
+    """
+    if source is None:
+        source = (0, 0, overlay.width, overlay.height)
+    elif len(source) == 2:
+        source = (source[0], source[1], overlay.width, overlay.height)
+
+    if tile_rows and source[3] - source[1] > tile_rows:
+        for top in range(source[1], source[3], tile_rows):
+            strip = (source[0], top, source[2], min(top + tile_rows, source[3]))
+            alpha_composite(image, overlay, (dest[0], dest[1] + top - source[1]), strip)
+        return image
+
+    if image.mode == 'RGBA':
+        image.alpha_composite(overlay, dest=dest, source=source)
+        return image
+
+    box = (dest[0], dest[1], dest[0] + source[2] - source[0], dest[1] + source[3] - source[1])
+    region = image.crop(box).convert('RGBA')
+    region.alpha_composite(overlay, source=source)
+    image.paste(region.convert(image.mode), box)
+    return image
+
+
+def output_format(path, default=None):
+    """根据输出路径的扩展名确定编码格式，无法识别时返回 default"""
+    return FORMAT_BY_EXTENSION.get(os.path.splitext(str(path))[1].lower(), default)
+
+
+def encoder_options(format, preset=None, quality=None):
+    """
+    获取某个格式在指定预设下的编码参数
+
+    Args:
+        format: 编码格式，如 'JPEG'、'WEBP'
+        preset: 预设名，None 等同于 'default'
+        quality: (可选) 覆盖预设中的质量参数
+
+    Raises:
+        ValueError: 预设不存在
+    """
+    preset = preset or 'default'
+    if preset not in ENCODER_PRESETS:
+        raise ValueError(f"未知的编码预设: {preset} (可选: {', '.join(ENCODER_PRESETS)})")
+    options = dict(ENCODER_PRESETS[preset].get(format, {}))
+    if quality is not None and format in _LOSSY_FORMATS:
+        options['quality'] = int(quality)
+    return options
+
+
+def save_image(image, output, format=None, preset=None, quality=None, stats=None):
+    """
+    编码并写出图片
+
+    Args:
+        image: 待保存的图片 (JPEG 会自动去掉透明通道)
+        output: 输出路径或文件对象
+        format: (可选) 编码格式，默认根据输出路径的扩展名确定 (无法识别时交给 Pillow 判断)
+        preset: (可选) ENCODER_PRESETS 中的预设名
+        quality: (可选) 覆盖预设中的质量参数
+        stats: (可选) 统计字典，写入 encode_ms 和 output_bytes
+
+    Returns:
+        int: 输出的字节数
+
+    Raises:
+        ValueError: 预设不存在或当前 Pillow 不支持该格式
+    """
+    if format is None:
+        format = output_format(output) if isinstance(output, (str, os.PathLike)) else 'JPEG'
+    elif format.upper() in ('JPG', 'JPEG'):
+        format = 'JPEG'
+    else:
+        format = format.upper()
+    if format == 'AVIF' and not features.check('avif'):
+        raise ValueError('当前 Pillow 不支持 AVIF 编码')
+    options = encoder_options(format, preset, quality)
+
+    start = time.perf_counter()
+    if format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    if isinstance(output, (str, os.PathLike)):
+        # 输出文件可能是渲染缓存中对象的硬链接，先断开链接再写，避免改写缓存
+        if os.path.exists(output) and os.stat(output).st_nlink > 1:
+            os.remove(output)
+        image.save(output, format, **options)
+        output_bytes = os.path.getsize(output)
+    else:
+        position = output.tell()
+        image.save(output, format, **options)
+        output_bytes = output.tell() - position
+
+    if stats is not None:
+        stats['encode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        stats['output_bytes'] = output_bytes
+    return output_bytes
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能埋点模块
+按图片记录各阶段的耗时 (span) 和计数器 (counter)，用于定位慢在解码、字体加载、
+换行、阴影绘制还是编码。
+
+- 每处理一张图片产生一条记录: image_scope 开启记录，span 记录阶段耗时，count 累加计数
+- 记录可以按 JSON Lines 追加写入文件，也可以交给回调函数处理
+- 可选的分析模式: 'cprofile' 为每张图片保存一份 .prof 文件，
+  'tracemalloc' 记录每张图片在 Python 层的内存分配峰值和分配最多的代码行
+  (Pillow 在C层分配的像素内存不在统计范围内)
+
+默认关闭。关闭时 span 返回共享的空上下文、count 直接返回，埋点本身几乎没有开销；
+cProfile 和 tracemalloc 只在开启对应的分析模式时才导入，不拖慢命令行的启动。
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+_enabled = False
+_settings = {}
+_callback = None
+_write_lock = threading.Lock()
+_local = threading.local()
+_sequence = itertools.count(1)
+
+
+class _NullSpan:
+    """埋点关闭时使用的空上下文"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('record', 'name', 'fields', 'start')
+
+    def __init__(self, record, name, fields):
+        self.record = record
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        entry = {'name': self.name, 'ms': round(elapsed, 3)}
+        entry.update(self.fields)
+        self.record['spans'].append(entry)
+        return False
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+class _ImageScope:
+    """一张图片的记录，退出时写出"""
+
+    def __init__(self, kind, fields):
+        self.kind = kind
+        self.fields = fields
+
+    def __enter__(self):
+        self.record = {'kind': self.kind, 'pid': os.getpid(), 'seq': next(_sequence), 'spans': [], 'counters': {}}
+        _local.record = self.record
+
+        self.profiler = None
+        if _settings.get('profile') == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif _settings.get('profile') == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.reset_peak()
+            self.snapshot = tracemalloc.take_snapshot()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total_ms = (time.perf_counter() - self.start) * 1000
+        _local.record = None
+        record = self.record
+        record.update(self.fields)
+        record['total_ms'] = round(total_ms, 3)
+        if exc_type is not None:
+            record['error'] = f"{exc_type.__name__}: {exc}"
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            profile_dir = _settings.get('profile_dir') or '.'
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_path = os.path.join(profile_dir, f"{self.kind}_{record['pid']}_{record['seq']}.prof")
+            self.profiler.dump_stats(profile_path)
+            record['profile_path'] = profile_path
+        elif _settings.get('profile') == 'tracemalloc':
+            import tracemalloc
+            record['peak_alloc_bytes'] = tracemalloc.get_traced_memory()[1]
+            top = tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')[:5]
+            record['top_allocations'] = [
+                f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} {stat.size_diff}" for stat in top
+            ]
+
+        _emit(record)
+        return False
+
+    def set(self, **fields):
+        """补充记录中的字段，如处理结果"""
+        self.fields.update(fields)
+
+
+def _emit(record):
+    jsonl_path = _settings.get('jsonl_path')
+    if jsonl_path:
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with _write_lock:
+            # 多个工作进程追加写同一个文件，每条记录一次 write 写完
+            with open(jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+    if _callback is not None:
+        _callback(record)
+
+
+def image_scope(kind, **fields):
+    """
+    开始一张图片的记录
+
+    已在另一张图片的记录中 (如流水线中调用的封面渲染) 时只记为一个 span。
+
+    Args:
+        kind: 记录类型，如 'cover'、'overlay'
+        fields: 附加到记录中的字段，如图片路径
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        return _Span(record, kind, fields)
+    return _ImageScope(kind, fields)
+
+
+def span(name, **fields):
+    """记录一个阶段的耗时，fields 为附加字段 (如行号)"""
+    if not _enabled:
+        return _NULL_SPAN
+    record = getattr(_local, 'record', None)
+    if record is None:
+        return _NULL_SPAN
+    return _Span(record, name, fields)
+
+
+def count(name, n=1):
+    """累加当前图片记录中的计数器"""
+    if not _enabled:
+        return
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        counters = record['counters']
+        counters[name] = counters.get(name, 0) + n
+
+
+def enable(jsonl_path=None, callback=None, profile=None, profile_dir=None):
+    """
+    开启埋点
+
+    Args:
+        jsonl_path: (可选) 记录追加写入的 JSON Lines 文件
+        callback: (可选) 每条记录完成时调用 callback(record)，只在当前进程有效
+        profile: (可选) 分析模式，'cprofile' 或 'tracemalloc'
+        profile_dir: (可选) cprofile 模式下 .prof 文件的保存目录 (默认: 当前目录)
+
+    Raises:
+        ValueError: 分析模式无效
+    """
+    global _enabled, _settings, _callback
+    if profile and profile not in PROFILE_MODES:
+        raise ValueError(f"未知的分析模式: {profile} (可选: {', '.join(PROFILE_MODES)})")
+    if profile == 'tracemalloc':
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    _settings = {'jsonl_path': jsonl_path, 'profile': profile, 'profile_dir': profile_dir}
+    _callback = callback
+    _enabled = True
+
+
+def disable():
+    """关闭埋点"""
+    global _enabled, _settings, _callback
+    if _settings.get('profile') == 'tracemalloc':
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+    _enabled = False
+    _settings = {}
+    _callback = None
+
+
+def is_enabled():
+    return _enabled
+
+
+def settings():
+    """当前的埋点设置 (不含回调)，传给工作进程的 init_worker 使用"""
+    return dict(_settings) if _enabled else None
+
+
+def init_worker(worker_settings):
+    """进程池初始化函数：在工作进程中按主进程的设置开启埋点"""
+    if worker_settings:
+        enable(**worker_settings)
+
+
+def _print_record(record):
+    summary = f"[trace] {record['kind']} {record.get('image_path') or record.get('background_path', '')} {record['total_ms']:.1f}ms"
+    if 'peak_alloc_bytes' in record:
+        summary += f", 内存峰值 {record['peak_alloc_bytes'] / 1024 / 1024:.1f}MB"
+    if 'profile_path' in record:
+        summary += f", 分析结果 {record['profile_path']}"
+    print(summary)
+
+
+def add_arguments(parser):
+    """添加埋点相关的命令行参数，供各脚本共用"""
+    parser.add_argument('--trace', default=None,
+                        help='(可选) 把每张图片各阶段的耗时和计数追加写入该 JSON Lines 文件')
+    parser.add_argument('--profile', default=None, choices=PROFILE_MODES,
+                        help='(可选) 分析模式: cprofile 为每张图片保存 .prof 文件，tracemalloc 记录 Python 层的内存分配峰值')
+    parser.add_argument('--profile_dir', default=None,
+                        help='(可选) cprofile 模式下 .prof 文件的保存目录 (默认: 当前目录)')
+
+
+def enable_from_args(args):
+    """按 add_arguments 添加的参数开启埋点；只指定 --profile 时把每条记录的摘要打印出来"""
+    if args.trace or args.profile:
+        enable(args.trace, None if args.trace else _print_record, args.profile, args.profile_dir)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务规划模块
+背景 × 元素 (× 封面文字) 的任务矩阵里常有重复的工作：内容相同但文件名不同的背景或元素、
+相同的元素和文字组合。规划时按文件内容的摘要 (render_cache.file_digest) 把输出必然相同的
+任务合并为一个，只渲染一次；其余输出文件在渲染成功后用硬链接 (跨文件系统时复制) 生成。
+
+需要渲染的任务按 (背景尺寸, 背景, 元素) 排序：同一张背景的任务相邻，工作进程可以直接复用
+刚解码的背景 (见 overlay_images.load_background)；同尺寸背景上的同一元素复用按尺寸
+预缩放好的元素图层。进程池中按 background_runs 把同一张背景的任务整组交给一个工作进程，
+复用不会被拆散到不同的进程里。
+"""
+
+import os
+import time
+from collections import namedtuple
+
+from PIL import Image
+
+import image_io
+import render_cache
+
+# overlay_images 任务中影响输出的参数 (memory_budget 只影响内存占用，不影响输出)
+OVERLAY_OPTIONS = ('position', 'opacity', 'scale_factor', 'preset', 'quality')
+
+# 规划结果
+Plan = namedtuple('Plan', [
+    'jobs',        # list, 需要渲染的任务 (已排序)
+    'duplicates',  # dict, {渲染任务的 output_path: [输出相同的其他任务]}
+    'stats',       # dict, total, rendered, duplicates, duplicate_backgrounds, duplicate_elements, hash_ms
+])
+
+
+def _digest(path, digests):
+    if path not in digests:
+        try:
+            digests[path] = render_cache.file_digest(path)
+        except OSError:
+            digests[path] = None
+    return digests[path]
+
+
+def _image_size(path):
+    """只读取文件头获取图片尺寸，无法识别时返回 (0, 0)"""
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, ValueError):
+        return (0, 0)
+
+
+def work_key(job, option_keys=(), digests=None):
+    """
+    任务的工作键：输入文件内容、封面文字、影响输出的参数和输出格式都相同的任务，输出必然相同
+
+    输入文件无法读取时返回 None，此类任务不参与合并
+    """
+    digests = {} if digests is None else digests
+    background = _digest(job['background_path'], digests)
+    element = _digest(job['element_path'], digests) if job.get('element_path') else ''
+    if background is None or element is None:
+        return None
+    texts = tuple(job['texts']) if job.get('texts') else None
+    options = tuple(repr(job.get(key)) for key in option_keys)
+    return (background, element, texts, options, image_io.output_format(job['output_path'], 'JPEG'))
+
+
+def plan_jobs(jobs, option_keys=()):
+    """
+    合并输出相同的任务，并按复用解码结果的顺序排列需要渲染的任务
+
+    Args:
+        jobs: 任务列表，每项至少包含 background_path, output_path，以及可选的 element_path, texts
+        option_keys: 任务中影响输出的其他参数名，如 OVERLAY_OPTIONS
+
+    Returns:
+        Plan: 需要渲染的任务、重复的任务和统计信息。渲染任务是原任务的副本，
+              输入路径统一为同一内容第一次出现的路径，并在下一个任务使用同一背景时
+              标记 keep_background
+    """
+    start = time.perf_counter()
+    digests = {}
+    canonical = {}
+    groups = {}
+    rendered = []
+    for job in jobs:
+        key = work_key(job, option_keys, digests)
+        if key is not None and key in groups:
+            groups[key].append(job)
+            continue
+        job = dict(job)
+        for field in ('background_path', 'element_path'):
+            digest = digests.get(job.get(field))
+            if digest is not None:
+                job[field] = canonical.setdefault(digest, job[field])
+        rendered.append((key, job))
+        if key is not None:
+            groups[key] = [job]
+
+    sizes = {}
+    for key, job in rendered:
+        if job['background_path'] not in sizes:
+            sizes[job['background_path']] = _image_size(job['background_path'])
+    rendered.sort(key=lambda item: (sizes[item[1]['background_path']], item[1]['background_path'],
+                                    item[1].get('element_path') or '', repr(item[1].get('texts'))))
+
+    duplicates = {}
+    for key, job in rendered:
+        if key is not None and len(groups[key]) > 1:
+            duplicates.setdefault(job['output_path'], []).extend(groups[key][1:])
+    ordered = [job for _, job in rendered]
+    for job, next_job in zip(ordered, ordered[1:]):
+        job['keep_background'] = job['background_path'] == next_job['background_path']
+
+    def repeated(field):
+        paths = {job[field] for job in jobs if job.get(field)}
+        return len(paths) - len({digests.get(path) or path for path in paths})
+
+    stats = {
+        'total': len(jobs),
+        'rendered': len(ordered),
+        'duplicates': len(jobs) - len(ordered),
+        'duplicate_backgrounds': repeated('background_path'),
+        'duplicate_elements': repeated('element_path'),
+        'hash_ms': round((time.perf_counter() - start) * 1000, 2),
+    }
+    return Plan(ordered, duplicates, stats)
+
+
+def background_runs(jobs, workers=1):
+    """
+    把使用同一背景的相邻任务分为一组，供进程池整组派发给同一个工作进程
+
+    一组最多 ceil(任务数 / workers) 个任务，背景很少时仍能让所有工作进程都有活干。
+    每组最后一个任务的 keep_background 被清除 (返回副本)：下一个任务在另一组，
+    可能由其他进程处理，保留背景只会多一次整图复制并让解码结果常驻内存。
+
+    Returns:
+        list: [[任务, ...], ...]，保持原有顺序
+    """
+    max_run = max(1, -(-len(jobs) // max(1, workers)))
+    runs = []
+    for job in jobs:
+        if runs and len(runs[-1]) < max_run and runs[-1][-1]['background_path'] == job['background_path']:
+            runs[-1].append(job)
+        else:
+            runs.append([job])
+    for run in runs:
+        if run[-1].get('keep_background'):
+            run[-1] = dict(run[-1], keep_background=False)
+    return runs
+
+
+def materialize(plan, output_path):
+    """
+    渲染任务成功后，为输出相同的其他任务生成输出文件 (硬链接，跨文件系统时复制)
+
+    Returns:
+        list: [(任务, 错误信息或 None)]
+    """
+    results = []
+    for job in plan.duplicates.get(output_path, ()):
+        error = None
+        if os.path.abspath(job['output_path']) != os.path.abspath(output_path):
+            try:
+                render_cache.link_or_copy(output_path, job['output_path'])
+            except OSError as e:
+                error = f"{type(e).__name__}: {e}"
+        results.append((job, error))
+    return results
+
+
+def format_stats(stats):
+    """把 plan_jobs 的统计格式化为一行摘要"""
+    saved = stats['duplicates'] / stats['total'] if stats['total'] else 0.0
+    return (f"任务规划: {stats['total']} 个任务只需渲染 {stats['rendered']} 次，"
+            f"{stats['duplicates']} 个重复输出用硬链接生成 (节省 {saved:.1%})；"
+            f"内容重复的背景 {stats['duplicate_backgrounds']} 张、元素 {stats['duplicate_elements']} 个，"
+            f"计算摘要耗时 {stats['hash_ms']:.0f}ms")
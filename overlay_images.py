@@ -7,91 +7,492 @@
 
 import os
 import sys
+import json
+import time
+import hashlib
+import functools
+import multiprocessing
+from collections import OrderedDict
 from PIL import Image
 import argparse
 
-def overlay_images(background_path, element_path, output_path, position=(0, 0), opacity=1.0, scale_factor=1.0):
+import image_io
+import instrumentation
+import job_planner
+import render_cache
+
+# 解码后的元素图片和按背景尺寸预缩放后的元素图片都缓存在进程内，
+# 同一个元素叠加到多张背景上时只需解码、缩放一次
+_MAX_CACHED_ELEMENTS = 64
+_decoded_elements = OrderedDict()
+_prepared_elements = OrderedDict()
+
+# 保留给同一背景下一个任务的解码结果 (最多一张)，见 load_background
+_kept_background = {}
+
+
+def _cache_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _cache_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _MAX_CACHED_ELEMENTS:
+        cache.popitem(last=False)
+
+
+def load_element(element_path):
+    """解码元素图片 (RGBA)，按路径和修改时间缓存"""
+    key = (element_path, os.path.getmtime(element_path))
+    element = _cache_get(_decoded_elements, key)
+    if element is None:
+        element = Image.open(element_path).convert('RGBA')
+        _cache_put(_decoded_elements, key, element)
+    return element
+
+
+def load_background(background_path, stats=None, keep=False):
+    """
+    解码背景图片，返回可以原地修改的图片
+
+    上一个任务以 keep=True 保留的同一背景直接复用，不再解码。keep=True 时保留这次的解码结果
+    并返回副本，供紧接着处理同一背景的任务使用 (job_planner 会按背景排序并设置该标记)；
+    keep=False 时不保留，也不多做一次复制
+    """
+    stat = os.stat(background_path)
+    key = (background_path, stat.st_size, stat.st_mtime_ns)
+    start = time.perf_counter()
+    background = _kept_background.pop(key, None)
+    _kept_background.clear()
+    if background is None:
+        background = image_io.open_image(background_path, stats=stats)
+    else:
+        instrumentation.count('background_reuses')
+        if stats is not None:
+            stats['source_size'] = background.size
+    if keep:
+        _kept_background[key] = background
+        background = background.copy()
+    if stats is not None:
+        stats['decode_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return background
+
+
+def opacity_lut(opacity):
+    """透明度查找表：alpha 通道的 256 个取值一次算好，交给 PIL 在C层按表映射"""
+    return [int(p * opacity) for p in range(256)]
+
+
+def prepare_element(element_path, background_size, scale_factor=1.0, opacity=1.0):
+    """
+    获取按背景尺寸缩放、应用透明度并预合成好的元素图层
+
+    返回的图层等价于把元素以自身为蒙版粘贴到同尺寸的透明画布上，
+    可直接用 alpha_composite 合成到背景的对应区域。
+    结果按 (元素, 背景尺寸, 缩放比例, 透明度) 缓存，调用方不应修改返回的图片
+    """
+    key = (element_path, os.path.getmtime(element_path), background_size, scale_factor, opacity)
+    element = _cache_get(_prepared_elements, key)
+    if element is not None:
+        instrumentation.count('element_cache_hits')
+        return element
+    instrumentation.count('element_cache_misses')
+
+    element = load_element(element_path)
+
+    # 应用用户指定的缩放比例
+    if scale_factor != 1.0:
+        new_size = (int(element.size[0] * scale_factor), 
+                   int(element.size[1] * scale_factor))
+        element = element.resize(new_size, Image.Resampling.LANCZOS)
+    
+    # 如果元素图片比背景图片大，调整元素图片大小
+    if element.size[0] > background_size[0] or element.size[1] > background_size[1]:
+        # 计算缩放比例，保持宽高比
+        fit_scale_factor = min(background_size[0] / element.size[0], 
+                         background_size[1] / element.size[1])
+        new_size = (int(element.size[0] * fit_scale_factor * 0.8),  # 稍微缩小一点
+                   int(element.size[1] * fit_scale_factor * 0.8))
+        element = element.resize(new_size, Image.Resampling.LANCZOS)
+
+    # 调整元素透明度
+    if opacity < 1.0:
+        if element is load_element(element_path):
+            element = element.copy()
+        # 创建一个新的alpha通道
+        alpha = element.getchannel('A')
+        alpha = alpha.point(opacity_lut(opacity))
+        element.putalpha(alpha)
+
+    # 将元素图片粘贴到与元素同尺寸的透明图层上
+    tile = Image.new('RGBA', element.size, (0, 0, 0, 0))
+    tile.paste(element, (0, 0), element)
+
+    _cache_put(_prepared_elements, key, tile)
+    return tile
+
+
+def composite_region(background, tile, position, tile_rows=None):
+    """
+    把图层原地合成到背景 (RGB 或 RGBA) 上，只处理两者重叠的区域
+
+    指定 tile_rows 时按条带逐块合成 (见 image_io.alpha_composite)
+
+    Returns:
+        bool: 图层与背景是否有重叠
+    """
+    left = max(0, position[0])
+    top = max(0, position[1])
+    right = min(background.size[0], position[0] + tile.size[0])
+    bottom = min(background.size[1], position[1] + tile.size[1])
+    if right <= left or bottom <= top:
+        return False
+    source = (left - position[0], top - position[1], right - position[0], bottom - position[1])
+    image_io.alpha_composite(background, tile, dest=(left, top), source=source, tile_rows=tile_rows)
+    return True
+
+
+def resolve_position(position, background_size, element_size):
+    """把预设位置字符串或 (0, 0) 换算成元素左上角的坐标"""
+    if isinstance(position, str):
+        if position == 'center':
+            position = ((background_size[0] - element_size[0]) // 2,
+                       (background_size[1] - element_size[1]) // 2)
+        elif position == 'top-left':
+            position = (0, 0)
+        elif position == 'top-right':
+            position = (background_size[0] - element_size[0], 0)
+        elif position == 'bottom-left':
+            position = (0, background_size[1] - element_size[1])
+        elif position == 'bottom-right':
+            position = (background_size[0] - element_size[0], 
+                       background_size[1] - element_size[1])
+        else:
+            position = ((background_size[0] - element_size[0]) // 2,
+                       (background_size[1] - element_size[1]) // 2)
+    elif tuple(position) == (0, 0):
+        # 如果位置是(0, 0) (或清单中的 [0, 0])，则居中放置元素
+        position = ((background_size[0] - element_size[0]) // 2,
+                   (background_size[1] - element_size[1]) // 2)
+    return position
+
+
+def parse_position(position_str):
+    """
+    把命令行或任务清单中的位置参数转换为 overlay_images 接受的格式
+
+    清单 (JSON) 中的坐标是列表，如 [0, 0]，与元组 (0, 0) 一样处理 ((0, 0) 表示居中)
+    """
+    if not isinstance(position_str, str):
+        try:
+            x, y = map(int, position_str)
+            return (x, y)
+        except (TypeError, ValueError):
+            print(f"警告: 无效的位置格式 '{position_str}'，使用居中")
+            return (0, 0)
+    if position_str == 'center':
+        return (0, 0)
+    if position_str in ('top-left', 'top-right', 'bottom-left', 'bottom-right'):
+        return position_str
+    if ',' in position_str:
+        try:
+            x, y = map(int, position_str.split(','))
+            return (x, y)
+        except ValueError:
+            print(f"警告: 无效的位置格式 '{position_str}'，使用居中")
+            return (0, 0)
+    print(f"警告: 未知的位置 '{position_str}'，使用居中")
+    return (0, 0)
+
+
+def overlay_element(background, element_path, position=(0, 0), opacity=1.0, scale_factor=1.0, memory_budget=None):
+    """
+    在已加载的背景图片 (RGB 或 RGBA) 上原地叠加元素图片，参数含义同 overlay_images
+
+    Returns:
+        Image: 传入的背景图片
+    """
+    # 获取解码、缩放、调整过透明度并预合成的元素图层
+    with instrumentation.span('prepare_element'):
+        tile = prepare_element(element_path, background.size, scale_factor, opacity)
+    
+    # 处理预设位置
+    position = resolve_position(position, background.size, tile.size)
+    
+    # 只在元素覆盖的区域内原地叠加，不再创建与背景同尺寸的透明画布
+    tile_rows = image_io.tile_rows(background, memory_budget)
+    with instrumentation.span('composite'):
+        composite_region(background, tile, position, tile_rows)
+    return background
+
+
+def overlay_images(background_path, element_path, output_path, position=(0, 0), opacity=1.0, scale_factor=1.0,
+                   preset=None, quality=95, stats=None, cache=None, memory_budget=None, keep_background=False):
     """
     在背景图片上叠加元素图片
     
     Args:
         background_path: 背景图片路径
         element_path: 元素图片路径（PNG格式，支持透明度）
-        output_path: 输出图片路径
+        output_path: 输出图片路径 (按扩展名选择 JPEG/PNG/WebP/AVIF，无法识别时使用 JPEG)
         position: 元素图片在背景上的位置 (x, y) 或预设位置字符串
         opacity: 元素图片的透明度 (0.0-1.0)
         scale_factor: 元素缩放比例 (0.1-2.0，1.0为原比例)
+        preset: (可选) image_io.ENCODER_PRESETS 中的编码预设
+        quality: 有损格式的编码质量，None 表示使用预设中的值 (默认: 95)
+        stats: (可选) 统计字典，写入 decode_ms, encode_ms, output_bytes
+        cache: (可选) render_cache.RenderCache，输入完全相同时直接复用之前的输出
+        memory_budget: (可选) 单张图片的内存预算 (字节)，指定后按条带分块合成 (结果相同)
+        keep_background: 保留解码后的背景给下一个同背景的任务 (见 load_background，指定内存预算时忽略)
     """
+    with instrumentation.image_scope('overlay', background_path=background_path,
+                                     element_path=element_path, output_path=output_path) as scope:
+        try:
+            # 查询渲染缓存
+            cache_key = None
+            output_format = image_io.output_format(output_path, 'JPEG')
+            if cache is not None:
+                with instrumentation.span('cache_lookup'):
+                    cache_key = render_cache.overlay_key(
+                        background_path, element_path, output_format, position=position, opacity=opacity,
+                        scale_factor=scale_factor, preset=preset, quality=quality)
+                    output_bytes = cache.fetch(cache_key, output_path)
+                if output_bytes is not None:
+                    if stats is not None:
+                        stats.update(decode_ms=0.0, encode_ms=0.0, output_bytes=output_bytes, cache_hit=True)
+                    print(f"✓ 从缓存生成: {output_path}")
+                    scope.set(success=True, cache_hit=True)
+                    return True
+
+            # 打开背景图片 (不透明的背景保持 RGB，只在元素覆盖的区域转换)
+            with instrumentation.span('decode'):
+                background = load_background(background_path, stats, keep_background and not memory_budget)
+            
+            # 叠加元素
+            overlay_element(background, element_path, position, opacity, scale_factor, memory_budget)
+            
+            # 去掉透明通道并保存
+            with instrumentation.span('encode'):
+                if background.mode != 'RGB':
+                    background = background.convert('RGB')
+                image_io.save_image(background, output_path, output_format, preset, quality, stats)
+            if cache_key is not None:
+                cache.store(cache_key, output_path)
+            
+            print(f"✓ 成功生成: {output_path}")
+            scope.set(success=True)
+            return True
+            
+        except Exception as e:
+            print(f"✗ 处理失败 {background_path}: {str(e)}")
+            scope.set(success=False, error=f"{type(e).__name__}: {e}")
+            return False
+
+
+# =============================================================================
+# 批量处理：增量跳过与并行执行
+# =============================================================================
+STATE_FILENAME = '.overlay_state.json'
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _input_fingerprint(path, use_hash, digest_cache):
+    """输入文件的指纹：默认使用大小和修改时间，use_hash 时使用内容哈希"""
+    if use_hash:
+        if path not in digest_cache:
+            digest_cache[path] = _file_digest(path)
+        return digest_cache[path]
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def job_signature(job, use_hash=False, digest_cache=None):
+    """任务签名：输入文件指纹和叠加参数都不变时，已有的输出即为最新"""
+    if digest_cache is None:
+        digest_cache = {}
+    parts = [
+        _input_fingerprint(job['background_path'], use_hash, digest_cache),
+        _input_fingerprint(job['element_path'], use_hash, digest_cache),
+        repr(job['position']),
+        repr(job['opacity']),
+        repr(job['scale_factor']),
+        repr((job.get('preset'), job.get('quality', 95))),
+    ]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def load_state(output_dir):
+    """读取输出目录中记录的 {输出文件名: 任务签名}"""
     try:
-        # 打开背景图片
-        background = Image.open(background_path).convert('RGBA')
-        
-        # 打开元素图片
-        element = Image.open(element_path).convert('RGBA')
-        
-        # 应用用户指定的缩放比例
-        if scale_factor != 1.0:
-            new_size = (int(element.size[0] * scale_factor), 
-                       int(element.size[1] * scale_factor))
-            element = element.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # 如果元素图片比背景图片大，调整元素图片大小
-        if element.size[0] > background.size[0] or element.size[1] > background.size[1]:
-            # 计算缩放比例，保持宽高比
-            fit_scale_factor = min(background.size[0] / element.size[0], 
-                             background.size[1] / element.size[1])
-            new_size = (int(element.size[0] * fit_scale_factor * 0.8),  # 稍微缩小一点
-                       int(element.size[1] * fit_scale_factor * 0.8))
-            element = element.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # 处理预设位置
-        if isinstance(position, str):
-            if position == 'center':
-                position = ((background.size[0] - element.size[0]) // 2,
-                           (background.size[1] - element.size[1]) // 2)
-            elif position == 'top-left':
-                position = (0, 0)
-            elif position == 'top-right':
-                position = (background.size[0] - element.size[0], 0)
-            elif position == 'bottom-left':
-                position = (0, background.size[1] - element.size[1])
-            elif position == 'bottom-right':
-                position = (background.size[0] - element.size[0], 
-                           background.size[1] - element.size[1])
+        with open(os.path.join(output_dir, STATE_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(output_dir, state):
+    state_path = os.path.join(output_dir, STATE_FILENAME)
+    tmp_path = state_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, state_path)
+    except OSError as e:
+        print(f"警告: 保存增量状态失败: {e}")
+
+
+def _run_job(job, cache=None):
+    stats = {}
+    success = overlay_images(
+        job['background_path'],
+        job['element_path'],
+        job['output_path'],
+        job['position'],
+        job['opacity'],
+        job['scale_factor'],
+        job.get('preset'),
+        job.get('quality', 95),
+        stats,
+        cache,
+        job.get('memory_budget'),
+        job.get('keep_background', False)
+    )
+    return job['output_path'], success, stats
+
+
+def _run_job_run(jobs, cache=None):
+    """在同一个工作进程中依次执行使用同一背景的一组任务"""
+    return [_run_job(job, cache) for job in jobs]
+
+
+def run_jobs(jobs, output_dir, workers=1, force=False, use_hash=False, cache=None, async_io=False,
+             io_workers=None, dedupe=False):
+    """
+    执行叠加任务：跳过输出已是最新的任务，其余任务交给进程池并行处理
+
+    Args:
+        jobs: 任务列表，每项包含 background_path, element_path, output_path, position, opacity, scale_factor，
+              以及可选的 preset, quality, memory_budget
+        output_dir: 输出目录 (增量状态文件保存在这里)
+        workers: 并行进程数，0表示使用全部CPU核心
+        force: 忽略增量状态，全部重新生成
+        use_hash: 用文件内容哈希 (而非大小和修改时间) 判断输入是否变化
+        cache: (可选) render_cache.RenderCache，跨目录复用相同输入的输出 (async_io 模式下不使用)
+        async_io: 使用 async_runner 让读写与渲染重叠进行 (适合网络存储)
+        io_workers: async_io 模式下并发读写的线程数 (默认: async_runner.DEFAULT_IO_WORKERS)
+        dedupe: 用 job_planner 合并输出相同的任务，重复的输出用硬链接生成
+
+    Returns:
+        dict: 统计信息，包含 total, success, failed, skipped, elapsed，
+              以及成功任务的解码/编码总耗时 decode_ms, encode_ms、输出总字节数 output_bytes、
+              命中渲染缓存的任务数 cache_hits 和用硬链接生成的任务数 linked
+    """
+    start = time.perf_counter()
+    state = {} if force else load_state(output_dir)
+    digest_cache = {}
+
+    pending = []
+    signatures = {}
+    skipped = 0
+    for job in jobs:
+        output_name = os.path.basename(job['output_path'])
+        signature = job_signature(job, use_hash, digest_cache)
+        signatures[output_name] = signature
+        if state.get(output_name) == signature and os.path.exists(job['output_path']):
+            skipped += 1
+            continue
+        pending.append(job)
+
+    if skipped:
+        print(f"跳过 {skipped} 张已是最新的图片")
+
+    plan = None
+    if dedupe and pending:
+        plan = job_planner.plan_jobs(pending, job_planner.OVERLAY_OPTIONS)
+        print(job_planner.format_stats(plan.stats))
+        work = plan.jobs
+    else:
+        # 按元素排序，让同一元素的任务尽量落在同一个工作进程里复用预缩放结果
+        work = sorted(pending, key=lambda job: (job['element_path'], job['background_path']))
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    success_count = 0
+    io_totals = {'decode_ms': 0.0, 'encode_ms': 0.0, 'output_bytes': 0, 'cache_hits': 0, 'linked': 0}
+    run_job = functools.partial(_run_job, cache=cache)
+    pool = None
+    if async_io:
+        # async_runner 依赖本模块，在用到时再导入以避免循环导入
+        import async_runner
+        summary = async_runner.run_jobs(work, workers=workers,
+                                        io_workers=io_workers or async_runner.DEFAULT_IO_WORKERS)
+        results = ((r['output_path'], r['success'], r) for r in summary['results'])
+    elif workers == 1 or len(work) <= 1:
+        results = map(run_job, work)
+    else:
+        # 同一背景的任务整组交给一个工作进程，keep_background 的复用不会被拆散
+        runs = job_planner.background_runs(work, workers)
+        chunksize = max(1, min(16, len(runs) // (workers * 4)))
+        pool = multiprocessing.Pool(workers, initializer=instrumentation.init_worker,
+                                    initargs=(instrumentation.settings(),))
+        run_group = functools.partial(_run_job_run, cache=cache)
+        results = (result for group in pool.imap_unordered(run_group, runs, chunksize) for result in group)
+
+    try:
+        for output_path, success, job_stats in results:
+            output_name = os.path.basename(output_path)
+            if success:
+                success_count += 1
+                for key in ('decode_ms', 'encode_ms', 'output_bytes'):
+                    io_totals[key] += job_stats.get(key, 0)
+                io_totals['cache_hits'] += 1 if job_stats.get('cache_hit') else 0
+                state[output_name] = signatures[output_name]
             else:
-                position = ((background.size[0] - element.size[0]) // 2,
-                           (background.size[1] - element.size[1]) // 2)
-        elif position == (0, 0):
-            # 如果位置是(0, 0)，则居中放置元素
-            position = ((background.size[0] - element.size[0]) // 2,
-                       (background.size[1] - element.size[1]) // 2)
-        
-        # 调整元素透明度
-        if opacity < 1.0:
-            # 创建一个新的alpha通道
-            alpha = element.split()[-1]
-            alpha = alpha.point(lambda p: int(p * opacity))
-            element.putalpha(alpha)
-        
-        # 创建一个新的透明背景，大小与背景图片相同
-        overlay = Image.new('RGBA', background.size, (0, 0, 0, 0))
-        
-        # 将元素图片粘贴到透明背景上
-        overlay.paste(element, position, element)
-        
-        # 将元素叠加到背景图片上
-        result = Image.alpha_composite(background, overlay)
-        
-        # 转换回RGB模式并保存
-        final_result = result.convert('RGB')
-        final_result.save(output_path, 'JPEG', quality=95)
-        
-        print(f"✓ 成功生成: {output_path}")
-        return True
-        
-    except Exception as e:
-        print(f"✗ 处理失败 {background_path}: {str(e)}")
-        return False
+                state.pop(output_name, None)
+            if plan is None:
+                continue
+            # 重复的任务跟随渲染任务的结果，渲染成功时用硬链接生成输出
+            if success:
+                duplicates = job_planner.materialize(plan, output_path)
+            else:
+                duplicates = [(job, '渲染任务失败') for job in plan.duplicates.get(output_path, ())]
+            for job, error in duplicates:
+                duplicate_name = os.path.basename(job['output_path'])
+                if error is None:
+                    success_count += 1
+                    io_totals['linked'] += 1
+                    state[duplicate_name] = signatures[duplicate_name]
+                else:
+                    print(f"✗ 处理失败 {job['output_path']}: {error}")
+                    state.pop(duplicate_name, None)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        save_state(output_dir, state)
+
+    elapsed = time.perf_counter() - start
+    return {
+        'total': len(jobs),
+        'success': success_count,
+        'failed': len(pending) - success_count,
+        'skipped': skipped,
+        'elapsed': elapsed,
+        **io_totals,
+    }
+
 
 def main():
     # 设置默认路径
@@ -100,9 +501,6 @@ def main():
     element_dir = os.path.join(base_dir, "img-element")
     output_dir = os.path.join(base_dir, "img-output")
     
-    # 创建输出目录
-    os.makedirs(output_dir, exist_ok=True)
-    
     # 命令行参数解析
     parser = argparse.ArgumentParser(description='图片叠加工具')
     parser.add_argument('--background_dir', type=str, default=background_dir,
@@ -117,8 +515,34 @@ def main():
                        help='元素透明度 (0.0-1.0)')
     parser.add_argument('--resize_factor', type=float, default=1.0,
                        help='元素缩放因子 (0.1-2.0)')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='并行进程数，0表示使用全部CPU核心 (默认: 1)')
+    parser.add_argument('--force', action='store_true',
+                       help='忽略增量状态，重新生成所有图片')
+    parser.add_argument('--hash_inputs', action='store_true',
+                       help='用文件内容哈希判断输入是否变化 (默认使用文件大小和修改时间)')
+    parser.add_argument('--async_io', action='store_true',
+                       help='读写与渲染重叠进行，适合背景和输出位于网络存储的情况')
+    parser.add_argument('--io_workers', type=int, default=None,
+                       help='--async_io 模式下并发读写的线程数 (默认: 8)')
+    parser.add_argument('--dedupe', action='store_true',
+                       help='按内容合并输出相同的任务，只渲染一次，重复的输出用硬链接生成')
+    parser.add_argument('--format', type=str, default='jpg', choices=['jpg', 'png', 'webp', 'avif'],
+                       help='输出图片格式 (默认: jpg)')
+    parser.add_argument('--preset', type=str, default=None, choices=sorted(image_io.ENCODER_PRESETS),
+                       help='编码预设 (默认: Pillow 默认参数)')
+    parser.add_argument('--quality', type=int, default=None,
+                       help='有损格式的编码质量 (默认: 95，指定 --preset 时使用预设中的值)')
+    parser.add_argument('--memory_budget_mb', type=int, default=None,
+                       help='(可选) 单张图片的内存预算，MB；指定后按条带分块合成，输出不变')
+    render_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     
     args = parser.parse_args()
+    instrumentation.enable_from_args(args)
+    
+    # 创建输出目录
+    os.makedirs(args.output_dir, exist_ok=True)
     
     # 验证输入目录是否存在
     if not os.path.exists(args.background_dir):
@@ -154,57 +578,55 @@ def main():
     print(f"输出目录: {args.output_dir}")
     print("-" * 50)
     
-    # 解析位置参数
-    position_map = {
-        'center': (0, 0),
-        'top-left': None,
-        'top-right': None,
-        'bottom-left': None,
-        'bottom-right': None
-    }
-    
-    # 处理每个背景图片
-    success_count = 0
-    total_count = 0
+    # 未指定预设时保持原来的 JPEG 质量 95
+    quality = args.quality if args.quality is not None or args.preset else 95
+
+    # 确定位置 (所有任务共用)
+    position = parse_position(args.position)
     
+    # 生成 背景 × 元素 的全部任务
+    jobs = []
     for bg_file in background_files:
         for element_file in element_files:
-            total_count += 1
-            
-            bg_path = os.path.join(args.background_dir, bg_file)
-            element_path = os.path.join(args.element_dir, element_file)
-            
             # 生成输出文件名
             bg_name = os.path.splitext(bg_file)[0]
             element_name = os.path.splitext(element_file)[0]
-            output_filename = f"{bg_name}_with_{element_name}.jpg"
-            output_path = os.path.join(args.output_dir, output_filename)
-            
-            # 确定位置
-            if args.position in position_map:
-                if args.position == 'center':
-                    position = (0, 0)
-                else:
-                    # 直接传递位置字符串给overlay_images函数处理
-                    position = args.position
-            elif ',' in args.position:
-                # 自定义坐标
-                try:
-                    x, y = map(int, args.position.split(','))
-                    position = (x, y)
-                except ValueError:
-                    print(f"警告: 无效的位置格式 '{args.position}'，使用居中")
-                    position = (0, 0)
-            else:
-                print(f"警告: 未知的位置 '{args.position}'，使用居中")
-                position = (0, 0)
-            
-            # 执行叠加
-            if overlay_images(bg_path, element_path, output_path, position, args.opacity, args.resize_factor):
-                success_count += 1
+            output_filename = f"{bg_name}_with_{element_name}.{args.format}"
+            jobs.append({
+                'background_path': os.path.join(args.background_dir, bg_file),
+                'element_path': os.path.join(args.element_dir, element_file),
+                'output_path': os.path.join(args.output_dir, output_filename),
+                'position': position,
+                'opacity': args.opacity,
+                'scale_factor': args.resize_factor,
+                'preset': args.preset,
+                'quality': quality,
+                'memory_budget': args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None,
+            })
+    
+    # 执行叠加
+    cache = render_cache.from_args(args)
+    if cache is not None and args.async_io:
+        print("警告: --async_io 模式下不使用渲染缓存")
+        cache = None
+    stats = run_jobs(jobs, args.output_dir, args.workers, args.force, args.hash_inputs, cache,
+                     args.async_io, args.io_workers, args.dedupe)
     
+    processed = stats['success'] + stats['failed']
+    throughput = processed / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
     print("-" * 50)
-    print(f"处理完成! 成功生成 {success_count}/{total_count} 张图片")
+    print(f"处理完成! 成功生成 {stats['success']}/{processed} 张图片, 跳过 {stats['skipped']} 张已是最新的图片")
+    print(f"总耗时 {stats['elapsed']:.2f}s, 吞吐量 {throughput:.1f} 张/秒")
+    rendered = stats['success'] - stats['cache_hits'] - stats['linked']
+    if rendered:
+        print(f"平均解码 {stats['decode_ms'] / rendered:.1f}ms, "
+              f"平均编码 {stats['encode_ms'] / rendered:.1f}ms, "
+              f"输出共 {stats['output_bytes'] / 1024 / 1024:.1f}MB")
+    if stats['linked']:
+        print(f"去重: {stats['linked']} 张图片用硬链接生成，未重复渲染")
+    if cache is not None:
+        print(f"渲染缓存: 本次命中 {stats['cache_hits']}/{processed} 张")
+        print(render_cache.format_stats(cache.stats()))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
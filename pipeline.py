@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+封面流水线脚本
+把 "元素叠加 (overlay_images.py) → 封面文字 (stable_script.py) → 分组提取 (extract_groups.py)"
+合并为一次处理：每张图片只解码一次、编码一次，文字在内存中直接画到叠加结果上，
+分组信息在写出文件时同步记录，最后直接生成 filename_groups.json，无需再扫描输出目录。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict
+
+import async_runner
+import image_io
+import job_planner
+import style_cache
+from extract_groups import extract_group_name, save_to_json, sort_groups
+from overlay_images import load_background, overlay_element, parse_position
+from stable_script import add_font_arguments, render_cover, resolve_font_paths
+
+BACKGROUND_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+
+def build_jobs(background_dir, element_dir, output_dir, texts, texts_map=None, extension='jpg'):
+    """
+    生成 背景 × 元素 的全部任务，输出文件名与 overlay_images.py 一致: {背景名}_with_{元素名}.jpg
+
+    Args:
+        texts: 默认的封面文字列表 (为空时只做元素叠加)
+        texts_map: (可选) {元素名: 文字列表}，为特定元素指定不同的封面文字
+        extension: 输出文件的扩展名，决定编码格式 (jpg, png, webp, avif)
+    """
+    background_files = sorted(f for f in os.listdir(background_dir) if f.lower().endswith(BACKGROUND_EXTENSIONS))
+    element_files = sorted(f for f in os.listdir(element_dir) if f.lower().endswith('.png'))
+    texts_map = texts_map or {}
+
+    jobs = []
+    for element_file in element_files:
+        element_name = os.path.splitext(element_file)[0]
+        for bg_file in background_files:
+            bg_name = os.path.splitext(bg_file)[0]
+            jobs.append({
+                'background_path': os.path.join(background_dir, bg_file),
+                'element_path': os.path.join(element_dir, element_file),
+                'output_path': os.path.join(output_dir, f"{bg_name}_with_{element_name}.{extension}"),
+                'texts': texts_map.get(element_name, texts),
+            })
+    return jobs
+
+
+def process_image(job, styles, font_paths, position=(0, 0), opacity=1.0, scale_factor=1.0, quality=95, preset=None,
+                  memory_budget=None):
+    """
+    处理单张图片：解码背景 → 叠加元素 → 渲染文字 → 编码写出，全程只在内存中传递图片
+
+    memory_budget 为单张图片的内存预算 (字节)，指定后叠加和文字都按条带分块合成
+
+    Returns:
+        dict: 包含 output_path, group, success, error 的结果，成功时还包含 decode_ms, encode_ms, output_bytes
+    """
+    output_name = os.path.basename(job['output_path'])
+    result = {
+        'output_path': job['output_path'],
+        'group': extract_group_name(output_name),
+        'success': False,
+        'error': None,
+    }
+    stats = {}
+    try:
+        image = load_background(job['background_path'], stats, job.get('keep_background', False) and not memory_budget)
+        overlay_element(image, job['element_path'], position, opacity, scale_factor, memory_budget)
+        if job.get('texts'):
+            render_cover(image, job['texts'], styles, font_paths, memory_budget=memory_budget)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image_io.save_image(image, job['output_path'], image_io.output_format(job['output_path'], 'JPEG'),
+                            preset, quality, stats)
+        stats.pop('source_size', None)
+        result.update(stats)
+        result['success'] = True
+        print(f"✓ 成功生成: {job['output_path']}")
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        print(f"✗ 处理失败 {job['output_path']}: {result['error']}")
+    return result
+
+
+# 工作进程内常驻的状态，由 _init_worker 在进程启动时填充一次
+_worker_state = {}
+
+
+def _init_worker(style_css, font_paths, options):
+    _worker_state['styles'] = style_cache.load_styles(style_css)
+    _worker_state['font_paths'] = font_paths
+    _worker_state['options'] = options
+
+
+def _process_in_worker(job):
+    return process_image(job, _worker_state['styles'], _worker_state['font_paths'], **_worker_state['options'])
+
+
+def _process_run_in_worker(jobs):
+    """在同一个工作进程中依次处理使用同一背景的一组任务"""
+    return [_process_in_worker(job) for job in jobs]
+
+
+def run_pipeline(jobs, style_css, font_paths, workers=1, async_io=False,
+                 io_workers=async_runner.DEFAULT_IO_WORKERS, dedupe=False, **options):
+    """
+    执行流水线，并在写出文件的同时收集分组信息
+
+    Args:
+        async_io: 使用 async_runner 让读写与渲染重叠进行 (适合网络存储)
+        io_workers: async_io 模式下并发读写的线程数
+        dedupe: 用 job_planner 合并输出相同的任务 (相同的背景内容、元素和文字)，重复的输出用硬链接生成
+        options: 传给 process_image 的叠加/编码参数 (position, opacity, scale_factor, quality, preset, memory_budget)
+
+    Returns:
+        tuple: (results, groups)，groups 为排序后的 {分组名: [文件名]}；
+               用硬链接生成的结果带有 linked=True
+    """
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    groups = defaultdict(list)
+    results = []
+    plan = None
+    if dedupe and jobs:
+        plan = job_planner.plan_jobs(jobs)
+        print(job_planner.format_stats(plan.stats))
+        jobs = plan.jobs
+
+    def record(result):
+        results.append(result)
+        if result['success'] and result['group'] is not None:
+            groups[result['group']].append(os.path.basename(result['output_path']))
+
+    def collect(result):
+        record(result)
+        if plan is None:
+            return
+        # 重复的任务跟随渲染任务的结果，渲染成功时用硬链接生成输出
+        if result['success']:
+            duplicates = job_planner.materialize(plan, result['output_path'])
+        else:
+            duplicates = [(job, '渲染任务失败') for job in plan.duplicates.get(result['output_path'], ())]
+        for job, error in duplicates:
+            output_name = os.path.basename(job['output_path'])
+            duplicate = {'output_path': job['output_path'], 'group': extract_group_name(output_name),
+                         'success': error is None, 'error': error, 'linked': True}
+            if error is None:
+                duplicate.update(decode_ms=0.0, encode_ms=0.0, output_bytes=result.get('output_bytes', 0))
+                print(f"✓ 硬链接生成: {job['output_path']}")
+            else:
+                print(f"✗ 处理失败 {job['output_path']}: {error}")
+            record(duplicate)
+
+    if async_io:
+        summary = async_runner.run_jobs(jobs, style_css, font_paths, workers, io_workers=io_workers, **options)
+        for result in summary['results']:
+            result['group'] = extract_group_name(os.path.basename(result['output_path']))
+            collect(result)
+        return results, sort_groups(groups)
+
+    if workers == 1 or len(jobs) <= 1:
+        styles = style_cache.load_styles(style_css)
+        result_iter = (process_image(job, styles, font_paths, **options) for job in jobs)
+        pool = None
+    else:
+        # 同一背景的任务整组交给一个工作进程，keep_background 的复用不会被拆散
+        runs = job_planner.background_runs(jobs, workers)
+        chunksize = max(1, min(16, len(runs) // (workers * 4)))
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(style_css, font_paths, options))
+        result_iter = (result for group in pool.imap_unordered(_process_run_in_worker, runs, chunksize)
+                       for result in group)
+
+    try:
+        for result in result_iter:
+            collect(result)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return results, sort_groups(groups)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='一次完成元素叠加、封面文字和分组提取')
+    parser.add_argument('--background_dir', required=True, help='背景图片目录路径')
+    parser.add_argument('--element_dir', required=True, help='元素图片目录路径')
+    parser.add_argument('--output_dir', required=True, help='输出图片目录路径')
+    parser.add_argument('--texts', default=None, help="""默认封面文字的JSON字符串, e.g., '["line 1", "line 2", "line 3"]'""")
+    parser.add_argument('--texts_map', default=None, help='(可选) JSON文件，格式为 {元素名: 文字列表}，为特定元素指定封面文字')
+    parser.add_argument('--style_css', required=True, help='guangshu_style.css 文件的路径')
+    add_font_arguments(parser)
+    parser.add_argument('--position', type=str, default='center',
+                        help='元素位置 (center, top-left, top-right, bottom-left, bottom-right, 或 x,y 坐标)')
+    parser.add_argument('--opacity', type=float, default=1.0, help='元素透明度 (0.0-1.0)')
+    parser.add_argument('--resize_factor', type=float, default=1.0, help='元素缩放因子 (0.1-2.0)')
+    parser.add_argument('--format', default='jpg', choices=['jpg', 'png', 'webp', 'avif'], help='输出图片格式 (默认: jpg)')
+    parser.add_argument('--preset', default=None, choices=sorted(image_io.ENCODER_PRESETS),
+                        help='(可选) 编码预设，默认使用 Pillow 的默认参数')
+    parser.add_argument('--quality', type=int, default=None, help='有损格式的编码质量 (默认: 95，指定 --preset 时使用预设中的值)')
+    parser.add_argument('--workers', type=int, default=1, help='并行进程数，0表示使用全部CPU核心 (默认: 1)')
+    parser.add_argument('--async_io', action='store_true', help='读写与渲染重叠进行，适合背景和输出位于网络存储的情况')
+    parser.add_argument('--io_workers', type=int, default=async_runner.DEFAULT_IO_WORKERS,
+                        help=f'--async_io 模式下并发读写的线程数 (默认: {async_runner.DEFAULT_IO_WORKERS})')
+    parser.add_argument('--memory_budget_mb', type=int, default=None,
+                        help='(可选) 单张图片的内存预算，MB；指定后按条带分块合成，输出不变')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='按内容合并输出相同的任务 (相同的背景、元素和文字)，只渲染一次，重复的输出用硬链接生成')
+    parser.add_argument('--groups_json', default='./filename_groups.json', help='分组JSON的输出路径 (默认: ./filename_groups.json)')
+
+    args = parser.parse_args()
+
+    try:
+        texts = json.loads(args.texts) if args.texts else None
+        texts_map = None
+        if args.texts_map:
+            with open(args.texts_map, 'r', encoding='utf-8') as f:
+                texts_map = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"错误: 封面文字参数无效: {e}")
+        sys.exit(1)
+
+    for directory in (args.background_dir, args.element_dir):
+        if not os.path.isdir(directory):
+            print(f"错误: 目录不存在: {directory}")
+            sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    font_paths = resolve_font_paths(args)
+    if not font_paths or not style_cache.load_styles(args.style_css):
+        sys.exit(1)
+
+    jobs = build_jobs(args.background_dir, args.element_dir, args.output_dir, texts, texts_map, args.format)
+    if not jobs:
+        print("警告: 没有找到可处理的背景图片或PNG元素")
+        sys.exit(1)
+
+    print(f"共 {len(jobs)} 个任务，输出目录: {args.output_dir}")
+    print("-" * 50)
+
+    start = time.perf_counter()
+    results, groups = run_pipeline(
+        jobs, args.style_css, font_paths, args.workers, args.async_io, args.io_workers, args.dedupe,
+        position=parse_position(args.position),
+        opacity=args.opacity,
+        scale_factor=args.resize_factor,
+        quality=args.quality if args.quality is not None or args.preset else 95,
+        preset=args.preset,
+        memory_budget=args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None,
+    )
+    elapsed = time.perf_counter() - start
+
+    success_count = sum(1 for r in results if r['success'])
+    throughput = len(results) / elapsed if elapsed > 0 else 0.0
+    print("-" * 50)
+    print(f"处理完成! 成功生成 {success_count}/{len(results)} 张图片, 共 {len(groups)} 个分组")
+    print(f"总耗时 {elapsed:.2f}s, 吞吐量 {throughput:.1f} 张/秒")
+    rendered = [r for r in results if r['success'] and not r.get('linked')]
+    if rendered:
+        print(f"平均解码 {sum(r['decode_ms'] for r in rendered) / len(rendered):.1f}ms, "
+              f"平均编码 {sum(r['encode_ms'] for r in rendered) / len(rendered):.1f}ms, "
+              f"输出共 {sum(r['output_bytes'] for r in rendered) / 1024 / 1024:.1f}MB")
+    linked = success_count - len(rendered)
+    if linked:
+        print(f"去重: {linked} 张图片用硬链接生成，未重复渲染")
+
+    save_to_json(groups, args.groups_json)
+    if success_count < len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+渲染结果缓存
+按内容寻址的磁盘缓存：缓存键由背景图片的字节、封面文字、编译后的样式、字体文件的
+摘要以及编码参数计算得到，输入完全相同的请求直接复用之前编码好的输出文件
+(同一文件系统上使用硬链接，否则复制)，不再解码、渲染和编码。
+
+缓存目录结构:
+    objects/ab/abcdef....jpg   编码好的输出文件
+    index.db                   SQLite 索引: 每个对象的大小、最近使用时间，以及累计的命中统计
+
+总大小超过上限时按最近使用时间 (LRU) 淘汰。多个工作进程可以共用同一个缓存目录。
+
+注意: 默认情况下输出文件与缓存对象是同一个文件的硬链接。更新输出时必须先删除或替换
+(写临时文件再 os.replace，image_io.save_image 就是这样做的)，不能原地打开覆盖写入，
+否则缓存对象会被一起改掉，之后命中的请求拿到的是被改过的内容。需要用其他工具原地修改
+输出时使用 --cache_copy，输出和缓存对象改为各自独立的副本。
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# 渲染逻辑变化导致相同输入的输出不同时需要递增，旧的缓存对象会自然失效
+CACHE_VERSION = 2
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# 文件摘要按 (路径, 大小, 修改时间) 缓存在进程内，字体等大文件不必每次重新计算
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """计算文件内容的 SHA-1 摘要，文件未修改时直接返回上次的结果"""
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(stamp)
+    if digest is not None:
+        return digest
+
+    hasher = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    with _digests_lock:
+        _digests[stamp] = digest
+    return digest
+
+
+def _make_key(parts):
+    payload = json.dumps([CACHE_VERSION, parts], ensure_ascii=False, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _font_digests(font_paths):
+    return {role: file_digest(path) for role, path in sorted(font_paths.items()) if path and os.path.exists(path)}
+
+
+def cover_key(image_path, texts, styles, font_paths, output_format, layout=None, **options):
+    """
+    封面的缓存键
+
+    Args:
+        styles: style_cache.load_styles 编译好的样式 (按内容参与计算，与CSS文件路径无关)
+        output_format: 输出格式，如 'JPEG'
+        layout: (可选) 复用的预览排版
+        options: 影响输出的其他参数，如 max_width, preset, quality
+    """
+    return _make_key({
+        'kind': 'cover',
+        'background': file_digest(image_path),
+        'texts': list(texts),
+        'styles': repr(styles),
+        'fonts': _font_digests(font_paths),
+        'layout': layout.get('wrapped_texts') if layout else None,
+        'format': output_format,
+        'options': options,
+    })
+
+
+def overlay_key(background_path, element_path, output_format, **options):
+    """
+    元素叠加结果的缓存键
+
+    Args:
+        options: 影响输出的其他参数，如 position, opacity, scale_factor, preset, quality
+    """
+    return _make_key({
+        'kind': 'overlay',
+        'background': file_digest(background_path),
+        'element': file_digest(element_path),
+        'format': output_format,
+        'options': options,
+    })
+
+
+def link_or_copy(source, destination, link=True):
+    """
+    把 source 放到 destination：优先硬链接，跨文件系统或 link=False 时复制
+
+    先写临时文件再替换，destination 原来是其他文件的硬链接时也不会改动那个文件
+    """
+    tmp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if not link:
+            raise OSError('复制')
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+class RenderCache:
+    """
+    按内容寻址的输出缓存
+
+    对象本身只保存缓存目录和容量，可以传给工作进程；每次操作单独打开 SQLite 连接。
+    link=True 时输出与缓存对象共用硬链接 (见模块说明)，link=False 时各自复制一份。
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, link=True):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = int(max_bytes)
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(self.cache_dir, 'objects'), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS entries "
+                         "(key TEXT PRIMARY KEY, path TEXT, size INTEGER, last_used REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_by_use ON entries (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """打开索引连接，正常退出时提交，异常时回滚，最后关闭连接"""
+        # 只在真正使用缓存时才导入，不指定 --cache_dir 的命令行不必付出导入开销
+        import sqlite3
+        conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.db'), timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _object_path(self, key, output_path):
+        extension = os.path.splitext(output_path)[1].lower()
+        return os.path.join(self.cache_dir, 'objects', key[:2], key + extension)
+
+    @staticmethod
+    def _bump(conn, name):
+        conn.execute("INSERT INTO counters (name, value) VALUES (?, 1) "
+                     "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def fetch(self, key, output_path):
+        """
+        命中时把缓存的输出放到 output_path
+
+        Returns:
+            int 或 None: 命中时返回输出的字节数，未命中返回 None
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT path, size FROM entries WHERE key = ?", (key,)).fetchone()
+            object_path = os.path.join(self.cache_dir, row[0]) if row else None
+            # 对象被外部修改或删除时视为未命中
+            if row is None or not os.path.exists(object_path) or os.path.getsize(object_path) != row[1]:
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._bump(conn, 'misses')
+                self.misses += 1
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._bump(conn, 'hits')
+        self.hits += 1
+
+        link_or_copy(object_path, output_path, self.link)
+        return row[1]
+
+    def store(self, key, output_path):
+        """把刚生成的输出文件加入缓存，超出容量时淘汰最久未使用的对象"""
+        object_path = self._object_path(key, output_path)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        link_or_copy(output_path, object_path, self.link)
+        size = os.path.getsize(object_path)
+
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries (key, path, size, last_used) VALUES (?, ?, ?, ?)",
+                         (key, os.path.relpath(object_path, self.cache_dir), size, time.time()))
+            self._bump(conn, 'stores')
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, path, size in conn.execute("SELECT key, path, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, path))
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._bump(conn, 'evictions')
+            total -= size
+
+    def stats(self):
+        """返回缓存统计：本进程和累计的命中/未命中、命中率、对象数和占用字节数"""
+        with self._transaction() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters"))
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'total_hits': hits,
+            'total_misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+            'stores': counters.get('stores', 0),
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        """删除所有缓存对象和统计"""
+        shutil.rmtree(os.path.join(self.cache_dir, 'objects'), ignore_errors=True)
+        os.makedirs(os.path.join(self.cache_dir, 'objects'), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
+        self.hits = self.misses = 0
+
+
+def add_arguments(parser):
+    """添加缓存相关的命令行参数，供各脚本共用"""
+    parser.add_argument('--cache_dir', default=None, help='(可选) 渲染结果缓存目录，输入完全相同时直接复用之前的输出')
+    parser.add_argument('--cache_max_mb', type=int, default=DEFAULT_MAX_BYTES // 1024 // 1024,
+                        help='渲染结果缓存的容量上限，MB (默认: 1024)')
+    parser.add_argument('--cache_copy', action='store_true',
+                        help='输出与缓存对象各自复制一份，不共用硬链接 (输出会被其他工具原地修改时使用)')
+
+
+def from_args(args):
+    """按 add_arguments 添加的参数创建缓存，未指定 --cache_dir 时返回 None"""
+    if not args.cache_dir:
+        return None
+    return RenderCache(args.cache_dir, args.cache_max_mb * 1024 * 1024, link=not args.cache_copy)
+
+
+def format_stats(stats):
+    """把 stats() 的累计统计格式化为一行摘要"""
+    hit_rate = '-' if stats['hit_rate'] is None else f"{stats['hit_rate']:.1%}"
+    return (f"渲染缓存累计命中率 {hit_rate}, {stats['entries']} 个对象, "
+            f"{stats['bytes'] / 1024 / 1024:.1f}/{stats['max_bytes'] / 1024 / 1024:.0f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查看或清空渲染结果缓存')
+    parser.add_argument('--cache_dir', required=True, help='缓存目录')
+    parser.add_argument('--clear', action='store_true', help='清空缓存')
+    args = parser.parse_args()
+
+    cache = RenderCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+        print(f"缓存已清空: {args.cache_dir}")
+        return
+    print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -52,13 +52,15 @@ fi
 STYLE_CSS="$BASE_DIR/guangshu_style.css"
 FONT_ZONGYI="/Users/ryla/work/coverText/antuozongyi.ttf"
 FONT_ENGLISH="/System/Library/Fonts/Supplemental/Georgia Italic.ttf"
-SCRIPT_PATH="$BASE_DIR/stable_script.py"
+# 通过 cover_daemon.py 的客户端渲染: 常驻进程 (./run_daemon.sh start) 运行时直接交给预热好的
+# 工作进程，未运行时在当前进程内渲染，效果与直接调用 stable_script.py 相同
+SCRIPT_PATH="$BASE_DIR/cover_daemon.py"
 
 # --- 执行Python脚本 ---
 echo "正在使用以下文字生成封面:"
 echo "$TEXTS_JSON"
 
-python "$SCRIPT_PATH" \
+python "$SCRIPT_PATH" render \
   --image_path "$IMAGE_PATH" \
   --output_path "$OUTPUT_PATH" \
   --style_css "$STYLE_CSS" \
@@ -0,0 +1,34 @@
+#!/bin/bash
+
+# 封面常驻进程的启动/停止脚本，启动后 run_cover.sh 会自动通过它渲染
+# 用法: ./run_daemon.sh start|stop|status
+
+# --- 固定参数配置 ---
+BASE_DIR="/Users/ryla/work/coverText"
+STYLE_CSS="$BASE_DIR/guangshu_style.css"
+FONT_ZONGYI="$BASE_DIR/antuozongyi.ttf"
+FONT_ENGLISH="/System/Library/Fonts/Supplemental/Georgia Italic.ttf"
+SCRIPT_PATH="$BASE_DIR/cover_daemon.py"
+LOG_FILE="$BASE_DIR/cover_daemon.log"
+
+case "$1" in
+  start)
+    if python "$SCRIPT_PATH" status > /dev/null; then
+      echo "守护进程已在运行"
+      exit 0
+    fi
+    nohup python "$SCRIPT_PATH" start \
+      --style_css "$STYLE_CSS" \
+      --font_zongyi "$FONT_ZONGYI" \
+      --font_english "$FONT_ENGLISH" \
+      "${@:2}" >> "$LOG_FILE" 2>&1 &
+    echo "守护进程已启动 (PID $!)，日志: $LOG_FILE"
+    ;;
+  stop|status)
+    python "$SCRIPT_PATH" "$1"
+    ;;
+  *)
+    echo "用法: $0 start|stop|status [cover_daemon.py 的其他参数]"
+    exit 1
+    ;;
+esac
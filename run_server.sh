@@ -0,0 +1,59 @@
+#!/bin/bash
+
+# 封面渲染服务的启动/停止脚本
+# 用法: ./run_server.sh start|stop|status
+
+# --- 固定参数配置 ---
+BASE_DIR="/Users/ryla/work/coverText"
+HOST="127.0.0.1"
+PORT="8765"
+STYLE_CSS="$BASE_DIR/guangshu_style.css"
+FONT_ZONGYI="$BASE_DIR/antuozongyi.ttf"
+FONT_ENGLISH="/System/Library/Fonts/Supplemental/Georgia Italic.ttf"
+SCRIPT_PATH="$BASE_DIR/cover_server.py"
+PID_FILE="$BASE_DIR/cover_server.pid"
+LOG_FILE="$BASE_DIR/cover_server.log"
+
+is_running() {
+  [ -f "$PID_FILE" ] && kill -0 "$(cat "$PID_FILE")" 2>/dev/null
+}
+
+case "$1" in
+  start)
+    if is_running; then
+      echo "服务已在运行 (PID $(cat "$PID_FILE"))"
+      exit 0
+    fi
+    nohup python "$SCRIPT_PATH" \
+      --host "$HOST" \
+      --port "$PORT" \
+      --style_css "$STYLE_CSS" \
+      --font_zongyi "$FONT_ZONGYI" \
+      --font_english "$FONT_ENGLISH" \
+      "${@:2}" >> "$LOG_FILE" 2>&1 &
+    echo $! > "$PID_FILE"
+    echo "服务已启动 (PID $!): http://$HOST:$PORT，日志: $LOG_FILE"
+    ;;
+  stop)
+    if is_running; then
+      kill -TERM "$(cat "$PID_FILE")"
+      rm -f "$PID_FILE"
+      echo "服务已停止"
+    else
+      echo "服务未在运行"
+    fi
+    ;;
+  status)
+    if is_running; then
+      echo "服务运行中 (PID $(cat "$PID_FILE"))"
+      curl -s "http://$HOST:$PORT/metrics"
+      echo
+    else
+      echo "服务未在运行"
+    fi
+    ;;
+  *)
+    echo "用法: $0 start|stop|status [cover_server.py 的其他参数]"
+    exit 1
+    ;;
+esac
@@ -1,220 +1,174 @@
 import argparse
+import functools
 import json
-import re
-from PIL import Image, ImageDraw, ImageFont
-import textwrap
+import os
+import time
+import instrumentation
 
-# =============================================================================
-# 1. CSS 解析模块
-# =============================================================================
-def parse_css(css_path):
-    """
-    一个简易的CSS解析器，用于从 guangshu_style.css 文件中提取特定样式。
-    它会查找 .text-block p, .line1, .line2, .line3 的规则。
-    """
-    styles = {
-        'base': {},
-        'line1': {},
-        'line2': {},
-        'line3': {}
-    }
-    
-    try:
-        with open(css_path, 'r', encoding='utf-8') as f:
-            # 先用正则去掉所有CSS注释，这是修复bug的关键
-            content = re.sub(r'/\*.*?\*/', '', f.read())
-    except FileNotFoundError:
-        print(f"错误：CSS文件未找到 at {css_path}")
-        return None
-
-    # 匹配规则块
-    rule_pattern = re.compile(r'([^{]+)\{([^}]+)\}')
-    rules = rule_pattern.findall(content)
-
-    selector_map = {
-        '.text-block p': 'base',
-        '.text-block p.line1': 'line1',
-        '.text-block p.line2': 'line2',
-        '.text-block p.line3': 'line3'
-    }
-
-    for selector, properties_str in rules:
-        selector = selector.strip()
-        if selector in selector_map:
-            key = selector_map[selector]
-            properties = properties_str.strip().split(';')
-            for prop in properties:
-                if ':' in prop:
-                    prop_name, prop_value = prop.split(':', 1)
-                    prop_name = prop_name.strip()
-                    prop_value = prop_value.strip()
-                    if prop_name and prop_value:
-                        styles[key][prop_name] = prop_value
-    return styles
-
-def get_line_style(styles, line_num):
-    """合并基础样式和特定行的样式"""
-    line_key = f'line{line_num}'
-    # 先复制基础样式，然后用特定行的样式覆盖
-    final_style = styles['base'].copy()
-    final_style.update(styles.get(line_key, {}))
-    return final_style
+# Pillow 和渲染模块只在真正渲染时才导入 (见各函数内的 import)：
+# cover_daemon.py 的客户端和 start/stop/status 只用到本模块的参数解析，不必付出导入开销
 
 # =============================================================================
-# 2. 渲染辅助函数
+# 1-2. CSS 解析与样式编译 (见 style_cache.py)
 # =============================================================================
-def parse_px(value):
-    """从 '80px' 中提取数字 80"""
-    if isinstance(value, str) and 'px' in value:
-        return int(re.sub(r'px', '', value).strip())
-    return int(value)
-
-def parse_shadow(shadow_str):
-    """从 ' -2px -2px 0 #000, ...' 中解析描边"""
-    if not shadow_str or shadow_str == 'none':
-        return []
-    shadows = []
-    # 正则表达式匹配每个shadow: x-offset y-offset blur-radius color
-    shadow_pattern = re.compile(r'(-?\d+)px\s+(-?\d+)px\s+\d+\s+([^,]+)')
-    for match in shadow_pattern.finditer(shadow_str):
-        shadows.append({
-            'x': int(match.group(1)),
-            'y': int(match.group(2)),
-            'color': match.group(3).strip()
-        })
-    return shadows
+def __getattr__(name):
+    # 兼容旧代码中 from stable_script import parse_css 等写法，用到时再导入 style_cache
+    if name in ('parse_css', 'get_line_style', 'parse_px', 'parse_shadow'):
+        import style_cache
+        return getattr(style_cache, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # =============================================================================
 # 3. 主渲染函数
 # =============================================================================
-def create_cover(image_path, output_path, texts, style_css, font_paths):
+def render_cover(image, texts, styles, font_paths, prewrapped=False, memory_budget=None):
+    """
+    在已加载的图片上原地渲染封面文字，供不经过文件读写的流水线使用
+
+    Args:
+        image: RGB 或 RGBA 模式的图片，会被原地修改
+        texts: 各行文字
+        styles: style_cache.load_styles 编译好的样式
+        font_paths: 字体路径字典
+        prewrapped: texts 是否已经换好行 (如预览时计算好的排版)
+        memory_budget: (可选) 单张图片的内存预算 (字节)，指定后按条带分块合成，
+                       不生成整张文字图层 (结果相同)
+
+    Returns:
+        Image: 传入的图片
+    """
+    import image_io
+    import text_layer
+
+    tile_rows = image_io.tile_rows(image, memory_budget)
+    if tile_rows is not None:
+        # --- 分块: 只缓存文字和阴影的蒙版，逐个条带绘制并合成 ---
+        with instrumentation.span('text_layer'):
+            drawing, dest_y = text_layer.get_text_drawing(texts, styles, font_paths, image.width, image.height, prewrapped)
+        with instrumentation.span('composite', tile_rows=tile_rows):
+            text_layer.composite_drawing(image, drawing, dest_y, tile_rows)
+        return image
+
+    # --- 渲染文字图层 (相同文字和宽度的图层会被缓存复用) 并合成 ---
+    with instrumentation.span('text_layer'):
+        layer, dest_y = text_layer.get_text_layer(texts, styles, font_paths, image.width, image.height, prewrapped)
+    with instrumentation.span('composite'):
+        text_layer.composite_layer(image, layer, dest_y)
+    return image
+
+def create_cover(image_path, output_path, texts, style_css, font_paths, styles=None, layout=None,
+                 max_width=None, preset=None, quality=None, stats=None, cache=None, memory_budget=None):
     """
     主函数，用于创建封面
+
+    Args:
+        styles: (可选) 预先由 style_cache.load_styles 编译好的样式，传入后不再读取 style_css
+        layout: (可选) render_preview 返回的排版结果，直接复用其中的换行 (与图片尺寸无关)
+        max_width: (可选) 输出的最大宽度，原图更宽时缩小解码后再渲染
+        preset: (可选) image_io.ENCODER_PRESETS 中的编码预设
+        quality: (可选) 覆盖预设中的编码质量
+        stats: (可选) 统计字典，写入 decode_ms, encode_ms, output_bytes
+        cache: (可选) render_cache.RenderCache，输入完全相同时直接复用之前的输出
+        memory_budget: (可选) 单张图片的内存预算 (字节)，指定后按条带分块合成 (结果相同)
+
+    Returns:
+        bool: 是否成功生成封面
     """
-    # --- 解析CSS ---
-    styles = parse_css(style_css)
-    if not styles:
-        return
+    import image_io
+    import render_cache
+    import style_cache
+    import text_layer
 
-    # --- 加载图片和字体 ---
-    try:
-        image = Image.open(image_path).convert("RGBA")
-    except FileNotFoundError:
-        print(f"错误：输入图片未找到 at {image_path}")
-        return
-        
-    draw = ImageDraw.Draw(image)
-    img_width, img_height = image.size
-
-    # --- 动态缩放逻辑 ---
-    reference_width = 720.0
-    scale_factor = img_width / reference_width
-    print(f"--- INFO: Image width is {img_width}px. Scaling all pixel values by factor of {scale_factor:.2f} ---")
-    
-    # --- 逐行渲染文字 ---
-    current_y = img_height / 2 - (150 * scale_factor)
-
-    for i, text in enumerate(texts):
-        line_num = i + 1
-        style = get_line_style(styles, line_num)
-
-        # --- 获取并缩放样式属性 ---
-        font_size = int(parse_px(style.get('font-size', 80)) * scale_factor)
-        font_color = style.get('color', 'white')
-        line_height_multiplier = float(style.get('line-height', 1.3))
-        
-        font_family = style.get('font-family', '')
-        if '综艺体' in font_family and font_paths.get('zongyi'):
-            font_path = font_paths['zongyi']
-        elif 'MyCoolEnglishFont' in font_family and font_paths.get('english'):
-            font_path = font_paths['english']
-        else:
-            font_path = font_paths['main']
+    with instrumentation.image_scope('cover', image_path=image_path, output_path=output_path) as scope:
+        # --- 解析CSS ---
+        if styles is None:
+            with instrumentation.span('load_styles'):
+                styles = style_cache.load_styles(style_css)
+        if not styles:
+            scope.set(success=False)
+            return False
+
+        # --- 查询渲染缓存 ---
+        cache_key = None
+        if cache is not None:
+            try:
+                with instrumentation.span('cache_lookup'):
+                    cache_key = render_cache.cover_key(
+                        image_path, texts, styles, font_paths, image_io.output_format(output_path),
+                        layout, max_width=max_width, preset=preset, quality=quality)
+                    output_bytes = cache.fetch(cache_key, output_path)
+            except FileNotFoundError:
+                print(f"错误：输入图片未找到 at {image_path}")
+                scope.set(success=False)
+                return False
+            if output_bytes is not None:
+                if stats is not None:
+                    stats.update(decode_ms=0.0, encode_ms=0.0, output_bytes=output_bytes, cache_hit=True)
+                print(f"封面已从缓存生成: {output_path}")
+                scope.set(success=True, cache_hit=True)
+                return True
 
+        # --- 加载图片 ---
         try:
-            font = ImageFont.truetype(font_path, font_size)
-        except IOError:
-            print(f"错误：字体文件未找到 at {font_path}。请检查路径。")
-            font = ImageFont.load_default()
-
-        if style.get('font-style') == 'italic' and font_paths.get('italic'):
-             try:
-                font = ImageFont.truetype(font_paths['italic'], font_size)
-             except IOError:
-                print(f"警告：斜体字体 at {font_paths['italic']} 未找到。")
-
-        # --- 处理换行 (新版，更精确) ---
-        text_width_percent = style.get('width')
-        wrapped_text = text
-        if text_width_percent and '%' in text_width_percent:
-            percent = int(text_width_percent.replace('%','').strip())
-            max_width_pixels = img_width * (percent / 100.0)
-            
-            lines = []
-            current_line = ""
-            for char in text:
-                if draw.textbbox((0,0), current_line + char, font=font)[2] <= max_width_pixels:
-                    current_line += char
-                else:
-                    if current_line:
-                        lines.append(current_line)
-                    current_line = char
-            if current_line:
-                lines.append(current_line)
-            wrapped_text = "\n".join(lines)
-
-        # --- 精确计算位置和尺寸 ---
-        bbox = draw.textbbox((0, 0), wrapped_text, font=font, align="center")
-        text_left, text_top, text_right, text_bottom = bbox
-        text_width = text_right - text_left
-        text_height = text_bottom - text_top
-        
-        x_start = (img_width - text_width) / 2
-        
-        margin_top = int(parse_px(style.get('margin-top', 0)) * scale_factor)
-        margin_str = style.get('margin', '0 auto')
-        if margin_str != '0 auto':
-             margin_parts = margin_str.split()
-             if len(margin_parts) > 0:
-                 margin_top += int(parse_px(margin_parts[0]) * scale_factor)
-
-        if i == 0:
-            current_y += margin_top
-        else:
-            prev_style = get_line_style(styles, i)
-            prev_font_size = int(parse_px(prev_style.get('font-size', 80)) * scale_factor)
-            current_y += prev_font_size * line_height_multiplier + margin_top
+            with instrumentation.span('decode'):
+                image = image_io.open_image(image_path, max_width, stats)
+        except FileNotFoundError:
+            print(f"错误：输入图片未找到 at {image_path}")
+            scope.set(success=False)
+            return False
 
-        y_start = current_y
+        # --- 动态缩放逻辑 ---
+        scale_factor = image.width / text_layer.REFERENCE_WIDTH
+        print(f"--- INFO: Image width is {image.width}px. Scaling all pixel values by factor of {scale_factor:.2f} ---")
 
-        # --- 渲染背景块 (针对line3) ---
-        bg_color = style.get('background-color')
-        if bg_color:
-            padding = int(20 * scale_factor)
-            bg_box = [x_start - padding, y_start - padding, x_start + text_width + padding, y_start + text_height + padding]
-            draw.rectangle(bg_box, fill=bg_color)
+        prewrapped = False
+        if layout:
+            texts = layout['wrapped_texts']
+            prewrapped = True
 
-        # --- 渲染描边/阴影 ---
-        draw_x = x_start - text_left
-        draw_y = y_start - text_top
+        render_cover(image, texts, styles, font_paths, prewrapped, memory_budget)
 
-        shadows = parse_shadow(style.get('text-shadow'))
-        for shadow in shadows:
-            shadow_x = int(shadow['x'] * scale_factor)
-            shadow_y = int(shadow['y'] * scale_factor)
-            draw.text((draw_x + shadow_x, draw_y + shadow_y), wrapped_text, font=font, fill=shadow['color'], align="center")
+        # --- 保存图片 ---
+        try:
+            with instrumentation.span('encode'):
+                image_io.save_image(image, output_path, preset=preset, quality=quality, stats=stats)
+            if cache_key is not None:
+                cache.store(cache_key, output_path)
+            print(f"封面已成功生成并保存到: {output_path}")
+            scope.set(success=True)
+            return True
+        except Exception as e:
+            print(f"错误：保存图片失败。{e}")
+            scope.set(success=False)
+            return False
 
-        # --- 渲染主文字 ---
-        draw.text((draw_x, draw_y), wrapped_text, font=font, fill=font_color, align="center")
+def render_preview(image_path, texts, styles, font_paths, max_width=360):
+    """
+    以限定的宽度快速渲染预览图，用于确认文字效果
 
-    # --- 保存图片 ---
-    try:
-        if output_path.lower().endswith(('.jpg', '.jpeg')):
-            image = image.convert("RGB")
-        image.save(output_path)
-        print(f"封面已成功生成并保存到: {output_path}")
-    except Exception as e:
-        print(f"错误：保存图片失败。{e}")
+    换行在参考宽度下计算，预览与全尺寸渲染使用同一套排版，只是投影的比例不同；
+    JPEG 通过 Image.draft 直接以缩小的尺寸解码。返回的排版结果可以传给
+    create_cover 的 layout 参数，确认后的全尺寸渲染不必再重新计算换行。
+
+    Returns:
+        tuple: (预览图, 排版结果字典)
+    """
+    from PIL import Image
+
+    import image_io
+    import text_layer
+
+    stats = {}
+    image = image_io.open_image(image_path, max_width, stats, resample=Image.Resampling.BILINEAR)
+    full_size = stats['source_size']
+    layout = {
+        'image_path': image_path,
+        'image_size': list(full_size),
+        'texts': list(texts),
+        'wrapped_texts': text_layer.wrap_texts(texts, styles, font_paths),
+    }
+    render_cover(image, layout['wrapped_texts'], styles, font_paths, prewrapped=True)
+    return image, layout
 
 
 # =============================================================================
@@ -223,11 +177,13 @@ def create_cover(image_path, output_path, texts, style_css, font_paths):
 # =============================================================================
 # 4. 新增：系统字体查找模块
 # =============================================================================
+@functools.lru_cache(maxsize=None)
 def find_system_font():
     """
     在macOS系统中查找可用的中文字体
+
+    查找结果在进程内缓存，常驻进程 (cover_daemon.py) 每次请求不再重复探测字体目录
     """
-    import os
     font_preferences = [
         'PingFang.ttc',          # 平方
         'STHeiti Medium.ttc',    # 黑体-中
@@ -247,28 +203,23 @@ def find_system_font():
                 return path
     return None
 
-# =============================================================================
-# 5. 命令行接口
-# =============================================================================
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='为图片添加风格化的文字封面')
-    parser.add_argument('--image_path', required=True, help='输入图片的路径')
-    parser.add_argument('--output_path', required=True, help='输出图片的路径')
-    parser.add_argument('--texts', required=True, help="""包含三行文字的JSON字符串, e.g., '["line 1", "line 2", "line 3"]'""")
-    parser.add_argument('--style_css', required=True, help='guangshu_style.css 文件的路径')
+def add_font_arguments(parser):
+    """为命令行解析器添加字体相关参数，供本脚本和其他入口 (如 pipeline.py) 共用"""
     parser.add_argument('--font_main', default=None, help='主字体路径。如果留空，脚本会尝试自动查找系统字体')
     parser.add_argument('--font_zongyi', default=None, help='综艺体字体的路径。如果留空，将使用主字体')
     parser.add_argument('--font_english', default=None, help='(可选) 英文专用字体的路径')
     parser.add_argument('--font_italic', default='', help='(可选) 斜体字体的路径')
 
-    args = parser.parse_args()
+def resolve_font_paths(args, required=True):
+    """
+    根据命令行参数生成 font_paths 字典，未指定主字体时自动查找系统字体
 
-    try:
-        texts_list = json.loads(args.texts)
-    except json.JSONDecodeError:
-        print("错误: --texts 参数必须是有效的JSON格式字符串。")
-        exit(1)
+    Args:
+        required: 找不到主字体时是否报错；模板自带字体时传 False，找不到时只省略主字体
 
+    Returns:
+        dict: 字体路径字典 (省略未找到的字体)，required 且找不到主字体时返回 None
+    """
     # --- 自动查找或验证字体路径 ---
     main_font_path = args.font_main
     if not main_font_path:
@@ -276,24 +227,392 @@ if __name__ == '__main__':
         main_font_path = find_system_font()
         if main_font_path:
             print(f"--- INFO: 找到可用字体: {main_font_path} ---")
-        else:
+        elif required:
             print("错误: 自动查找字体失败。请使用 --font_main 手动指定一个中文字体路径。")
-            exit(1)
+            return None
+        else:
+            font_paths = {'zongyi': args.font_zongyi, 'english': args.font_english, 'italic': args.font_italic}
+            return {role: path for role, path in font_paths.items() if path}
     
     zongyi_font_path = args.font_zongyi if args.font_zongyi else main_font_path
     english_font_path = args.font_english if args.font_english else main_font_path
 
-    font_paths = {
+    return {
         'main': main_font_path,
         'zongyi': zongyi_font_path,
         'english': english_font_path,
         'italic': args.font_italic
     }
-    
+
+# =============================================================================
+# 5. 批量渲染模块
+# =============================================================================
+def load_manifest(manifest_path):
+    """
+    读取批量任务清单，支持 JSONL 和 CSV 两种格式
+
+    JSONL 每行: {"image_path": "...", "output_path": "...", "texts": ["第一行", "第二行", "第三行"]}
+    CSV 表头: image_path,output_path,texts  (texts 列为JSON数组字符串)
+    两种格式都可以带可选的 template 字段/列，按名称选择 template_registry 中注册的模板
+
+    无法解析的行不会中断读取：该行的任务只包含 line 和 error，渲染时报告为失败，其余行照常渲染
+
+    Returns:
+        list: 任务列表，每项为包含 image_path, output_path, texts 的字典，
+              以及该行在清单文件中的行号 line
+    """
+    jobs = []
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        if manifest_path.lower().endswith('.csv'):
+            import csv
+            reader = csv.DictReader(f)
+            for row in reader:
+                job = {key: value for key, value in row.items() if key is not None}
+                job['line'] = reader.line_num
+                texts = job.pop('texts', None)
+                if texts:
+                    try:
+                        job['texts'] = json.loads(texts)
+                    except ValueError as e:
+                        job['error'] = f"texts 列不是有效的JSON: {e}"
+                jobs.append(job)
+        else:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    job = json.loads(line)
+                except ValueError as e:
+                    jobs.append({'line': line_number, 'error': f"无法解析JSON: {e}"})
+                    continue
+                if not isinstance(job, dict):
+                    jobs.append({'line': line_number, 'error': '每行必须是JSON对象'})
+                    continue
+                job['line'] = line_number
+                jobs.append(job)
+    return jobs
+
+def manifest_error(job):
+    """
+    检查清单中的一个封面任务
+
+    Returns:
+        str: 该行无法解析或缺少必填字段时的错误信息，任务有效时返回 None
+    """
+    if job.get('error'):
+        return job['error']
+    for key in ('image_path', 'output_path'):
+        if not job.get(key):
+            return f"缺少 {key}"
+    texts = job.get('texts')
+    if not isinstance(texts, list) or not texts or not all(isinstance(text, str) for text in texts):
+        return 'texts 必须是非空的字符串列表'
+    return None
+
+def render_job(index, job, style_css, font_paths, styles, **options):
+    """
+    渲染清单中的单个任务，并把结果整理成报告中的一行
+
+    任务指定了 template 时使用该模板的样式和字体，否则使用 style_css / font_paths / styles
+
+    Args:
+        options: 传给 create_cover 的读写参数 (max_width, preset, quality, cache, memory_budget)
+
+    Returns:
+        dict: 包含 index, line (清单中的行号), image_path, output_path, success, error, elapsed_ms 的结果，
+              成功时还包含 decode_ms, encode_ms, output_bytes (命中渲染缓存时还有 cache_hit)
+    """
+    import template_registry
+
+    start = time.perf_counter()
+    result = {
+        'index': index,
+        'line': job.get('line'),
+        'image_path': job.get('image_path'),
+        'output_path': job.get('output_path'),
+        'success': False,
+        'error': None,
+    }
+    io_stats = {}
+    try:
+        error = manifest_error(job)
+        if error is not None:
+            raise ValueError(error)
+        if job.get('template'):
+            template = template_registry.get_template(job['template'])
+            style_css, font_paths, styles = template.css_path, template.font_paths, template.styles
+        result['success'] = create_cover(
+            job['image_path'],
+            job['output_path'],
+            job['texts'],
+            style_css,
+            font_paths,
+            styles=styles,
+            stats=io_stats,
+            **options
+        )
+        if not result['success']:
+            result['error'] = '渲染失败，详见日志'
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        print(f"✗ 第 {job.get('line', index + 1)} 行处理失败: {result['error']}")
+    io_stats.pop('source_size', None)
+    result.update(io_stats)
+    result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+# 工作进程内常驻的状态，由 _init_worker 在进程启动时填充一次
+_worker_state = {}
+
+def _init_worker(style_css, font_paths, options, trace_settings=None, templates=()):
+    """进程池初始化函数：每个工作进程只解析一次CSS，字体和文字图层在进程内缓存"""
+    import style_cache
+    import template_registry
+
+    instrumentation.init_worker(trace_settings)
+    template_registry.install(templates)
+    _worker_state['style_css'] = style_css
+    _worker_state['font_paths'] = font_paths
+    _worker_state['styles'] = style_cache.load_styles(style_css)
+    _worker_state['options'] = options
+
+def _render_job_in_worker(indexed_job):
+    index, job = indexed_job
+    return render_job(
+        index,
+        job,
+        _worker_state['style_css'],
+        _worker_state['font_paths'],
+        _worker_state['styles'],
+        **_worker_state['options']
+    )
+
+def iter_render_jobs(jobs, style_css, font_paths, workers=1, styles=None, **options):
+    """
+    按清单顺序逐个产出渲染结果
+
+    workers > 1 时使用进程池并行渲染，结果仍按输入顺序流式返回；
+    workers <= 0 表示使用全部CPU核心。options 传给 render_job。
+    """
+    import style_cache
+    import template_registry
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    if workers == 1 or len(jobs) <= 1:
+        if styles is None:
+            styles = style_cache.load_styles(style_css)
+        for index, job in enumerate(jobs):
+            yield render_job(index, job, style_css, font_paths, styles, **options)
+        return
+
+    # 每个任务本身耗时较长，小 chunksize 即可兼顾负载均衡与调度开销
+    chunksize = max(1, min(8, len(jobs) // (workers * 4)))
+    # 只有批量模式才需要进程池，单张封面的命令行不必导入 multiprocessing
+    import multiprocessing
+    initargs = (style_css, font_paths, options, instrumentation.settings(), template_registry.templates())
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        for result in pool.imap(_render_job_in_worker, enumerate(jobs), chunksize):
+            yield result
+
+def run_batch(manifest_path, style_css, font_paths, report_path=None, workers=1, **options):
+    """
+    批量生成封面：CSS只解析一次，字体通过 font_registry 复用
+
+    Args:
+        manifest_path: 任务清单路径 (JSONL 或 CSV)
+        style_css: CSS样式文件路径
+        font_paths: 字体路径字典
+        report_path: (可选) 逐行结果报告的输出路径 (JSONL)
+        workers: 并行工作进程数，1为单进程，0为使用全部CPU核心
+        options: 传给 create_cover 的读写参数 (max_width, preset, quality, cache, memory_budget)
+
+    Returns:
+        list: 每个任务的结果字典
+    """
+    import font_registry
+    import glyph_atlas
+    import render_cache
+    import style_cache
+    import text_layer
+
+    styles = style_cache.load_styles(style_css)
+    if not styles:
+        return []
+
+    try:
+        jobs = load_manifest(manifest_path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"错误：读取任务清单失败 {manifest_path}: {e}")
+        return []
+
+    results = []
+    batch_start = time.perf_counter()
+    report_file = None
+    if report_path:
+        try:
+            report_file = open(report_path, 'w', encoding='utf-8')
+        except OSError as e:
+            print(f"错误：无法创建结果报告。{e}")
+
+    try:
+        for result in iter_render_jobs(jobs, style_css, font_paths, workers, styles, **options):
+            results.append(result)
+            if report_file:
+                report_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+    finally:
+        if report_file:
+            report_file.close()
+
+    total_seconds = time.perf_counter() - batch_start
+    success_count = sum(1 for r in results if r['success'])
+    print("-" * 50)
+    print(f"批量处理完成! 成功 {success_count}/{len(results)} 张, 总耗时 {total_seconds:.2f}s")
+    encoded = [r for r in results if r['success'] and not r.get('cache_hit')]
+    if encoded:
+        print(f"平均解码 {sum(r['decode_ms'] for r in encoded) / len(encoded):.1f}ms, "
+              f"平均编码 {sum(r['encode_ms'] for r in encoded) / len(encoded):.1f}ms, "
+              f"输出共 {sum(r['output_bytes'] for r in encoded) / 1024 / 1024:.1f}MB")
+    if options.get('cache') is not None:
+        hits = sum(1 for r in results if r.get('cache_hit'))
+        print(f"渲染缓存: 本次命中 {hits}/{len(results)} 张")
+        print(render_cache.format_stats(options['cache'].stats()))
+    if workers == 1:
+        font_stats = font_registry.cache_info()
+        layer_stats = text_layer.cache_info()
+        print(f"字体缓存: 命中 {font_stats['hits']} 次, 加载 {font_stats['misses']} 次")
+        print(f"文字图层缓存: 命中 {layer_stats['hits']} 次, 渲染 {layer_stats['misses']} 次")
+        glyph_stats = glyph_atlas.cache_info()
+        print(f"字形缓存: 命中 {glyph_stats['hits']} 次, 光栅化 {glyph_stats['misses']} 次, "
+              f"{glyph_stats['size']} 个字形 {glyph_stats['bytes'] / 1024 / 1024:.1f}MB")
+    if report_file:
+        print(f"结果报告已保存到: {report_path}")
+
+    return results
+
+# =============================================================================
+# 6. 命令行接口
+# =============================================================================
+def main(argv=None):
+    import image_io
+    import render_cache
+    import style_cache
+    import template_registry
+
+    parser = argparse.ArgumentParser(description='为图片添加风格化的文字封面')
+    parser.add_argument('--image_path', default=None, help='输入图片的路径')
+    parser.add_argument('--output_path', default=None, help='输出图片的路径')
+    parser.add_argument('--texts', default=None, help="""每行文字一项的JSON数组字符串, e.g., '["line 1", "line 2", "line 3"]'""")
+    parser.add_argument('--manifest', default=None, help='(可选) 批量任务清单 (JSONL 或 CSV)，指定后忽略 --image_path/--output_path/--texts')
+    parser.add_argument('--report', default=None, help='(可选) 批量模式下逐行结果报告的输出路径 (JSONL)')
+    parser.add_argument('--workers', type=int, default=1, help='批量模式下的并行工作进程数，0表示使用全部CPU核心 (默认: 1)')
+    parser.add_argument('--style_css', default=None, help='guangshu_style.css 文件的路径 (指定 --template 时可省略)')
+    parser.add_argument('--templates', default=None,
+                        help='(可选) 模板目录或JSON清单，启动时预编译全部模板；批量任务可用 template 字段按名称选择')
+    parser.add_argument('--template', default=None, help='(可选) 默认使用的模板名 (需要 --templates)，代替 --style_css 和字体参数')
+    parser.add_argument('--style_cache_dir', default=None, help='(可选) 编译后样式的磁盘缓存目录，CSS未修改时新进程可直接加载')
+    parser.add_argument('--preview', action='store_true', help='只渲染缩小的预览图，配合 --layout_path 保存排版结果')
+    parser.add_argument('--preview_width', type=int, default=360, help='预览图的最大宽度 (默认: 360)')
+    parser.add_argument('--layout_path', default=None, help='(可选) 排版结果JSON：预览时写入，正式渲染时读取并复用')
+    parser.add_argument('--max_width', type=int, default=None, help='(可选) 输出的最大宽度，原图更宽时缩小解码后再渲染')
+    parser.add_argument('--preset', default=None, choices=sorted(image_io.ENCODER_PRESETS),
+                        help='(可选) 编码预设，默认使用 Pillow 的默认参数')
+    parser.add_argument('--quality', type=int, default=None, help='(可选) 有损格式的编码质量，覆盖预设中的值')
+    parser.add_argument('--memory_budget_mb', type=int, default=None,
+                        help='(可选) 单张图片的内存预算，MB；指定后按条带分块合成，输出不变')
+    render_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    add_font_arguments(parser)
+
+    args = parser.parse_args(argv)
+    if not args.style_css and not args.template:
+        parser.error('必须指定 --style_css 或 --template')
+    if args.template and not args.templates:
+        parser.error('--template 需要配合 --templates 使用')
+    instrumentation.enable_from_args(args)
+
+    texts_list = None
+    layout = None
+    if not args.manifest:
+        if args.layout_path and not args.preview:
+            try:
+                with open(args.layout_path, 'r', encoding='utf-8') as f:
+                    layout = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"错误: 无法读取排版结果 {args.layout_path}: {e}")
+                exit(1)
+            args.image_path = args.image_path or layout['image_path']
+            texts_list = layout['texts']
+        if not (args.image_path and args.output_path and (args.texts or layout)):
+            parser.error('未指定 --manifest 时，--image_path、--output_path 和 --texts 为必填参数')
+        if args.texts:
+            try:
+                texts_list = json.loads(args.texts)
+            except json.JSONDecodeError:
+                print("错误: --texts 参数必须是有效的JSON格式字符串。")
+                exit(1)
+            if layout and texts_list != layout['texts']:
+                print("警告: --texts 与排版结果中的文字不一致，重新计算排版")
+                layout = None
+
+    # 模板可以自带字体，选用模板时找不到命令行或系统字体不算错误 (由注册模板时检查)
+    font_paths = resolve_font_paths(args, required=not args.template)
+    if font_paths is None:
+        exit(1)
+    memory_budget = args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None
+
+    # 预先编译样式；之后同一进程内对 load_styles 的调用都会命中内存缓存。选用模板时不使用 --style_css
+    if not args.template and not style_cache.load_styles(args.style_css, args.style_cache_dir):
+        exit(1)
+    if args.templates and template_registry.load_templates(args.templates, font_paths) is None:
+        exit(1)
+    style_css = args.style_css
+    if args.template:
+        try:
+            template = template_registry.get_template(args.template)
+        except ValueError as e:
+            print(f"错误: {e}")
+            exit(1)
+        style_css, font_paths = template.css_path, template.font_paths
+
+    if args.manifest:
+        results = run_batch(args.manifest, style_css, font_paths, args.report, args.workers,
+                            max_width=args.max_width, preset=args.preset, quality=args.quality,
+                            cache=render_cache.from_args(args), memory_budget=memory_budget)
+        if not results or not all(r['success'] for r in results):
+            exit(1)
+        return
+
+    if args.preview:
+        styles = style_cache.load_styles(style_css)
+        try:
+            preview, layout = render_preview(args.image_path, texts_list, styles, font_paths, args.preview_width)
+        except FileNotFoundError:
+            print(f"错误：输入图片未找到 at {args.image_path}")
+            exit(1)
+        image_io.save_image(preview, args.output_path, preset=args.preset, quality=args.quality)
+        print(f"预览图已生成并保存到: {args.output_path}")
+        if args.layout_path:
+            with open(args.layout_path, 'w', encoding='utf-8') as f:
+                json.dump(layout, f, ensure_ascii=False, indent=2)
+            print(f"排版结果已保存到: {args.layout_path}")
+        return
+
     create_cover(
         args.image_path,
         args.output_path,
         texts_list,
-        args.style_css,
-        font_paths
-    )
\ No newline at end of file
+        style_css,
+        font_paths,
+        layout=layout,
+        max_width=args.max_width,
+        preset=args.preset,
+        quality=args.quality,
+        cache=render_cache.from_args(args),
+        memory_budget=memory_budget
+    )
+
+if __name__ == '__main__':
+    main()
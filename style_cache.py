@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+样式模块
+解析 guangshu_style.css，并把每一行的样式编译成不可变的 LineStyle 对象：
+字号、颜色、阴影、边距等在编译时一次性解析完毕，渲染循环中无需再跑正则。
+
+编译结果按CSS文件路径缓存在内存中，文件修改时间 (mtime) 变化后自动重新编译；
+也可以通过 cache_dir 把编译结果持久化到磁盘，供新进程直接加载。
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+
+# =============================================================================
+# 1. CSS 解析模块
+# =============================================================================
+def parse_css(css_path):
+    """
+    一个简易的CSS解析器，用于从 guangshu_style.css 文件中提取特定样式。
+    它会查找 .text-block p 以及 .text-block p.line1 … p.lineN 的规则 (行数不限)。
+    """
+    styles = {
+        'base': {},
+        'line1': {},
+        'line2': {},
+        'line3': {}
+    }
+    
+    try:
+        with open(css_path, 'r', encoding='utf-8') as f:
+            # 先用正则去掉所有CSS注释，这是修复bug的关键
+            content = re.sub(r'/\*.*?\*/', '', f.read())
+    except FileNotFoundError:
+        print(f"错误：CSS文件未找到 at {css_path}")
+        return None
+
+    # 匹配规则块
+    rule_pattern = re.compile(r'([^{]+)\{([^}]+)\}')
+    rules = rule_pattern.findall(content)
+
+    line_selector = re.compile(r'\.text-block p\.line([1-9]\d*)')
+
+    for selector, properties_str in rules:
+        selector = selector.strip()
+        line_match = line_selector.fullmatch(selector)
+        if selector == '.text-block p' or line_match:
+            key = f'line{line_match.group(1)}' if line_match else 'base'
+            styles.setdefault(key, {})
+            properties = properties_str.strip().split(';')
+            for prop in properties:
+                if ':' in prop:
+                    prop_name, prop_value = prop.split(':', 1)
+                    prop_name = prop_name.strip()
+                    prop_value = prop_value.strip()
+                    if prop_name and prop_value:
+                        styles[key][prop_name] = prop_value
+    return styles
+
+def get_line_style(styles, line_num):
+    """合并基础样式和特定行的样式"""
+    line_key = f'line{line_num}'
+    # 先复制基础样式，然后用特定行的样式覆盖
+    final_style = styles['base'].copy()
+    final_style.update(styles.get(line_key, {}))
+    return final_style
+
+# =============================================================================
+# 2. 样式值解析辅助函数
+# =============================================================================
+def parse_px(value):
+    """从 '80px' 中提取数字 80"""
+    if isinstance(value, str) and 'px' in value:
+        return int(re.sub(r'px', '', value).strip())
+    return int(value)
+
+def parse_shadow(shadow_str):
+    """从 ' -2px -2px 0 #000, ...' 中解析描边"""
+    if not shadow_str or shadow_str == 'none':
+        return []
+    shadows = []
+    # 正则表达式匹配每个shadow: x-offset y-offset blur-radius color
+    shadow_pattern = re.compile(r'(-?\d+)px\s+(-?\d+)px\s+(\d+)(?:px)?\s+([^,]+)')
+    for match in shadow_pattern.finditer(shadow_str):
+        shadows.append({
+            'x': int(match.group(1)),
+            'y': int(match.group(2)),
+            'blur': int(match.group(3)),
+            'color': match.group(4).strip()
+        })
+    return shadows
+
+# =============================================================================
+# 3. 样式编译与缓存
+# =============================================================================
+# 单行的已解析样式，所有像素值均为 720px 参考宽度下的数值，渲染时再乘以缩放系数
+LineStyle = namedtuple('LineStyle', [
+    'font_size',         # int, 字号
+    'color',             # str, 文字颜色
+    'line_height',       # float, 行高倍数
+    'font_family',       # str, 原始 font-family 声明
+    'font_role',         # str, 使用 font_paths 中的哪个字体: 'main' / 'zongyi' / 'english'
+    'italic',            # bool, 是否为斜体
+    'width_percent',     # int 或 None, 自动换行的宽度百分比
+    'margin_top',        # int, margin-top
+    'margin',            # int, margin 简写中的上边距
+    'background_color',  # str 或 None, 背景块颜色
+    'shadows',           # tuple, 每项为 (x, y, blur, color)
+])
+
+# 编译后的样式表: base 为 .text-block p 的样式, lines[i] 为第 i+1 行的最终样式
+CompiledStyles = namedtuple('CompiledStyles', ['base', 'lines'])
+
+# 缓存文件格式版本，LineStyle 字段变化时需要递增
+_CACHE_FORMAT = 2
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def _resolve_font_role(font_family):
+    if '综艺体' in font_family:
+        return 'zongyi'
+    if 'MyCoolEnglishFont' in font_family:
+        return 'english'
+    return 'main'
+
+
+def compile_line_style(style):
+    """把 get_line_style 返回的样式字典编译成 LineStyle"""
+    width = style.get('width')
+    width_percent = None
+    if width and '%' in width:
+        width_percent = int(width.replace('%', '').strip())
+
+    margin = 0
+    margin_str = style.get('margin', '0 auto')
+    if margin_str != '0 auto':
+        margin_parts = margin_str.split()
+        if len(margin_parts) > 0:
+            margin = parse_px(margin_parts[0])
+
+    font_family = style.get('font-family', '')
+    return LineStyle(
+        font_size=parse_px(style.get('font-size', 80)),
+        color=style.get('color', 'white'),
+        line_height=float(style.get('line-height', 1.3)),
+        font_family=font_family,
+        font_role=_resolve_font_role(font_family),
+        italic=style.get('font-style') == 'italic',
+        width_percent=width_percent,
+        margin_top=parse_px(style.get('margin-top', 0)),
+        margin=margin,
+        background_color=style.get('background-color'),
+        shadows=tuple((s['x'], s['y'], s['blur'], s['color']) for s in parse_shadow(style.get('text-shadow'))),
+    )
+
+
+def compile_styles(styles):
+    """
+    把 parse_css 的结果编译成 CompiledStyles
+
+    Args:
+        styles: parse_css 返回的样式字典
+
+    Returns:
+        CompiledStyles: 编译后的样式表
+    """
+    line_keys = sorted(
+        (key for key in styles if key.startswith('line') and key[4:].isdigit()),
+        key=lambda key: int(key[4:])
+    )
+    line_count = int(line_keys[-1][4:]) if line_keys else 0
+    return CompiledStyles(
+        base=compile_line_style(get_line_style(styles, 0)),
+        lines=tuple(compile_line_style(get_line_style(styles, n)) for n in range(1, line_count + 1))
+    )
+
+
+def line_style(compiled, line_num):
+    """获取第 line_num 行 (从1开始) 的样式，超出定义范围的行使用基础样式"""
+    if 1 <= line_num <= len(compiled.lines):
+        return compiled.lines[line_num - 1]
+    return compiled.base
+
+
+def _to_json(compiled):
+    return {
+        'base': list(compiled.base),
+        'lines': [list(s) for s in compiled.lines],
+    }
+
+
+def _from_json(data):
+    def to_line_style(values):
+        style = LineStyle(*values)
+        return style._replace(shadows=tuple(tuple(s) for s in style.shadows))
+    return CompiledStyles(
+        base=to_line_style(data['base']),
+        lines=tuple(to_line_style(values) for values in data['lines'])
+    )
+
+
+def _disk_cache_path(cache_dir, css_path):
+    digest = hashlib.sha1(css_path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f"style_{digest}.json")
+
+
+def _load_from_disk(cache_path, stamp):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') == _CACHE_FORMAT and data.get('stamp') == list(stamp):
+            return _from_json(data['styles'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _save_to_disk(cache_path, stamp, compiled):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': _CACHE_FORMAT, 'stamp': list(stamp), 'styles': _to_json(compiled)}, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"警告：样式缓存写入失败 {cache_path}: {e}")
+
+
+def load_styles(css_path, cache_dir=None):
+    """
+    获取编译后的样式表，CSS文件未修改时直接返回缓存
+
+    Args:
+        css_path: CSS文件路径
+        cache_dir: (可选) 编译结果的磁盘缓存目录
+
+    Returns:
+        CompiledStyles: 编译后的样式表，CSS文件不存在时返回 None
+    """
+    css_path = os.path.abspath(css_path)
+    try:
+        stat = os.stat(css_path)
+    except FileNotFoundError:
+        print(f"错误：CSS文件未找到 at {css_path}")
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    with _compiled_lock:
+        cached = _compiled.get(css_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    compiled = None
+    cache_path = _disk_cache_path(cache_dir, css_path) if cache_dir else None
+    if cache_path:
+        compiled = _load_from_disk(cache_path, stamp)
+
+    if compiled is None:
+        styles = parse_css(css_path)
+        if not styles:
+            return None
+        compiled = compile_styles(styles)
+        if cache_path:
+            _save_to_disk(cache_path, stamp, compiled)
+
+    with _compiled_lock:
+        _compiled[css_path] = (stamp, compiled)
+    return compiled
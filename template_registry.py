@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+样式模板注册表
+启动时一次性加载多套样式模板：每个模板是一份与 guangshu_style.css 写法相同的CSS
+(可以用 .text-block p.lineN 定义任意多行)，以及可选的专用字体。注册时编译样式并预加载
+每一行用到的字体，批量任务和服务请求按名称选择模板，不再为换一套样式重新解析CSS、
+加载字体；混合使用多个模板的批次同样全部命中进程内缓存。
+
+模板清单有两种写法:
+    目录: 目录中的每个 .css 文件是一个模板，名称为文件名 (不含扩展名)
+    JSON: {"模板名": "style.css",
+           "另一个": {"css": "other.css", "fonts": {"main": "a.ttf", "zongyi": "b.ttf"}}}
+          相对路径按JSON文件所在目录解析，模板未指定的字体使用命令行指定的字体
+"""
+
+import json
+import os
+import threading
+from collections import namedtuple
+
+import style_cache
+from cover_layout import REFERENCE_WIDTH, load_line_font
+
+# 注册时预加载字体的输出宽度：参考宽度 (排版) 和常见的封面宽度
+DEFAULT_WARM_WIDTHS = (720, 1440)
+
+Template = namedtuple('Template', [
+    'name',        # str, 模板名
+    'css_path',    # str, CSS文件的绝对路径
+    'styles',      # style_cache.CompiledStyles, 编译好的样式
+    'font_paths',  # dict, 该模板使用的字体路径
+])
+
+_templates = {}
+_lock = threading.Lock()
+
+
+def warm_fonts(styles, font_paths, warm_widths=DEFAULT_WARM_WIDTHS):
+    """按样式中每一行的字号和字体预加载字体"""
+    for style in (styles.base,) + styles.lines:
+        for width in warm_widths:
+            load_line_font(style, int(style.font_size * width / REFERENCE_WIDTH), font_paths)
+
+
+def register(name, css_path, font_paths, styles=None, warm_widths=DEFAULT_WARM_WIDTHS):
+    """
+    编译样式、预加载字体并注册模板，同名模板会被替换
+
+    Args:
+        styles: (可选) 已编译好的样式，传入后不再读取 css_path (工作进程中使用)
+
+    Returns:
+        Template: 注册的模板，CSS无法加载或没有主字体时返回 None
+    """
+    if not font_paths.get('main'):
+        print(f"错误：模板 {name} 没有主字体，请在模板清单的 fonts 中指定 main，或使用 --font_main")
+        return None
+    if styles is None:
+        styles = style_cache.load_styles(css_path)
+        if not styles:
+            return None
+    template = Template(name, os.path.abspath(css_path), styles, dict(font_paths))
+    warm_fonts(styles, template.font_paths, warm_widths)
+    with _lock:
+        _templates[name] = template
+    return template
+
+
+def read_spec(spec_path):
+    """
+    读取模板清单
+
+    Returns:
+        dict: {模板名: (CSS路径, 字体路径覆盖)}
+
+    Raises:
+        OSError / ValueError: 清单无法读取或格式不正确
+    """
+    if os.path.isdir(spec_path):
+        return {os.path.splitext(name)[0]: (os.path.join(spec_path, name), {})
+                for name in sorted(os.listdir(spec_path)) if name.lower().endswith('.css')}
+
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    if not isinstance(entries, dict):
+        raise ValueError('模板清单必须是 {模板名: CSS路径或配置} 格式的JSON对象')
+    base_dir = os.path.dirname(os.path.abspath(spec_path))
+    spec = {}
+    for name, entry in entries.items():
+        if isinstance(entry, str):
+            entry = {'css': entry}
+        if not isinstance(entry, dict) or not entry.get('css'):
+            raise ValueError(f'模板 {name} 缺少 css')
+        fonts = {role: os.path.join(base_dir, path) if path else path
+                 for role, path in (entry.get('fonts') or {}).items()}
+        spec[name] = (os.path.join(base_dir, entry['css']), fonts)
+    return spec
+
+
+def load_templates(spec_path, font_paths, warm_widths=DEFAULT_WARM_WIDTHS):
+    """
+    按模板清单注册全部模板
+
+    Args:
+        spec_path: 模板目录或JSON清单
+        font_paths: 默认字体路径，模板未指定的字体使用这里的字体
+
+    Returns:
+        list: 注册成功的模板名；清单无法读取或任一模板无法加载时返回 None
+    """
+    try:
+        spec = read_spec(spec_path)
+    except (OSError, ValueError) as e:
+        print(f"错误：读取模板清单失败 {spec_path}: {e}")
+        return None
+    if not spec:
+        print(f"错误：模板清单中没有模板 {spec_path}")
+        return None
+
+    names = []
+    for name, (css_path, fonts) in spec.items():
+        if register(name, css_path, {**font_paths, **fonts}, warm_widths=warm_widths) is None:
+            return None
+        names.append(name)
+    return names
+
+
+def install(templates, warm_widths=DEFAULT_WARM_WIDTHS):
+    """注册已编译好的模板 (由 templates() 获得)，供进程池初始化时使用"""
+    for template in templates:
+        register(template.name, template.css_path, template.font_paths, template.styles, warm_widths)
+
+
+def get_template(name):
+    """
+    按名称获取模板
+
+    Raises:
+        ValueError: 模板不存在
+    """
+    with _lock:
+        template = _templates.get(name)
+        if template is None:
+            available = ', '.join(sorted(_templates)) or '无'
+            raise ValueError(f"未知的模板: {name} (可选: {available})")
+    return template
+
+
+def templates():
+    """返回全部已注册的模板"""
+    with _lock:
+        return list(_templates.values())
+
+
+def clear():
+    """清空注册表"""
+    with _lock:
+        _templates.clear()
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文字图层模块
+把一组封面文字 (背景块、描边/阴影、主文字) 渲染到一张透明的 RGBA 图层上，
+再整体 alpha 合成到背景图片。
+
+同一组文字在相同宽度的背景上渲染结果完全一致，因此图层按
+(文字, 样式, 字体, 图片宽度) 缓存：批量为多张背景生成同一组文字时，
+只需渲染一次文字，其余图片只做一次合成。缓存按图层占用的字节数限制大小，
+超出后按LRU淘汰。
+
+超大背景可以分块渲染：只缓存文字和阴影的灰度蒙版 (绘制操作)，合成时逐个条带
+绘制到小图层上再合成，不再生成与背景同宽的整张 RGBA 图层。
+
+换行和测量由 cover_layout 在参考宽度下计算一次，不同宽度的背景只做按比例投影。
+"""
+
+import math
+import threading
+from collections import OrderedDict, namedtuple
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+import cover_layout
+import glyph_atlas
+import image_io
+import instrumentation
+
+# CSS 中的像素值都以 720px 宽的封面为参考
+REFERENCE_WIDTH = cover_layout.REFERENCE_WIDTH
+
+# 图层上下额外留出的像素，容纳抗锯齿边缘
+_LAYER_PADDING = 2
+
+# 模糊阴影的扩散范围约为 1.5 倍模糊半径 (3 sigma)
+_BLUR_REACH = 1.5
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# 每个绘制操作除蒙版像素外的大致开销 (Image 对象、元组)
+_OP_OVERHEAD = 200
+
+# 文字图层的绘制操作 (见 render_text_drawing)
+TextDrawing = namedtuple('TextDrawing', [
+    'size',      # tuple, 整张图层的尺寸 (图片宽度, 图层高度)
+    'offset_y',  # int, 图层顶部相对文字块起始位置 (取整后) 的纵向偏移
+    'ops',       # tuple, 按顺序执行的 ('rectangle', 矩形, 颜色) 或 ('bitmap', 左上角, (蒙版, 颜色))
+])
+
+_layers = OrderedDict()
+_layers_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_cache_bytes = 0
+_max_bytes = DEFAULT_MAX_BYTES
+
+
+def wrap_texts(texts, styles, font_paths):
+    """
+    对各行文字自动换行，不做其他排版计算
+
+    换行在参考宽度下进行，与图片尺寸无关。返回的文字中用换行符表示断行位置，
+    可以作为 prewrapped 文字传给 layout_lines / get_text_layer
+    """
+    return [line.text for line in cover_layout.get_layout(texts, styles, font_paths).lines]
+
+
+def layout_lines(texts, styles, font_paths, img_width, start_y, prewrapped=False):
+    """
+    计算每一行文字的位置和尺寸
+
+    排版在参考宽度下只计算一次 (见 cover_layout.py)，这里按图片宽度投影
+
+    Args:
+        texts: 各行文字
+        styles: style_cache.load_styles 编译好的样式
+        font_paths: 字体路径字典
+        img_width: 图片宽度
+        start_y: 文字块的起始纵坐标
+        prewrapped: 文字是否已由 wrap_texts 换好行 (此时不再自动换行)
+
+    Returns:
+        list: 每行一个字典，包含绘制所需的字体、换行后的文字、坐标、背景块和阴影
+    """
+    with instrumentation.span('layout'):
+        layout = cover_layout.get_layout(texts, styles, font_paths, prewrapped)
+    return cover_layout.project(layout, font_paths, img_width, start_y)
+
+
+def _vertical_extent(lines):
+    """所有绘制内容在纵向上覆盖的范围"""
+    top, bottom = math.inf, -math.inf
+    for line in lines:
+        reach_up = max([blur * _BLUR_REACH - y for _, y, blur, _ in line['shadows']] + [0])
+        reach_down = max([blur * _BLUR_REACH + y for _, y, blur, _ in line['shadows']] + [0])
+        top = min(top, line['top'] - reach_up)
+        bottom = max(bottom, line['bottom'] + reach_down)
+        if line['bg_box']:
+            top = min(top, line['bg_box'][1])
+            bottom = max(bottom, line['bg_box'][3])
+    return top, bottom
+
+
+def render_text_drawing(texts, styles, font_paths, img_width, start_y, prewrapped=False):
+    """
+    把文字图层转换为绘制操作：背景块的矩形，以及描边/阴影和文字的灰度蒙版
+
+    蒙版只计算一次，可以整张绘制到图层上 (render_text_layer)，也可以逐个条带绘制后
+    直接合成 (composite_drawing)，两种方式的结果完全一致。
+
+    Args:
+        start_y: 文字块起始纵坐标的小数部分 (0 <= start_y < 1)，整数部分在合成时再加上
+
+    Returns:
+        TextDrawing 或 None: 没有文字时返回 None
+    """
+    lines = layout_lines(texts, styles, font_paths, img_width, start_y, prewrapped)
+    if not lines:
+        return None
+
+    top, bottom = _vertical_extent(lines)
+    offset_y = math.floor(top) - _LAYER_PADDING
+    size = (img_width, max(1, math.ceil(bottom) + _LAYER_PADDING - offset_y))
+
+    ops = []
+    for line_num, line in enumerate(lines, 1):
+        draw_y = line['draw_y'] - offset_y
+
+        if line['bg_box']:
+            # 图层内的纵坐标都是正数，预先取整后逐条带平移仍与整张绘制一致
+            x0, y0, x1, y1 = line['bg_box']
+            ops.append(('rectangle', (x0, math.floor(y0 - offset_y), x1, math.floor(y1 - offset_y)),
+                        line['background_color']))
+
+        ops.extend(_line_ops(size, line, line['draw_x'], draw_y, line_num))
+
+    return TextDrawing(size, offset_y, tuple(ops))
+
+
+def _paint(draw, ops, top=0, height=None):
+    """执行绘制操作；top/height 指定只绘制图层中的某个条带，坐标相应平移"""
+    for kind, (x, y, *rest), value in ops:
+        if kind == 'rectangle':
+            if height is not None and (rest[1] < top or y >= top + height):
+                continue
+            draw.rectangle([x, y - top, rest[0], rest[1] - top], fill=value)
+        else:
+            mask, color = value
+            if height is not None and (y + mask.height <= top or y >= top + height):
+                continue
+            draw.bitmap((x, y - top), mask, fill=color)
+
+
+def render_text_layer(texts, styles, font_paths, img_width, start_y, prewrapped=False):
+    """
+    渲染文字图层
+
+    Args:
+        start_y: 文字块起始纵坐标的小数部分 (0 <= start_y < 1)，整数部分在合成时再加上
+
+    Returns:
+        tuple: (layer, offset_y)，layer 为图片宽度的 RGBA 图层，
+               offset_y 为图层顶部相对文字块起始位置 (取整后) 的纵向偏移
+    """
+    drawing = render_text_drawing(texts, styles, font_paths, img_width, start_y, prewrapped)
+    if drawing is None:
+        return None, 0
+
+    layer = Image.new('RGBA', drawing.size, (0, 0, 0, 0))
+    with instrumentation.span('paint'):
+        _paint(ImageDraw.Draw(layer), drawing.ops)
+    return layer, drawing.offset_y
+
+
+def _shadow_runs(shadows):
+    """把相邻、同色的阴影归为一组，保持原有的绘制顺序"""
+    runs = []
+    for shadow_x, shadow_y, blur, color in shadows:
+        if runs and runs[-1][0] == color:
+            runs[-1][1].append((shadow_x, shadow_y, blur))
+        else:
+            runs.append((color, [(shadow_x, shadow_y, blur)]))
+    return runs
+
+
+def _rasterize(size, line, x, y):
+    """
+    把一行文字光栅化为灰度蒙版
+
+    优先用字形图集拼接，蒙版只覆盖文字所在的区域 (并裁剪到图层范围内)；
+    图集不适用时用 draw.text 在整个图层大小的蒙版上绘制。
+
+    Returns:
+        tuple: (mask, origin)，origin 为蒙版左上角在图层中的坐标，没有墨迹时 mask 为 None
+    """
+    masks = glyph_atlas.line_masks(line['font'], line['text'], (x, y), align="center")
+    if masks is None:
+        mask = Image.new('L', size, 0)
+        ImageDraw.Draw(mask).text((x, y), line['text'], font=line['font'], fill=255, align="center")
+        return mask, (0, 0)
+    if not masks:
+        return None, (0, 0)
+    if len(masks) == 1:
+        (left, top), line_mask = masks[0]
+        if left >= 0 and top >= 0 and left + line_mask.width <= size[0] and top + line_mask.height <= size[1]:
+            return line_mask, (left, top)
+
+    # 多行文字逐行叠加 (与 draw.text 相同)，并裁剪到图层范围内
+    left = max(0, min(origin[0] for origin, _ in masks))
+    top = max(0, min(origin[1] for origin, _ in masks))
+    right = min(size[0], max(origin[0] + m.width for origin, m in masks))
+    bottom = min(size[1], max(origin[1] + m.height for origin, m in masks))
+    if right <= left or bottom <= top:
+        return None, (0, 0)
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    mask_draw = ImageDraw.Draw(mask)
+    for origin, line_mask in masks:
+        mask_draw.bitmap((origin[0] - left, origin[1] - top), line_mask, fill=255)
+    return mask, (left, top)
+
+
+def _line_ops(size, line, x, y, line_num=None):
+    """
+    把一行文字及其描边/阴影转换为绘制操作
+
+    字形由字形图集拼接 (或光栅化一次) 得到灰度蒙版，描边/阴影由蒙版平移得到：
+    同色的多个 0 模糊阴影 (常见的 "四方向阴影 = 描边" 写法) 用 screen 叠加成
+    一张蒙版后一次填充，与逐个绘制的叠加效果一致；有模糊半径的阴影对平移后的
+    蒙版做高斯模糊 (sigma = blur / 2，与浏览器一致)。
+
+    Returns:
+        list: ('bitmap', 左上角坐标, (蒙版, 颜色)) 形式的绘制操作
+    """
+    if not line['shadows']:
+        with instrumentation.span('text', line=line_num):
+            masks = glyph_atlas.line_masks(line['font'], line['text'], (x, y), align="center")
+            if masks is None:
+                mask, origin = _rasterize(size, line, x, y)
+                masks = [(origin, mask)] if mask is not None else []
+        return [('bitmap', origin, (mask, line['color'])) for origin, mask in masks]
+
+    # --- 光栅化字形蒙版，只保留文字周围需要的区域 ---
+    with instrumentation.span('rasterize', line=line_num):
+        mask, mask_origin = _rasterize(size, line, x, y)
+        ink_box = mask.getbbox() if mask is not None else None
+    if ink_box is None:
+        return []
+    ink_box = (ink_box[0] + mask_origin[0], ink_box[1] + mask_origin[1],
+               ink_box[2] + mask_origin[0], ink_box[3] + mask_origin[1])
+    reach = max(max(abs(sx), abs(sy)) + math.ceil(blur * _BLUR_REACH) for sx, sy, blur, _ in line['shadows'])
+    region = (
+        max(0, ink_box[0] - reach),
+        max(0, ink_box[1] - reach),
+        min(size[0], ink_box[2] + reach),
+        min(size[1], ink_box[3] + reach),
+    )
+    glyphs = mask.crop((region[0] - mask_origin[0], region[1] - mask_origin[1],
+                        region[2] - mask_origin[0], region[3] - mask_origin[1]))
+    origin = region[:2]
+
+    # --- 描边/阴影 ---
+    ops = []
+    with instrumentation.span('shadow', line=line_num, count=len(line['shadows'])):
+        for color, offsets in _shadow_runs(line['shadows']):
+            combined = None
+            for shadow_x, shadow_y, blur in offsets:
+                shifted = Image.new('L', glyphs.size, 0)
+                shifted.paste(glyphs, (shadow_x, shadow_y))
+                if blur > 0:
+                    shifted = shifted.filter(ImageFilter.GaussianBlur(blur / 2))
+                combined = shifted if combined is None else ImageChops.screen(combined, shifted)
+            ops.append(('bitmap', origin, (combined, color)))
+
+    # --- 主文字 ---
+    ops.append(('bitmap', origin, (glyphs, line['color'])))
+    return ops
+
+
+def _layer_key(texts, styles, font_paths, img_width, start_frac, prewrapped):
+    return (
+        tuple(texts),
+        prewrapped,
+        styles,
+        tuple(sorted(font_paths.items())),
+        img_width,
+        round(start_frac, 6),
+    )
+
+
+def _block_start(img_width, img_height):
+    """文字块起始纵坐标的整数部分和小数部分"""
+    scale_factor = img_width / REFERENCE_WIDTH
+    start_y = img_height / 2 - (150 * scale_factor)
+    base_y = math.floor(start_y)
+    return base_y, start_y - base_y
+
+
+def _get_cached(key, render):
+    """
+    查询图层缓存，未命中时调用 render() 渲染并缓存
+
+    Args:
+        render: 返回 (对象, offset_y, 占用字节数)，没有文字时对象为 None
+
+    Returns:
+        tuple: (对象, offset_y)
+    """
+    global _cache_bytes
+    with _layers_lock:
+        cached = _layers.get(key)
+        if cached is not None:
+            _layers.move_to_end(key)
+            _stats['hits'] += 1
+            instrumentation.count('layer_cache_hits')
+            return cached[0], cached[1]
+        _stats['misses'] += 1
+    instrumentation.count('layer_cache_misses')
+
+    value, offset_y, entry_bytes = render()
+    if value is None:
+        return None, 0
+
+    with _layers_lock:
+        if entry_bytes <= _max_bytes and key not in _layers:
+            _layers[key] = (value, offset_y, entry_bytes)
+            _cache_bytes += entry_bytes
+            while _cache_bytes > _max_bytes:
+                _, (_, _, old_bytes) = _layers.popitem(last=False)
+                _cache_bytes -= old_bytes
+                _stats['evictions'] += 1
+    return value, offset_y
+
+
+def get_text_layer(texts, styles, font_paths, img_width, img_height, prewrapped=False):
+    """
+    获取文字图层，命中缓存时不再重新渲染
+
+    Returns:
+        tuple: (layer, dest_y)，layer 为 RGBA 图层 (可能为 None)，
+               dest_y 为图层在目标图片中的纵坐标 (可能为负数)
+    """
+    base_y, start_frac = _block_start(img_width, img_height)
+
+    def render():
+        layer, offset_y = render_text_layer(texts, styles, font_paths, img_width, start_frac, prewrapped)
+        return layer, offset_y, layer.width * layer.height * 4 if layer else 0
+
+    key = _layer_key(texts, styles, font_paths, img_width, start_frac, prewrapped)
+    layer, offset_y = _get_cached(key, render)
+    return layer, base_y + offset_y
+
+
+def get_text_drawing(texts, styles, font_paths, img_width, img_height, prewrapped=False):
+    """
+    获取文字图层的绘制操作 (见 render_text_drawing)，命中缓存时不再重新计算蒙版
+
+    缓存的只是文字和阴影的灰度蒙版，比整张 RGBA 图层小得多，适合超大背景的分块渲染。
+
+    Returns:
+        tuple: (drawing, dest_y)，drawing 为 TextDrawing (可能为 None)，
+               dest_y 为图层在目标图片中的纵坐标 (可能为负数)
+    """
+    base_y, start_frac = _block_start(img_width, img_height)
+
+    def render():
+        drawing = render_text_drawing(texts, styles, font_paths, img_width, start_frac, prewrapped)
+        if drawing is None:
+            return None, 0, 0
+        masks_bytes = sum(value[0].width * value[0].height for kind, _, value in drawing.ops if kind == 'bitmap')
+        return drawing, drawing.offset_y, masks_bytes + len(drawing.ops) * _OP_OVERHEAD
+
+    key = ('drawing',) + _layer_key(texts, styles, font_paths, img_width, start_frac, prewrapped)
+    drawing, offset_y = _get_cached(key, render)
+    return drawing, base_y + offset_y
+
+
+def composite_drawing(image, drawing, dest_y, tile_rows):
+    """
+    按条带把文字图层原地合成到 RGB 或 RGBA 图片上，不生成整张图层
+
+    每个条带只有 tile_rows 行：在条带大小的透明图层上执行绘制操作，再合成其中有内容的部分。
+    结果与 get_text_layer + composite_layer 完全一致，临时内存与条带大小成正比。
+    """
+    if drawing is None:
+        return image
+    top = max(0, dest_y)
+    bottom = min(image.height, dest_y + drawing.size[1])
+    for row in range(top, bottom, tile_rows):
+        height = min(tile_rows, bottom - row)
+        strip = Image.new('RGBA', (drawing.size[0], height), (0, 0, 0, 0))
+        with instrumentation.span('paint'):
+            _paint(ImageDraw.Draw(strip), drawing.ops, row - dest_y, height)
+        box = strip.getbbox()
+        if box is not None:
+            image_io.alpha_composite(image, strip, dest=(box[0], row + box[1]), source=box)
+    return image
+
+
+def composite_layer(image, layer, dest_y):
+    """把文字图层原地合成到 RGB 或 RGBA 图片上，超出图片范围的部分被裁掉"""
+    if layer is None:
+        return image
+    src_top = max(0, -dest_y)
+    src_bottom = min(layer.height, image.height - dest_y)
+    if src_bottom <= src_top:
+        return image
+    return image_io.alpha_composite(image, layer, dest=(0, dest_y + src_top),
+                                    source=(0, src_top, layer.width, src_bottom))
+
+
+def set_max_bytes(max_bytes):
+    """调整图层缓存的容量 (字节)，多余的图层会立即被淘汰"""
+    global _max_bytes, _cache_bytes
+    with _layers_lock:
+        _max_bytes = max(0, int(max_bytes))
+        while _layers and _cache_bytes > _max_bytes:
+            _, (_, _, old_bytes) = _layers.popitem(last=False)
+            _cache_bytes -= old_bytes
+            _stats['evictions'] += 1
+
+
+def cache_info():
+    """返回图层缓存统计：命中、未命中、淘汰次数、缓存图层数和占用字节数"""
+    with _layers_lock:
+        info = dict(_stats)
+        info['size'] = len(_layers)
+        info['bytes'] = _cache_bytes
+        info['max_bytes'] = _max_bytes
+    return info
+
+
+def clear():
+    """清空图层缓存和统计"""
+    global _cache_bytes
+    with _layers_lock:
+        _layers.clear()
+        _cache_bytes = 0
+        for key in _stats:
+            _stats[key] = 0
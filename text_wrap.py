@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文字换行模块
+按最大像素宽度对一行文字进行自动换行，供 stable_script.create_cover 使用。
+
+与逐字调用 draw.textbbox(current_line + char) 的做法不同，这里对每个排版单元
+(一个汉字、一个英文单词或一段空白) 只测量一次并按 (字体, 字号) 缓存，
+行宽通过累加前进宽度增量计算，整体复杂度为线性。
+
+换行规则：
+- 英文单词/数字不会从中间断开，除非单词本身比一整行还宽
+- 避头：句末标点 (，。！？ 等) 不会出现在行首
+- 避尾：开括号、开引号 (（《“ 等) 不会出现在行尾
+- 换行处的空格会被去掉
+"""
+
+import re
+
+import instrumentation
+
+# 不允许出现在行首的字符 (避头)
+NO_LINE_START = set(
+    '，。、；：？！…—～·）》」』】〕〉’”%‰℃'
+    ',.;:?!)]}>\'"'
+    'ぁぃぅぇぉっゃゅょァィゥェォッャュョー'
+)
+
+# 不允许出现在行尾的字符 (避尾)
+NO_LINE_END = set('（《「『【〔〈‘“([{<')
+
+# 英文单词、数字等需要整体排版的连续字符；其余字符各自成为一个单元
+_UNIT_PATTERN = re.compile(r"[A-Za-z0-9À-ɏ'’\-_.@#&+/]+|\s+|.", re.S)
+
+# 每个 (字体, 字号) 一张表: 单元文字 -> (前进宽度, 墨迹右边界)
+_metrics_cache = {}
+_MAX_CACHED_FONTS = 64
+
+
+def _font_key(font):
+    path = getattr(font, 'path', None)
+    if path is None:
+        return id(font)
+    return (path, getattr(font, 'size', None), getattr(font, 'index', 0))
+
+
+def _get_metrics_table(font):
+    key = _font_key(font)
+    table = _metrics_cache.get(key)
+    if table is None:
+        if len(_metrics_cache) >= _MAX_CACHED_FONTS:
+            _metrics_cache.clear()
+        table = _metrics_cache[key] = {}
+    return table
+
+
+def measure_unit(font, unit, table=None):
+    """
+    测量一个排版单元
+
+    Returns:
+        tuple: (advance, ink_right)，分别为前进宽度和从起点到墨迹右边界的距离
+    """
+    if table is None:
+        table = _get_metrics_table(font)
+    metrics = table.get(unit)
+    if metrics is None:
+        metrics = (font.getlength(unit), font.getbbox(unit)[2])
+        table[unit] = metrics
+        instrumentation.count('glyph_measures')
+    return metrics
+
+
+def split_units(text):
+    """把文字拆分成排版单元：汉字逐字拆分，英文单词和连续空白保持整体"""
+    return _UNIT_PATTERN.findall(text)
+
+
+def wrap_text(text, font, max_width):
+    """
+    将文字按最大像素宽度换行
+
+    Args:
+        text: 待换行的文字
+        font: 已加载的字体对象
+        max_width: 每行允许的最大像素宽度
+
+    Returns:
+        list: 换行后的各行文字
+    """
+    table = _get_metrics_table(font)
+    pending = split_units(text)
+    pending.reverse()
+
+    lines = []
+    current = []        # 当前行的单元
+    line_advance = 0.0  # 当前行已有单元的前进宽度之和
+    protected = 0       # 当前行行首因避头/避尾规则被带过来的单元数，不能再被挪走
+
+    def flush():
+        # 行尾空白不参与排版
+        while current and current[-1].isspace():
+            current.pop()
+        if current:
+            lines.append(''.join(current))
+
+    while pending:
+        unit = pending.pop()
+
+        # 换行后的行首空白直接丢弃
+        if not current and lines and unit.isspace():
+            continue
+
+        advance, ink_right = measure_unit(font, unit, table)
+        if line_advance + ink_right <= max_width or not current:
+            if not current and ink_right > max_width and len(unit) > 1:
+                # 单词比一整行还宽，只能逐字断开
+                pending.extend(reversed(unit))
+                continue
+            current.append(unit)
+            line_advance += advance
+            continue
+
+        # 放不下，需要换行
+        if unit.isspace():
+            flush()
+            current, line_advance, protected = [], 0.0, 0
+            continue
+
+        carried = []
+        keep = max(1, protected)
+        # 避头：标点不能出现在下一行行首，把上一单元一起带到下一行
+        if unit[0] in NO_LINE_START and len(current) > keep:
+            carried.append(current.pop())
+        # 避尾：开括号/开引号不能留在本行行尾
+        while len(current) > keep and current[-1][-1] in NO_LINE_END:
+            carried.append(current.pop())
+
+        if carried and all(u.isspace() for u in current):
+            # 挪走之后本行只剩空白，不如保持原样
+            current.extend(reversed(carried))
+            carried = []
+
+        flush()
+        current, line_advance, protected = [], 0.0, len(carried)
+        pending.append(unit)
+        pending.extend(carried)
+
+    flush()
+    return lines